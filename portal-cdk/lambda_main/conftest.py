@@ -19,6 +19,7 @@ from util.auth import PORTAL_USER_COOKIE, COGNITO_JWT_COOKIE
 from util.labs import BaseLab
 from util.user.user import filter_lab_access, create_lab_structure
 from jwt import decode as unpatched_jwt_decode
+from cryptography.hazmat.primitives import serialization
 
 
 def MockedRequestsPost(*args, **kwargs):
@@ -49,6 +50,74 @@ def mocked_requests_post() -> MockedRequestsPost:
     return MockedRequestsPost
 
 
+@pytest.fixture(autouse=True)
+def clear_secret_cache():
+    # Secrets are cached for a long time, don't let them leak between tests:
+    from util.auth import SSO_SECRET
+
+    SSO_SECRET.clear()
+    yield
+    SSO_SECRET.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_user_identity_map():
+    # Each test gets a fresh DB, so don't hand out Users from the last one:
+    from util.user import clear_identity_map
+
+    clear_identity_map()
+    yield
+    clear_identity_map()
+
+
+@pytest.fixture(autouse=True)
+def clear_hub_auth_cache():
+    from portal.hub import HUB_AUTH_CACHE
+
+    HUB_AUTH_CACHE.clear()
+    yield
+    HUB_AUTH_CACHE.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_lab_health_cache():
+    from util.labs.health import clear_lab_health
+
+    clear_lab_health()
+    yield
+    clear_lab_health()
+
+
+@pytest.fixture(autouse=True)
+def clear_fragment_cache():
+    from util.format import FRAGMENT_CACHE
+
+    FRAGMENT_CACHE.clear()
+    yield
+    FRAGMENT_CACHE.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_lab_catalog():
+    # A saved catalog replaces LABS in place, put the built-in one back:
+    import util.labs.catalog
+
+    yield
+    util.labs.catalog._CATALOG_TABLE = None
+    if util.labs.catalog.LAB_CATALOG.version != 0:
+        util.labs.catalog.LAB_CATALOG.reset()
+
+
+@pytest.fixture(autouse=True)
+def clear_ip_logs_query_cache():
+    # Each test gets a fresh CloudWatch, don't reuse query results from the last one:
+    from util.user_ip_logs_stream import IP_LOGS_QUERY_CACHE
+
+    IP_LOGS_QUERY_CACHE.clear()
+    yield
+    IP_LOGS_QUERY_CACHE.clear()
+
+
 @pytest.fixture
 def fake_get_secret(monkeypatch):
     # Override signing key
@@ -114,6 +183,9 @@ class Helpers:
         if body:
             ret_event["body"] = body
 
+        if headers:
+            ret_event["headers"] = headers
+
         for name, value in cookies.items():
             ret_event["cookies"].append(f"{name}={value}")
 
@@ -178,6 +250,9 @@ class Helpers:
                 2024, 1, 1, 12, 0, 0
             ).strftime("%Y-%m-%d %H:%M:%S")
 
+        def record_activity(self) -> None:
+            pass
+
         def is_admin(self) -> bool:
             return "admin" in self.access
 
@@ -244,6 +319,15 @@ class Helpers:
         ),
     }
 
+    # The lab token secret's value for a key:
+    @staticmethod
+    def private_key_to_pem(private_key) -> str:
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        ).decode("utf-8")
+
     # Raises a given error, used for monkeypatching
     # set kwarg "error" to your error
     @staticmethod
@@ -0,0 +1,34 @@
+"""Scheduled Lambda that checks every lab and records the results, see util/labs/health_history.py"""
+
+import os
+
+from util.labs import LABS
+from util.labs.catalog import refresh_lab_catalog
+from util.labs.health import probe_labs
+from util.labs.health_history import record_health_checks
+from util.user import clear_identity_map
+
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+# Unlike page loads, nobody is waiting on this, so give labs time to answer:
+LAB_HEALTH_MONITOR_TIMEOUT = float(os.getenv("LAB_HEALTH_MONITOR_TIMEOUT", "2"))
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    refresh_lab_catalog()
+    try:
+        results = probe_labs(LABS.values(), timeout=LAB_HEALTH_MONITOR_TIMEOUT)
+        status = record_health_checks(results)
+    finally:
+        # Users loaded this invoke shouldn't leak into the next one:
+        clear_identity_map()
+
+    unhealthy = [name for name, result in status.items() if not result["healthy"]]
+    if unhealthy:
+        logger.warning({"unhealthy_labs": unhealthy, "status": status})
+    else:
+        logger.info(f"All {len(status)} labs healthy")
+    return {"labs": len(status), "unhealthy": unhealthy}
@@ -12,8 +12,12 @@ from util.format import (
     portal_template,
     request_context_string,
     render_template,
+    warm_templates,
 )
 from util.responses import wrap_response
+from util.pages import landing_page, error_page, ANONYMOUS_PAGE_STATUS
+from util.reference_data import warm_reference_data
+from util.labs.catalog import refresh_lab_catalog
 from util.auth import (
     parse_token,
     validate_code,
@@ -21,12 +25,14 @@ from util.auth import (
     delete_cookies,
     revoke_refresh_token,
     refresh_map_del,
+    SSO_SECRET,
 )
 from util.exceptions import GenericFatalError
+from util.post_response import start_post_response_extension, request_finished
 from util.session import current_session
-from util.user import User
+from util.user import User, clear_identity_map
 
-from static import get_static_object
+from static import get_static_object, warm_assets
 
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.event_handler import APIGatewayHttpResolver
@@ -46,6 +52,18 @@ logger = Logger(log_uncaught_exceptions=should_debug)
 # debug: https://docs.powertools.aws.dev/lambda/python/latest/core/event_handler/api_gateway/#debug-mode
 app = APIGatewayHttpResolver(debug=should_debug)
 
+# Pay for the SSO secret fetch during init, not during the first request:
+SSO_SECRET.prefetch()
+
+# Templates, static assets and reference data are loaded once per container,
+# might as well be now:
+warm_templates()
+warm_assets()
+warm_reference_data()
+
+# Lets us send IP logs (and other bookkeeping) after the response goes out:
+start_post_response_extension()
+
 #####################
 ### Swagger Stuff ###
 #####################
@@ -72,34 +90,22 @@ for prefix, router in routes.items():
 
 @app.get("/", include_in_schema=False)
 def root():
-    # Forward to portal if they are logged in
-    if current_session.user:
+    # Forward to portal if they have a session cookie. Don't validate it here,
+    # /portal does that, and sends them back (w/out cookies) if it's bad.
+    if current_session.auth.cognito.raw:
         return wrap_response(
             body="Redirecting to Portal",
             headers={"Location": "/portal"},
             code=302,
         )
 
-    return wrap_response(
-        render_template(
-            content="Welcome to OpenScienceLab",
-            title="OpenScienceLab",
-            name="landing.j2",
-        )
-    )
+    return wrap_response(landing_page())
 
 
 # This endpoint exists primarily for dumping to html
 @app.get("/error", include_in_schema=False)
 def error():
-    return wrap_response(
-        render_template(
-            content="An unexpected error has occurred",
-            name="error.j2",
-            title="OpenScienceLab: Something went wrong",
-        ),
-        code=401,
-    )
+    return wrap_response(error_page(), code=ANONYMOUS_PAGE_STATUS["/error"])
 
 
 @app.get("/logout", include_in_schema=False)
@@ -224,4 +230,12 @@ def handle_generic_fatal_error(exception):
 @process_auth
 def lambda_handler(event, context):
     current_session.app = app  # Pass app into downstream functions
-    return app.resolve(event, context)
+    # Cheap unless it's been LAB_CATALOG_TTL since the last check:
+    refresh_lab_catalog()
+    try:
+        return app.resolve(event, context)
+    finally:
+        # Users loaded this request shouldn't leak into the next one, no matter
+        # which code path loaded them:
+        clear_identity_map()
+        request_finished()
@@ -0,0 +1,40 @@
+"""
+Runs a user table backfill, see util/user/migrations.py. Invoked by hand:
+
+    aws lambda invoke --function-name <UserMigrations function> \
+        --payload '{"migration": "activity"}' out.json
+
+Each invoke does up to `pages` scan pages. Until it returns `"next": null`, invoke
+it again with `"start": <next>`.
+"""
+
+from util.responses import decode_token, encode_token
+from util.user import clear_identity_map
+from util.user.migrations import MIGRATIONS, run_migration
+
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+# Scan pages per invoke, so one stays well inside the Lambda timeout:
+MIGRATION_PAGES = 10
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    name = event.get("migration")
+    if name not in MIGRATIONS:
+        raise ValueError(
+            f"Unknown migration {name!r}, expected one of {list(MIGRATIONS)}"
+        )
+
+    try:
+        updated, start_key = run_migration(
+            name,
+            pages=int(event.get("pages", MIGRATION_PAGES)),
+            start_key=decode_token(event.get("start"), "start"),
+        )
+    finally:
+        # Users loaded this invoke shouldn't leak into the next one:
+        clear_identity_map()
+    return {"migration": name, "updated": updated, "next": encode_token(start_key)}
@@ -3,10 +3,12 @@ from portal.access import access_route
 from portal.hub import hub_route
 from portal.users import users_route
 from portal.mfa import mfa_route
-from util.format import portal_template, jinja_template
+import util.labs
+from util.format import portal_template, jinja_template, render_fragment
 from util.auth import require_access
 from util.session import current_session
 from util.user import User
+from util.labs.health import get_lab_health
 
 from aws_lambda_powertools.event_handler.api_gateway import Router
 from aws_lambda_powertools import Logger
@@ -42,6 +44,37 @@ for route in (
 require_access.router = portal_router
 
 
+def _render_lab_cards(lab_access_info: dict, lab_health: dict, admin: bool) -> list:
+    lab_cards = []
+    # Labs the user can use go first:
+    for labname, access in sorted(
+        lab_access_info["lab_access"].items(),
+        key=lambda item: item[1]["can_user_access_lab"],
+        reverse=True,
+    ):
+        if not access["can_user_see_lab"]:
+            continue
+        lab = lab_access_info["viewable_labs_config"][labname]
+        accessable = access["can_user_access_lab"]
+        healthy = lab_health[labname]
+        # Everything the card depends on. The lab config itself is covered by
+        # the config version:
+        key = (util.labs.LABS_VERSION, labname, accessable, healthy, admin)
+        lab_cards.append(
+            render_fragment(
+                "lab_card.j2",
+                key,
+                {
+                    "lab": lab,
+                    "accessable": accessable,
+                    "healthy": healthy,
+                    "admin": admin,
+                },
+            )
+        )
+    return lab_cards
+
+
 @portal_router.get("", include_in_schema=False)
 @require_access(human=True)
 @portal_template()
@@ -54,8 +87,8 @@ def portal_root():
     # Filter by labs the user has access to
     lab_access_info = user.get_lab_access()
 
-    # Add labs to page_dict
-    template_input["labs"] = lab_access_info
+    # Checked concurrently (and cached), not one at a time while rendering:
+    lab_health = get_lab_health(lab_access_info["viewable_labs_config"].values())
 
     ## Curently missing ##
     ## Lab ordering
@@ -65,4 +98,10 @@ def portal_root():
     # Add admin check to formatting
     template_input["admin"] = user.is_admin()
 
+    # Add labs to page_dict
+    template_input["labs"] = lab_access_info
+    template_input["lab_cards"] = _render_lab_cards(
+        lab_access_info, lab_health, template_input["admin"]
+    )
+
     return jinja_template(template_input, "portal.j2")
@@ -1,14 +1,40 @@
 import json
+import time
 from dataclasses import asdict
 
+from boto3.dynamodb.conditions import Attr
+
 from util import swagger
 from util.format import portal_template, jinja_template
 from util.auth import require_access
-from util.user.dynamo_db import get_users_with_lab
+from util.session import current_session
+from util.user.dynamo_db import get_users_with_lab, scan_page
 from util.user.user import filter_lab_access
 from util.user import User
-from util.responses import wrap_response, form_body_to_dict, json_body_to_dict
+from util.responses import (
+    decode_token,
+    encode_token,
+    form_body_to_dict,
+    json_body_to_dict,
+    wrap_response,
+)
 from util.labs import LABS
+from util.labs.batch import UserColumns, get_batch_evaluator
+from util.labs.catalog import (
+    LAB_CATALOG,
+    is_lab_catalog_enabled,
+    lab_from_dict,
+    put_lab,
+    remove_lab,
+)
+from util.labs.compliance import newly_prohibited, sweep_lab
+from util.labs.health_history import (
+    LAB_HEALTH_HISTORY_DAYS,
+    get_health_stats,
+    get_health_status,
+    is_health_monitor_enabled,
+)
+from util.exceptions import EnvironmentNotSet, LabDoesNotExist, MalformedRequest
 
 from aws_lambda_powertools.event_handler.api_gateway import Router
 from aws_lambda_powertools.event_handler import content_types
@@ -292,7 +318,7 @@ def validate_set_lab_access(put_lab_request: dict) -> tuple[bool, str]:
         # Ensure all profiles exist for a given lab
         for profile in put_lab_request["labs"][lab_name]["lab_profiles"]:
             # If the lab doesn't have the profile you're trying to set:
-            if profile not in LABS[lab_name].allowed_profiles:
+            if profile not in LABS[lab_name].allowed_profile_set:
                 return False, f"Profile '{profile}' not allowed for lab {lab_name}"
 
     return True, "Success"
@@ -435,3 +461,348 @@ def delete_user_labs(username):
         code=200 if success else 422,
         content_type=content_types.APPLICATION_JSON,
     )
+
+
+@access_router.get(
+    "/health",
+    description="""
+Returns the current health of every lab, along with its uptime and health check 
+latency percentiles, as recorded by the scheduled lab health monitor.
+
+<hr>
+
+Optional `hours` query parameter picks how much history to use (default 24, up to 
+the retained history).
+    """,
+    response_description="A dict of lab health stats, keyed by lab short name.",
+    responses={
+        **swagger.format_response(
+            example={
+                "labs": {
+                    "<lab_name>": {
+                        "status": {
+                            "healthy": True,
+                            "latency_ms": 42,
+                            "failures": 0,
+                            "checked_at": 1735689600,
+                        },
+                        "checks": 1440,
+                        "uptime": 0.9986,
+                        "latency_ms": {"p50": 40, "p90": 85, "p99": 310},
+                    },
+                },
+                "hours": 24,
+                "message": "OK",
+            },
+            description="Returns lab health stats.",
+            code=200,
+        ),
+        **swagger.code_403,
+    },
+    tags=[access_route["name"]],
+)
+@require_access("admin", human=False)
+def get_labs_health():
+    if not is_health_monitor_enabled():
+        raise EnvironmentNotSet("Lab health monitor is not configured")
+
+    hours = access_router.current_event.query_string_parameters.get("hours", "24")
+    try:
+        hours = int(hours)
+    except ValueError as e:
+        raise MalformedRequest(f"Invalid 'hours' value: {hours}") from e
+    if not 0 < hours <= LAB_HEALTH_HISTORY_DAYS * 24:
+        raise MalformedRequest(
+            f"'hours' must be between 1 and {LAB_HEALTH_HISTORY_DAYS * 24}"
+        )
+
+    since = int(time.time()) - hours * 60 * 60
+    status = get_health_status()
+    labs_health = {
+        short_lab_name: {
+            "status": status.get(short_lab_name),
+            **get_health_stats(short_lab_name, since),
+        }
+        for short_lab_name in LABS
+    }
+
+    return wrap_response(
+        body=json.dumps({"labs": labs_health, "hours": hours, "message": "OK"}),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+# Users read per /report page. Keeps each request well inside API Gateway's timeout:
+ACCESS_REPORT_PAGE_SIZE = 2000
+
+
+@access_router.get(
+    "/report",
+    description="""
+Effective lab access for every user: how many members each lab has, and how many of 
+them can see it, can use it, or are blocked by their country.
+
+<hr>
+
+The user table is read one page per request. Counts are for that page, so add them 
+up, passing `next` from each response back in, until `next` is null.
+
+Optional `lab` query parameter also lists that lab's members (in the page), with 
+whether each one can use it.
+    """,
+    response_description="Per-lab access counts for one page of users.",
+    responses={
+        **swagger.format_response(
+            example={
+                "labs": {
+                    "<lab_name>": {
+                        "members": 120,
+                        "visible": 2000,
+                        "accessible": 118,
+                        "geo_blocked": 2,
+                    },
+                },
+                "users": 2000,
+                "members": [
+                    {"username": "user1", "accessible": True, "geo_blocked": False},
+                ],
+                "next": "<page cursor>",
+                "message": "OK",
+            },
+            description="Returns one page of the access report.",
+            code=200,
+        ),
+        **swagger.code_403,
+        **swagger.code_404_lab_not_found,
+    },
+    tags=[access_route["name"]],
+)
+@require_access("admin", human=False)
+def get_access_report():
+    params = access_router.current_event.query_string_parameters
+    lab_name = params.get("lab")
+    filterexpr = None
+    if lab_name:
+        if lab_name not in LABS:
+            raise LabDoesNotExist(f'"{lab_name}" lab does not exist')
+        filterexpr = Attr(f"labs.{lab_name}").exists()
+
+    items, next_key = scan_page(
+        filterexpr, ACCESS_REPORT_PAGE_SIZE, decode_token(params.get("next"), "next")
+    )
+    evaluator = get_batch_evaluator(LABS)
+    matrix = evaluator.evaluate(UserColumns.from_items(items, evaluator.lab_names))
+
+    out_payload = {
+        "labs": matrix.lab_summary(),
+        "users": len(items),
+        "next": encode_token(next_key),
+        "message": "OK",
+    }
+    if lab_name:
+        out_payload["labs"] = {lab_name: out_payload["labs"][lab_name]}
+        out_payload["members"] = matrix.lab_members(lab_name)
+
+    return wrap_response(
+        body=json.dumps(out_payload),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+@access_router.get(
+    "/catalog",
+    description="Returns the lab catalog, and its version (0 is the built-in catalog).",
+    response_description="The catalog version, and every lab's config.",
+    responses={
+        **swagger.format_response(
+            example={
+                "version": 3,
+                "labs": {"<lab_name>": {"short_lab_name": "<lab_name>"}},
+                "message": "OK",
+            },
+            description="Returns the lab catalog.",
+            code=200,
+        ),
+        **swagger.code_403,
+    },
+    tags=[access_route["name"]],
+)
+@require_access("admin", human=False)
+def get_lab_catalog():
+    # Don't wait out the check interval, an admin editing it wants the latest:
+    LAB_CATALOG.refresh(force=True)
+    return wrap_response(
+        body=json.dumps(
+            {
+                "version": LAB_CATALOG.version,
+                "labs": {name: asdict(lab) for name, lab in LABS.items()},
+                "message": "OK",
+            }
+        ),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+@access_router.put(
+    "/catalog/<shortname>",
+    description="""
+Adds or replaces a lab in the catalog. Takes effect in every portal container within 
+`LAB_CATALOG_TTL` seconds.
+
+<hr>
+
+`version` has to be the catalog version the change is based on (from 
+`GET /portal/access/catalog`), otherwise nothing is saved and a 409 is returned.
+
+New labs also need a deploy, for their CloudFront `/lab/<shortname>/*` behavior.
+
+If the lab now prohibits countries it didn't before, `compliance` lists the members 
+in those countries that lost access (see `POST /portal/access/compliance/<shortname>`).
+    """,
+    response_description="The new catalog version.",
+    responses={
+        **swagger.format_response(
+            example={
+                "version": 4,
+                "compliance": {
+                    "lab": "<lab_name>",
+                    "countries": ["KP"],
+                    "affected": [{"username": "user1", "country_code": "KP"}],
+                    "locked": [],
+                },
+                "message": "OK",
+            },
+            description="Lab saved.",
+            code=200,
+        ),
+        **swagger.format_response(
+            example={"error": "Lab catalog is version 4, not 3"},
+            description="The catalog changed since `version`.",
+            code=409,
+        ),
+        **swagger.code_403,
+    },
+    tags=[access_route["name"]],
+)
+@require_access("admin", human=False)
+def put_catalog_lab(shortname):
+    if not is_lab_catalog_enabled():
+        raise EnvironmentNotSet("Lab catalog is not configured")
+
+    body = json_body_to_dict(access_router.current_event.body)
+    if not isinstance(body.get("version"), int) or not isinstance(
+        body.get("lab"), dict
+    ):
+        raise MalformedRequest("Body must have an int 'version', and a 'lab' dict")
+
+    lab = lab_from_dict(shortname, body["lab"])
+    old_lab = LABS.get(shortname)
+    version = put_lab(lab, body["version"], current_session.user.username)
+
+    out_payload = {"version": version, "message": "OK"}
+    # New labs don't have members yet:
+    countries = newly_prohibited(old_lab, lab) if old_lab else None
+    if countries:
+        out_payload["compliance"] = sweep_lab(shortname, countries)
+
+    return wrap_response(
+        body=json.dumps(out_payload),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+@access_router.delete(
+    "/catalog/<shortname>",
+    description="""
+Removes a lab from the catalog. `version` query parameter works the same as for 
+`PUT /portal/access/catalog/<shortname>`.
+    """,
+    response_description="The new catalog version.",
+    responses={
+        **swagger.format_response(
+            example={"version": 5, "message": "OK"},
+            description="Lab removed.",
+            code=200,
+        ),
+        **swagger.code_403,
+        **swagger.code_404_lab_not_found,
+    },
+    tags=[access_route["name"]],
+)
+@require_access("admin", human=False)
+def delete_catalog_lab(shortname):
+    if not is_lab_catalog_enabled():
+        raise EnvironmentNotSet("Lab catalog is not configured")
+
+    version = access_router.current_event.query_string_parameters.get("version")
+    try:
+        version = int(version)
+    except (TypeError, ValueError) as e:
+        raise MalformedRequest(f"Invalid 'version' value: {version}") from e
+    if shortname not in LABS:
+        raise LabDoesNotExist(f'"{shortname}" lab does not exist')
+
+    version = remove_lab(shortname, version, current_session.user.username)
+    return wrap_response(
+        body=json.dumps({"version": version, "message": "OK"}),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+@access_router.post(
+    "/compliance/<shortname>",
+    description="""
+Finds the members of a lab that can't use it because of their country, by querying 
+only the users in those countries.
+
+<hr>
+
+Optional JSON body:
+- `countries`: only check these country codes (default: all of the lab's prohibited 
+  countries).
+- `lock`: also lock every affected user (default: false).
+    """,
+    response_description="The affected users, and which of them were locked.",
+    responses={
+        **swagger.format_response(
+            example={
+                "lab": "<lab_name>",
+                "countries": ["KP"],
+                "affected": [{"username": "user1", "country_code": "KP"}],
+                "locked": ["user1"],
+                "message": "OK",
+            },
+            description="Sweep finished.",
+            code=200,
+        ),
+        **swagger.code_403,
+        **swagger.code_404_lab_not_found,
+    },
+    tags=[access_route["name"]],
+)
+@require_access("admin", human=False)
+def post_compliance_sweep(shortname):
+    body = access_router.current_event.body
+    body = json_body_to_dict(body) if body else {}
+    if not isinstance(body, dict):
+        raise MalformedRequest("Body must be a JSON object")
+    countries = body.get("countries")
+    if countries is not None and (
+        not isinstance(countries, list)
+        or not all(isinstance(code, str) for code in countries)
+    ):
+        raise MalformedRequest("'countries' must be a list of country codes")
+    if not isinstance(body.get("lock", False), bool):
+        raise MalformedRequest("'lock' must be true or false")
+
+    report = sweep_lab(shortname, countries, lock=body.get("lock", False))
+    return wrap_response(
+        body=json.dumps({**report, "message": "OK"}),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
@@ -1,11 +1,28 @@
 import json
 import base64
+import hashlib
 
+from cachetools import TTLCache
+
+import util.labs
 from util import swagger
 from util import send_email
-from util.responses import wrap_response
+from util.responses import etag_matches, wrap_response
 from util.format import portal_template
-from util.auth import encrypt_data, require_access
+from util.auth import SSO_SECRET, encrypt_data, require_access
+from util.exceptions import (
+    BadLabToken,
+    LabDoesNotExist,
+    UserIsNotAuthorized,
+)
+from util.lab_token import (
+    LAB_TOKEN_TTL,
+    get_jwks,
+    issue_lab_token,
+    lab_token_cookie,
+    lab_token_version,
+    read_lab_token,
+)
 from util.session import current_session
 from util.user import User
 
@@ -23,6 +40,29 @@ hub_route = {
 
 logger = Logger(child=True)
 
+# Encrypted hub auth payloads per username, as (etag, payload). Labs call
+# /portal/hub/auth on every spawn, so during a class this is mostly hits.
+HUB_AUTH_CACHE = TTLCache(maxsize=1000, ttl=15 * 60)
+
+
+def hub_auth_etag(user: User) -> str:
+    """
+    Changes whenever the payload would: the user record changed (_rec_counter),
+    the lab config changed, or the SSO token was rotated.
+    """
+    # Make sure the secret version is current before using it in the key:
+    SSO_SECRET.get()
+    key = ":".join(
+        str(part)
+        for part in (
+            user.username,
+            user._rec_counter,
+            util.labs.LABS_VERSION,
+            SSO_SECRET.version,
+        )
+    )
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
 
 @hub_router.get("/", include_in_schema=False)
 @require_access(human=True)
@@ -67,6 +107,9 @@ Returns an encrypted user profile, used by labs to validate users.
 
 `POST` payload should be a base64 encoded JSON dictionary with a `username` key 
 containing the username of the profile being validated.
+
+Responses include an `ETag`. Send it back as `If-None-Match` to get a `304` 
+if the profile hasn't changed since.
     """,
     response_description="A dict containing encrypted profile information for a user.",
     responses={
@@ -99,6 +142,20 @@ def post_portal_hub_auth():
 
     user = User(username=username, create_if_missing=False)
 
+    etag = hub_auth_etag(user)
+    if etag_matches(hub_router.current_event.headers.get("if-none-match"), etag):
+        logger.debug(f"Hub auth for {username} not modified")
+        return wrap_response(body="", code=304, headers={"ETag": etag})
+
+    cached = HUB_AUTH_CACHE.get(username)
+    if cached and cached[0] == etag:
+        return wrap_response(
+            body=cached[1],
+            code=200,
+            content_type=content_types.APPLICATION_JSON,
+            headers={"ETag": etag},
+        )
+
     data = {
         "admin": user.is_admin(),
         "roles": user.access,
@@ -110,9 +167,143 @@ def post_portal_hub_auth():
         "lab_access": user.get_lab_access()["lab_access"],
     }
     encrypted_data = encrypt_data(data)
+    body = json.dumps({"data": encrypted_data, "message": "OK"})
+    HUB_AUTH_CACHE[username] = (etag, body)
+
+    return wrap_response(
+        body=body,
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+        headers={"ETag": etag},
+    )
+
 
+@hub_router.get("/launch/<lab_short_name>", include_in_schema=False)
+@require_access(human=True)
+def launch_lab(lab_short_name):
+    """
+    "Go to lab" from the portal. Hands the user a signed lab token, scoped to just
+    that lab, so the lab doesn't have to call /portal/hub/auth to know who they are.
+    """
+    login_url = f"/lab/{lab_short_name}/hub/login"
+    user = current_session.user
+
+    lab_access = user.get_lab_access()["lab_access"].get(lab_short_name)
+    if lab_access is None:
+        raise LabDoesNotExist(f"Lab {lab_short_name} does not exist")
+    if not lab_access["can_user_access_lab"]:
+        raise UserIsNotAuthorized(
+            f"User {user.username} does not have access to lab {lab_short_name}"
+        )
+
+    cookies = None
+    try:
+        token = issue_lab_token(user, lab_short_name, lab_access)
+        cookies = [lab_token_cookie(token, lab_short_name)]
+    except Exception as e:
+        # Labs still fall back to /portal/hub/auth without the token:
+        logger.warning(f"Could not issue lab token for {lab_short_name}: {e}")
+
+    return wrap_response(
+        body={"Redirect": login_url},
+        code=302,
+        content_type=content_types.APPLICATION_JSON,
+        headers={"Location": login_url},
+        cookies=cookies,
+    )
+
+
+@hub_router.get(
+    "/jwks.json",
+    description="""
+Public keys (JWKS) used to verify the lab tokens issued by the portal when a user 
+launches a lab. Tokens are `EdDSA` signed JWTs, with the lab's short name as the 
+audience, and the token's `kid` header picks the key. After a key rotation, the 
+previous key is listed too, so tokens it signed still verify until they expire.
+    """,
+    response_description="A JSON Web Key Set.",
+    responses={
+        **swagger.format_response(
+            example={
+                "keys": [
+                    {
+                        "kty": "OKP",
+                        "crv": "Ed25519",
+                        "x": "<public key>",
+                        "kid": "<key id>",
+                        "alg": "EdDSA",
+                        "use": "sig",
+                    }
+                ]
+            },
+            description="Keys to verify lab tokens with.",
+            code=200,
+        ),
+    },
+    tags=[hub_route["name"]],
+)
+def get_lab_token_jwks():
+    return wrap_response(
+        body=get_jwks(),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+        # No longer than a token lives, so labs pick up a rotated key in time:
+        headers={"Cache-Control": f"public, max-age={LAB_TOKEN_TTL}"},
+    )
+
+
+@hub_router.get(
+    "/token/version",
+    description="""
+Current version of a lab token's claims. Labs compare it with the `ver` claim of 
+the token to tell if it's out of date (access or profile changed since it was issued), 
+or `revoked` (user locked), without fetching the whole profile.
+
+<hr>
+
+Requires the lab token as an `Authorization: Bearer <token>` header, and only 
+answers for that token's user.
+    """,
+    response_description="The current version of the user's lab token claims.",
+    responses={
+        **swagger.format_response(
+            example={
+                "username": "<username>",
+                "ver": "0b1c2d3e4f5a6b7c",
+                "revoked": False,
+            },
+            description="Returns the current lab token version for the token's user.",
+            code=200,
+        ),
+        **swagger.format_response(
+            example={
+                "error": "Lab token is not valid: Signature has expired",
+                "extra_info": None,
+            },
+            description="The lab token is missing, expired, or wasn't issued by us.",
+            code=401,
+        ),
+        **swagger.code_404_user_not_found,
+    },
+    tags=[hub_route["name"]],
+)
+def get_lab_token_version():
+    authorization = hub_router.current_event.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise BadLabToken("Missing 'Authorization: Bearer <lab token>' header")
+    claims = read_lab_token(token.strip())
+    username = claims["sub"]
+
+    user = User(username=username, create_if_missing=False)
+    # The version is per lab, like the token's lab_access claim:
+    lab_access = user.get_lab_access()["lab_access"].get(claims.get("aud"))
     return wrap_response(
-        body=json.dumps({"data": encrypted_data, "message": "OK"}),
+        body={
+            "username": username,
+            "ver": lab_token_version(user, lab_access),
+            "revoked": bool(user.is_locked),
+        },
         code=200,
         content_type=content_types.APPLICATION_JSON,
     )
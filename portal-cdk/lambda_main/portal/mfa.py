@@ -11,6 +11,7 @@ import string
 
 from util.responses import wrap_response
 from util.format import render_template
+from util.pages import mfa_request_page
 from util.responses import form_body_to_dict
 from util.cognito import (
     verify_user_password,
@@ -75,17 +76,7 @@ def do_mfa_reset(username):
 
 @mfa_router.get("/", include_in_schema=False)
 def root():
-    req_content = render_template(
-        name="mfa_reset_request.j2", input={"username": "", "warning": ""}, content=""
-    )
-
-    return wrap_response(
-        render_template(
-            content=req_content,
-            title="OpenScienceLab - MFA Reset",
-            name="logged-out.j2",
-        )
-    )
+    return wrap_response(mfa_request_page())
 
 
 @mfa_router.post("/reset", include_in_schema=False)
@@ -95,18 +86,16 @@ def reset_post():
     password = form.get("password")
 
     if not verify_user_password(username, password):
-        req_content = render_template(
-            name="mfa_reset_request.j2",
-            input={"username": username, "warning": "Username or Password not found."},
-            content="",
+        return wrap_response(
+            mfa_request_page(
+                username=username, warning="Username or Password not found."
+            )
         )
-    else:
-        do_mfa_reset(username)
-        req_content = "MFA Reset processed, check your email"
 
+    do_mfa_reset(username)
     return wrap_response(
         render_template(
-            content=req_content,
+            content="MFA Reset processed, check your email",
             title="OpenScienceLab - MFA Reset",
             name="logged-out.j2",
         )
@@ -6,10 +6,9 @@ from util.session import current_session
 from util.user import User
 from util.responses import wrap_response, form_body_to_dict
 from util.labs import LABS
-from util.user_ip_logs_stream import get_user_ip_logs
+from util.reference_data import COUNTRIES
+from util.user_ip_logs_stream import get_recent_user_ips
 
-from pathlib import Path
-import json
 from urllib.parse import urlencode
 from typing import Any
 
@@ -94,7 +93,7 @@ def profile_bob():
 @enforce_profile_access()
 @portal_template(name="profile.j2")
 def profile_user(username: str):
-    user_ip_results = get_user_ip_logs(username=username, limit=5)
+    user_ip_results = get_recent_user_ips(username, limit=5)
 
     user_logged_in = current_session.user
     user_profile = User(username=username, create_if_missing=False)
@@ -107,13 +106,10 @@ def profile_user(username: str):
             "user_ip_results": user_ip_results,
             "default_value": "Choose...",
             "warning_missing": "Value is missing",
+            "countries": COUNTRIES,
         },
     }
 
-    CWD = Path(__file__).parent.resolve().absolute()
-    with open(CWD / "../data/countries.json", "r", encoding="utf-8") as f:
-        page_dict["input"]["countries"] = json.loads(f.read())
-
     # Get query string if present
     query_params = profile_router.current_event.query_string_parameters
 
@@ -1,3 +1,6 @@
+import json
+import time
+import datetime
 import traceback
 
 from util.format import (
@@ -5,15 +8,29 @@ from util.format import (
 )
 from util.auth import require_access
 from util.session import current_session
-from util.user.dynamo_db import get_all_items
+from util.user.dynamo_db import get_all_items, get_usernames_by_email
 from util.format import jinja_template
-from util.responses import wrap_response
-from util.exceptions import CognitoError, DbError
+from util.responses import decode_token, encode_token, wrap_response
+from util.exceptions import CognitoError, DbError, EnvironmentNotSet, MalformedRequest
 from util.user import User
-from util.user_ip_logs_stream import get_user_ip_logs
+from util.user.activity import get_inactive_users
+from util.user_ip_index import (
+    USER_IP_INDEX_DAYS,
+    find_ip_users,
+    is_ip_index_enabled,
+)
+from util.user_ip_logs_stream import (
+    get_user_ip_history,
+    get_user_ip_logs,
+    is_ip_history_enabled,
+    poll_user_ip_logs_query,
+    start_user_ip_logs_query,
+    suggested_retry_after,
+)
 
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.event_handler.api_gateway import Router
+from aws_lambda_powertools.event_handler import content_types
 
 logger = Logger(service="APP", level="DEBUG")
 
@@ -66,6 +83,25 @@ def _user_set_lock(username, lock: bool) -> bool:
     return True
 
 
+# {facet: label} for the filters on the users page (see util/user/indexed.py):
+USER_FACETS = {
+    "admin": "Admins",
+    "locked": "Locked",
+    "profile_update": "Needs profile update",
+    "no_labs": "No labs",
+}
+
+
+def _facets_param() -> list[str]:
+    # Comma separated, like '?facets=admin,locked':
+    value = users_router.current_event.query_string_parameters.get("facets", "")
+    facets = [facet for facet in value.split(",") if facet]
+    for facet in facets:
+        if facet not in USER_FACETS:
+            raise MalformedRequest(f"Unknown facet '{facet}'")
+    return facets
+
+
 @users_router.get("", include_in_schema=False)
 @require_access("admin", human=True)
 @portal_template()
@@ -75,11 +111,14 @@ def users_root():
     success = users_router.current_event.query_string_parameters.get("success", "false")
     username = users_router.current_event.query_string_parameters.get("username")
     user_filter = users_router.current_event.query_string_parameters.get("filter")
+    facets = _facets_param()
 
     row_limit = 200
 
     # Fetch all users
-    all_users = get_all_items(limit=row_limit, username_filter=user_filter)
+    all_users = get_all_items(
+        limit=row_limit, username_filter=user_filter, facets=facets
+    )
     all_users_sorted = sorted(all_users, key=lambda x: x["username"])
 
     template_input = {
@@ -89,12 +128,44 @@ def users_root():
         "username": username,
         "rowcount": len(all_users_sorted),
         "exceeded": len(all_users_sorted) >= row_limit,
+        "facets": facets,
+        "all_facets": USER_FACETS,
     }
 
     # Generate an HTML table
     return jinja_template(template_input, "user-table.j2")
 
 
+@users_router.get("/list", include_in_schema=True)
+@require_access("admin", human=False)
+def get_users_list():
+    """
+    Users as JSON, like the users page: optional `filter` (username substring) and
+    `facets` (comma separated, any of admin, locked, profile_update, no_labs).
+    """
+    params = users_router.current_event.query_string_parameters
+    try:
+        limit = min(max(int(params.get("limit", 200)), 1), 1000)
+    except ValueError as e:
+        raise MalformedRequest("'limit' must be a number") from e
+
+    users = get_all_items(
+        limit=limit, username_filter=params.get("filter"), facets=_facets_param()
+    )
+    return wrap_response(
+        body=json.dumps(
+            {
+                "users": sorted(users, key=lambda x: x["username"]),
+                "exceeded": len(users) >= limit,
+                "message": "OK",
+            },
+            default=str,
+        ),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
 @users_router.post("/unlock/<username>", include_in_schema=False)
 @require_access("admin", human=True)
 def unlock_user(username):
@@ -152,6 +223,11 @@ def delete_user(username):
 @users_router.get("/info", include_in_schema=True)
 @require_access("admin", human=False)
 def get_user_ip_info():
+    """
+    IP log events, from CloudWatch Logs Insights. Waits for the query to finish,
+    unless `async=true`: then it returns a `handle` right away, for
+    `/portal/users/info/results`.
+    """
     username: str | None = users_router.current_event.query_string_parameters.get(
         "username", None
     )
@@ -164,11 +240,25 @@ def get_user_ip_info():
     limit: str | None = users_router.current_event.query_string_parameters.get(
         "limit", None
     )
+    # Checked here, since the history table doesn't go through the Insights query:
+    try:
+        limit = int(limit) if limit else None
+    except ValueError as e:
+        raise MalformedRequest("'limit' must be a number") from e
+    if limit is not None and not 0 <= limit <= 10000:
+        raise MalformedRequest("'limit' must be between 0 and 10000")
+
+    if users_router.current_event.query_string_parameters.get("async") == "true":
+        return _start_user_ip_info(username, start_date, end_date, limit)
 
     try:
-        results = get_user_ip_logs(
-            username=username, start_date=start_date, end_date=end_date, limit=limit
-        )
+        # Just a user's latest IPs can come from the history table, in milliseconds:
+        if username and not start_date and not end_date and is_ip_history_enabled():
+            results = get_user_ip_history(username, limit=limit or 100)
+        else:
+            results = get_user_ip_logs(
+                username=username, start_date=start_date, end_date=end_date, limit=limit
+            )
     except Exception:
         logger.error(traceback.print_exc())
         return wrap_response(
@@ -180,3 +270,165 @@ def get_user_ip_info():
         body=results,
         code=200,
     )
+
+
+def _ip_info_response(query: dict, response: dict) -> dict:
+    return wrap_response(
+        body=json.dumps(
+            {
+                "handle": encode_token(
+                    {"query_id": query["query_id"], "started_at": query["started_at"]}
+                ),
+                "status": response["status"],
+                "complete": response["complete"],
+                "results": response["results"],
+                # Seconds to wait before asking for results again:
+                "retry_after": (
+                    None
+                    if response["complete"]
+                    else suggested_retry_after(query["started_at"])
+                ),
+                "message": "OK",
+            }
+        ),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+def _start_user_ip_info(username, start_date, end_date, limit):
+    try:
+        query = start_user_ip_logs_query(
+            username=username, start_date=start_date, end_date=end_date, limit=limit
+        )
+    except ValueError as e:
+        raise MalformedRequest(str(e)) from e
+
+    # Same lookup again, and it already finished:
+    if "results" in query:
+        response = {
+            "status": query["status"],
+            "complete": True,
+            "results": query["results"],
+        }
+    else:
+        response = {"status": "Running", "complete": False, "results": []}
+    return _ip_info_response(query, response)
+
+
+@users_router.get("/info/results", include_in_schema=True)
+@require_access("admin", human=False)
+def get_user_ip_info_results():
+    """
+    Results so far for a `handle` from `/portal/users/info?async=true`. Partial
+    until `complete`; ask again after `retry_after` seconds.
+    """
+    query = decode_token(
+        users_router.current_event.query_string_parameters.get("handle"), "handle"
+    )
+    if not query or "query_id" not in query or "started_at" not in query:
+        raise MalformedRequest("'handle' query parameter is required")
+
+    return _ip_info_response(query, poll_user_ip_logs_query(query["query_id"]))
+
+
+def _date_to_timestamp(value: str, name: str) -> int:
+    try:
+        date = datetime.date.fromisoformat(value)
+    except ValueError as e:
+        raise MalformedRequest(f"'{name}' must be a YYYY-MM-DD date") from e
+    return int(
+        datetime.datetime.combine(date, datetime.time(), datetime.UTC).timestamp()
+    )
+
+
+@users_router.get("/inactive", include_in_schema=True)
+@require_access("admin", human=False)
+def get_inactive_users_page():
+    """
+    One page of users whose last login was before `before` (YYYY-MM-DD), or at
+    least `days` (default 30) days ago, and after `after` (default a year before).
+    Pass `next` from the response to get the following page.
+    """
+    params = users_router.current_event.query_string_parameters
+    if params.get("before"):
+        before = _date_to_timestamp(params["before"], "before")
+    else:
+        try:
+            days = int(params.get("days", 30))
+        except ValueError as e:
+            raise MalformedRequest("'days' must be a number") from e
+        before = int(time.time()) - days * 24 * 60 * 60
+    after = None
+    if params.get("after"):
+        after = _date_to_timestamp(params["after"], "after")
+    try:
+        limit = min(max(int(params.get("limit", 500)), 1), 1000)
+    except ValueError as e:
+        raise MalformedRequest("'limit' must be a number") from e
+
+    try:
+        users, cursor = get_inactive_users(
+            before, after, limit, decode_token(params.get("next"), "next")
+        )
+    except ValueError as e:
+        raise MalformedRequest(str(e)) from e
+
+    return wrap_response(
+        body=json.dumps(
+            {
+                "users": users,
+                "before": before,
+                "next": encode_token(cursor),
+                "message": "OK",
+            }
+        ),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+@users_router.get("/lookup", include_in_schema=True)
+@require_access("admin", human=False)
+def get_users_by_email():
+    """Usernames with the `email` query parameter as their email (case-insensitive)."""
+    email = users_router.current_event.query_string_parameters.get("email")
+    if not email:
+        raise MalformedRequest("'email' query parameter is required")
+
+    return wrap_response(
+        body=json.dumps({"usernames": get_usernames_by_email(email), "message": "OK"}),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
+
+
+@users_router.get("/ip", include_in_schema=True)
+@require_access("admin", human=False)
+def get_users_by_ip():
+    """
+    Users seen at the `address` query parameter, an IP or a subnet up to /24 (IPv4)
+    or /64 (IPv6), in the last `days` (default 30, at most USER_IP_INDEX_DAYS) days.
+    """
+    if not is_ip_index_enabled():
+        raise EnvironmentNotSet("User IP index is not configured")
+
+    params = users_router.current_event.query_string_parameters
+    address = params.get("address")
+    if not address:
+        raise MalformedRequest("'address' query parameter is required")
+    try:
+        days = int(params.get("days", 30))
+    except ValueError as e:
+        raise MalformedRequest("'days' must be a number") from e
+    # Nothing older is kept:
+    if not 1 <= days <= USER_IP_INDEX_DAYS:
+        raise MalformedRequest(f"'days' must be between 1 and {USER_IP_INDEX_DAYS}")
+
+    return wrap_response(
+        body=json.dumps(
+            {"users": find_ip_users(address, days=days), "days": days, "message": "OK"}
+        ),
+        code=200,
+        content_type=content_types.APPLICATION_JSON,
+    )
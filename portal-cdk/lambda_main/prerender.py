@@ -0,0 +1,38 @@
+"""Renders the anonymous pages into S3 on every deploy, see util/pages.py"""
+
+import os
+
+import boto3
+
+from util.pages import PRERENDER_PREFIX, render_anonymous_pages
+
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+AWS_DEFAULT_REGION = os.getenv("STACK_REGION", "us-west-2")
+# Short, so a deploy's changes don't wait long behind browser caches:
+PRERENDER_CACHE_CONTROL = "public, max-age=300"
+
+
+def publish_pages(pages: dict[str, str], bucket_name: str) -> list[str]:
+    s3 = boto3.client("s3", region_name=AWS_DEFAULT_REGION)
+    keys = []
+    for file_name, html in pages.items():
+        key = f"{PRERENDER_PREFIX}{file_name}"
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=key,
+            Body=html.encode("utf-8"),
+            ContentType="text/html",
+            CacheControl=PRERENDER_CACHE_CONTROL,
+        )
+        keys.append(key)
+    return keys
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    keys = publish_pages(render_anonymous_pages(), os.getenv("PRERENDER_BUCKET_NAME"))
+    logger.info({"prerendered": keys})
+    return {"pages": keys}
@@ -1,45 +1,203 @@
-import mimetypes
+"""
+Static assets (css, js, img, fonts), loaded into memory once per container.
+
+Each asset is kept with its MIME type and a content hash (used for the ETag and for
+`static_url`). A gzipped copy is only made the first time a client asks for one,
+since CloudFront serves most assets and compressing them all would slow cold starts. Requests for
+`/static/<path>?v=<hash>` with the current hash are cached by browsers forever,
+since a changed file gets a new URL.
+
+When deployed, `make build-static` (see static/build.py) publishes fingerprinted
+copies to S3 behind CloudFront, and `static_url` points at those instead. The
+`/static/` route here is only the fallback for local runs and un-built bundles.
+"""
+
 import os
+import json
+import gzip
+import hashlib
+import functools
+import mimetypes
+from dataclasses import dataclass
 
 from aws_lambda_powertools.event_handler.exceptions import NotFoundError
 from aws_lambda_powertools.event_handler import Response
 
+from util.responses import accepts_gzip, etag_matches
 
-def read_file(read_path):
-    local_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+STATIC_DIR = os.path.dirname(os.path.realpath(__file__))
+STATIC_TYPES = ("css", "js", "img", "fonts")
+# Written by static/build.py, and bundled with the Lambda:
+STATIC_BUILD_DIR = os.path.join(os.path.dirname(STATIC_DIR), "static_build")
+STATIC_MANIFEST_NAME = "manifest.json"
 
-    abs_file_path = os.path.join(local_path, read_path)
+# guess_type gets these wrong
+MIME_TYPES = {
+    "css": "text/css",
+    "js": "text/javascript",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+COMPRESSIBLE_TYPES = ("text/", "image/svg+xml", "image/x-icon", "image/vnd.microsoft")
+COMPRESSIBLE_EXTENSIONS = ("ttf", "eot")
 
-    if not os.path.exists(abs_file_path):
-        raise NotFoundError(f"{read_path} (aka {abs_file_path}) not found")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Un-versioned URLs can change on deploy, so have browsers check back (with the ETag):
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
 
-    file_obj = open(abs_file_path, "rb")
-    return file_obj.read()
 
+@dataclass(frozen=True)
+class StaticAsset:
+    path: str
+    body: bytes
+    mime_type: str
+    content_hash: str
 
-def get_static_object(event):
-    file_type, file_name = event.path.split("/")[2:4]
+    @property
+    def etag(self) -> str:
+        # Weak, the same ETag goes out for the gzipped copy:
+        return f'W/"{self.content_hash}"'
+
+    @property
+    def compressible(self) -> bool:
+        # Already compressed formats (png, jpg, woff...) don't shrink any further:
+        return self.mime_type.startswith(COMPRESSIBLE_TYPES) or self.path.endswith(
+            COMPRESSIBLE_EXTENSIONS
+        )
+
+    @functools.cached_property
+    def gzip_body(self) -> bytes | None:
+        """Compressed on first use, or None if it doesn't get any smaller."""
+        if not self.compressible:
+            return None
+        compressed = gzip.compress(self.body, compresslevel=9, mtime=0)
+        return compressed if len(compressed) < len(self.body) else None
+
+
+def _mime_type(file_name: str) -> str:
     file_ext = file_name.split(".")[-1]
+    if file_ext in MIME_TYPES:
+        return MIME_TYPES[file_ext]
+    mime_type, _ = mimetypes.guess_type(file_name)
+    return mime_type or "application/octet-stream"
+
+
+def _load_asset(path: str, static_dir: str) -> StaticAsset:
+    with open(os.path.join(static_dir, path), "rb") as f:
+        body = f.read()
+    return StaticAsset(
+        path=path,
+        body=body,
+        mime_type=_mime_type(path),
+        content_hash=hashlib.sha256(body).hexdigest()[:16],
+    )
+
+
+def load_assets(static_dir: str = STATIC_DIR) -> dict[str, StaticAsset]:
+    """Every asset under STATIC_TYPES, keyed by path (eg. 'css/style.min.css')."""
+    assets = {}
+    for file_type in STATIC_TYPES:
+        type_dir = os.path.join(static_dir, file_type)
+        for root, _, files in os.walk(type_dir):
+            for file_name in files:
+                path = os.path.relpath(os.path.join(root, file_name), static_dir)
+                path = path.replace(os.sep, "/")
+                assets[path] = _load_asset(path, static_dir)
+    return assets
+
 
-    if file_type not in ("css", "js", "img", "fonts"):
+def fingerprinted_path(path: str, content_hash: str) -> str:
+    """'css/style.min.css' -> 'css/style.min.<hash>.css'"""
+    base, dot, ext = path.rpartition(".")
+    if not dot:
+        return f"{path}.{content_hash}"
+    return f"{base}.{content_hash}.{ext}"
+
+
+def load_manifest(build_dir: str = STATIC_BUILD_DIR) -> dict[str, str]:
+    """The published {path: fingerprinted_path} map, or {} if nothing was built."""
+    try:
+        with open(os.path.join(build_dir, STATIC_MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+ASSETS: dict[str, StaticAsset] = {}
+# Only the entries that still match what's bundled, see warm_assets():
+MANIFEST: dict[str, str] = {}
+# fingerprinted_path -> path, so the fallback route can serve those too:
+FINGERPRINTED: dict[str, str] = {}
+
+
+def warm_assets(build_dir: str = STATIC_BUILD_DIR) -> int:
+    """Load every asset. Done during Lambda init."""
+    ASSETS.clear()
+    ASSETS.update(load_assets())
+
+    MANIFEST.clear()
+    FINGERPRINTED.clear()
+    for path, published in load_manifest(build_dir).items():
+        asset = ASSETS.get(path)
+        # A stale build would point at files that aren't what we're serving:
+        if asset and published == fingerprinted_path(path, asset.content_hash):
+            MANIFEST[path] = published
+            FINGERPRINTED[published] = path
+    return len(ASSETS)
+
+
+def get_asset(path: str) -> StaticAsset | None:
+    if not ASSETS:
+        warm_assets()
+    return ASSETS.get(path)
+
+
+def static_url(path: str) -> str:
+    """URL for a static asset, versioned so it can be cached forever."""
+    asset = get_asset(path)
+    if not asset:
+        return f"/static/{path}"
+    if path in MANIFEST:
+        return f"/static/{MANIFEST[path]}"
+    return f"/static/{path}?v={asset.content_hash}"
+
+
+def get_static_object(event):
+    path = event.path.removeprefix("/static/")
+    if path.split("/")[0] not in STATIC_TYPES:
+        raise NotFoundError(f"{event.path} not found")
+
+    asset = get_asset(path)
+    version = (event.query_string_parameters or {}).get("v")
+    if not asset and path in FINGERPRINTED:
+        asset = get_asset(FINGERPRINTED[path])
+        version = asset.content_hash
+    if not asset:
         raise NotFoundError(f"{event.path} not found")
 
-    body = read_file(os.path.join(file_type, file_name))
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL
+            if version == asset.content_hash
+            else DEFAULT_CACHE_CONTROL
+        ),
+    }
+
+    if asset.compressible:
+        headers["Vary"] = "Accept-Encoding"
 
-    mime_type, encoding = mimetypes.guess_type(file_ext)
+    if etag_matches(event.headers.get("if-none-match"), asset.etag):
+        return Response(status_code=304, body="", headers=headers)
 
-    # guess_type gets these wrong
-    if file_ext == "css":
-        mime_type = "text/css"
-    if file_ext == "js":
-        mime_type = "text/javascript"
-    if file_ext == "png":
-        mime_type = "image/png"
-    if file_ext == "svg":
-        mime_type = "image/svg+xml"
+    body = asset.body
+    if asset.compressible and accepts_gzip(event) and asset.gzip_body:
+        body = asset.gzip_body
+        headers["Content-Encoding"] = "gzip"
 
     return Response(
         status_code=200,
-        content_type=mime_type,
+        content_type=asset.mime_type,
         body=body,
+        headers=headers,
     )
@@ -0,0 +1,47 @@
+"""
+Bundle-time step that fingerprints every static asset for S3/CloudFront.
+
+`make build-static` (or `python -m static.build` from lambda_main/) copies each
+asset to `static_build/static/<name>.<hash>.<ext>`, and writes a manifest of
+{path: fingerprinted_path} that `static_url` uses to point pages at them. The
+CDK stack publishes `static_build/static/` to the `/static/*` CloudFront behavior.
+"""
+
+import os
+import json
+import shutil
+
+from static import (
+    STATIC_BUILD_DIR,
+    STATIC_DIR,
+    STATIC_MANIFEST_NAME,
+    fingerprinted_path,
+    load_assets,
+)
+
+
+def build_static(
+    build_dir: str = STATIC_BUILD_DIR, static_dir: str = STATIC_DIR
+) -> dict[str, str]:
+    """Write fingerprinted copies and the manifest into `build_dir`. Returns the manifest."""
+    published_dir = os.path.join(build_dir, "static")
+    # Anything left over from an older build would get published again:
+    shutil.rmtree(published_dir, ignore_errors=True)
+
+    manifest = {}
+    for path, asset in sorted(load_assets(static_dir).items()):
+        published = fingerprinted_path(path, asset.content_hash)
+        out_path = os.path.join(published_dir, published)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb") as f:
+            f.write(asset.body)
+        manifest[path] = published
+
+    with open(os.path.join(build_dir, STATIC_MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    built = build_static()
+    print(f"Fingerprinted {len(built)} static assets into {STATIC_BUILD_DIR}")
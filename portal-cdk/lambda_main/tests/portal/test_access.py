@@ -934,3 +934,70 @@ class TestAccessPages:
         assert "User does not have required access" in ret["body"]
         assert ret["statusCode"] == 403
         assert ret["headers"].get("Content-Type") == "application/json"
+
+    def test_access_report(self, monkeypatch, lambda_context, helpers, fake_auth):
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("portal.access.LABS", helpers.FAKE_LABS)
+
+        items = [
+            {"username": "admin1", "access": ["admin"], "labs": {}},
+            {"username": "user1", "access": ["user"], "labs": {"testlab": {}}},
+            {
+                "username": "user2",
+                "access": ["user"],
+                "country_code": "KP",
+                "labs": {"testlab": {}, "noaccess": {}, "removedlab": {}},
+            },
+        ]
+        pages = []
+
+        def fake_scan_page(filterexpr, limit, start_key):
+            # Two users per page, and the cursor is the next one's index:
+            pages.append(start_key)
+            start = start_key["index"] if start_key else 0
+            page = items[start : start + 2]
+            if filterexpr is not None:
+                page = [item for item in page if "testlab" in item["labs"]]
+            return page, {"index": start + 2} if start + 2 < len(items) else None
+
+        monkeypatch.setattr("portal.access.scan_page", fake_scan_page)
+
+        def report(**qparams):
+            # Every page of the report, adding up the counts:
+            bodies = []
+            while True:
+                event = helpers.get_event(
+                    path="/portal/access/report", cookies=fake_auth, qparams=qparams
+                )
+                ret = main.lambda_handler(event, lambda_context)
+                assert ret["statusCode"] == 200
+                bodies.append(json.loads(ret["body"]))
+                if not bodies[-1]["next"]:
+                    return bodies
+                qparams = {**qparams, "next": bodies[-1]["next"]}
+
+        bodies = report()
+        assert len(bodies) == 2
+        assert pages == [None, {"index": 2}]
+        assert sum(body["users"] for body in bodies) == 3
+        testlab = {
+            key: sum(body["labs"]["testlab"][key] for body in bodies)
+            for key in bodies[0]["labs"]["testlab"]
+        }
+        assert testlab == {
+            "members": 2,
+            "visible": 3,
+            "accessible": 2,
+            "geo_blocked": 1,
+        }
+        # Private, so only visible to the admin and its member:
+        assert sum(body["labs"]["noaccess"]["visible"] for body in bodies) == 2
+        assert "members" not in bodies[0]
+
+        bodies = report(lab="testlab")
+        assert list(bodies[0]["labs"]) == ["testlab"]
+        assert [member for body in bodies for member in body["members"]] == [
+            {"username": "user1", "accessible": True, "geo_blocked": False},
+            {"username": "user2", "accessible": False, "geo_blocked": True},
+        ]
@@ -3,9 +3,15 @@ import json
 from base64 import b64encode
 
 import boto3
+import jwt
+import pytest
+from jwt.algorithms import OKPAlgorithm
 from moto import mock_aws
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 
 from util.auth import encrypt_data
+from util import lab_token
+from util.lab_token import LAB_TOKEN_COOKIE
 import main
 
 REGION = os.getenv("STACK_REGION", "us-west-2")
@@ -110,3 +116,161 @@ class TestHubPages:
         assert ret["statusCode"] == 422
         assert response["result"] == "Error"
         assert response["reason"] == "KeyError('to')"
+
+
+class TestLabTokens:
+    @pytest.fixture
+    def lab_token_key(self, monkeypatch, helpers):
+        from util.secret_cache import SecretCache
+
+        private_key = Ed25519PrivateKey.generate()
+        secrets = {
+            ("fake-lab-token-secret", None): helpers.private_key_to_pem(private_key),
+            # The value the secret was created with, before a key was put in it:
+            ("fake-lab-token-secret", "AWSPREVIOUS"): "not-a-key",
+            # SSO_TOKEN_SECRET_NAME isn't set in tests:
+            (None, None): "er9LnqEOiH+JLBsFCy0kVeba6ZSlG903cliU7VYKnM8=",
+        }
+        monkeypatch.setattr(
+            "aws_lambda_powertools.utilities.parameters.get_secret",
+            lambda name, VersionStage=None: secrets[(name, VersionStage)],
+        )
+        monkeypatch.setattr(
+            "util.lab_token.LAB_TOKEN_SECRET", SecretCache("fake-lab-token-secret")
+        )
+        monkeypatch.setattr(
+            "util.lab_token.LAB_TOKEN_PREVIOUS_SECRET",
+            SecretCache("fake-lab-token-secret", version_stage="AWSPREVIOUS"),
+        )
+        return secrets
+
+    def test_launch_lab_sets_token(
+        self, monkeypatch, lambda_context, fake_auth, helpers, lab_token_key
+    ):
+        user = helpers.FakeUser()
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("util.user.user.LABS", helpers.FAKE_LABS)
+
+        event = helpers.get_event(path="/portal/hub/launch/testlab", cookies=fake_auth)
+        ret = main.lambda_handler(event, lambda_context)
+
+        assert ret["statusCode"] == 302
+        assert ret["headers"].get("Location") == "/lab/testlab/hub/login"
+        cookie = ret["cookies"][0]
+        assert cookie.startswith(f"{LAB_TOKEN_COOKIE}=")
+        assert "Path=/lab/testlab/;" in cookie
+
+        # Labs verify the token with just the published key:
+        token = cookie.split(";")[0].split("=", 1)[1]
+        event = helpers.get_event(path="/portal/hub/jwks.json")
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        jwk = json.loads(ret["body"])["keys"][0]
+        assert jwk["kid"] == jwt.get_unverified_header(token)["kid"]
+
+        public_key = OKPAlgorithm.from_jwk(jwk)
+        claims = helpers.jwt_decode(
+            token, public_key, algorithms=["EdDSA"], audience="testlab"
+        )
+        assert claims["sub"] == "test_user"
+        assert claims["roles"] == ["user"]
+        assert claims["country_code"] == "US"
+        assert claims["force_user_profile_update"] is False
+        assert claims["lab_access"]["can_user_access_lab"] is True
+
+        # And the version check agrees with the token, until the user changes:
+        monkeypatch.setattr("portal.hub.User", lambda *args, **kwargs: user)
+        # fake_auth bypasses jwt.decode, the version check must really verify:
+        monkeypatch.setattr("jwt.decode", helpers.jwt_decode)
+        event = helpers.get_event(
+            path="/portal/hub/token/version",
+            headers={"authorization": f"Bearer {token}"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        version = json.loads(ret["body"])
+        assert version["username"] == "test_user"
+        assert version["ver"] == claims["ver"]
+        assert version["revoked"] is False
+
+        # Writes that don't touch the claims (activity, IPs...) keep it:
+        user._rec_counter += 1
+        ret = main.lambda_handler(event, lambda_context)
+        assert json.loads(ret["body"])["ver"] == claims["ver"]
+
+        user.require_profile_update = True
+        ret = main.lambda_handler(event, lambda_context)
+        assert json.loads(ret["body"])["ver"] != claims["ver"]
+
+        user.require_profile_update = False
+        user.is_locked = True
+        ret = main.lambda_handler(event, lambda_context)
+        version = json.loads(ret["body"])
+        assert version["ver"] != claims["ver"]
+        assert version["revoked"] is True
+
+    def test_token_version_needs_token(self, lambda_context, helpers, lab_token_key):
+        # Otherwise anyone could tell which accounts exist, and which are locked:
+        event = helpers.get_event(
+            path="/portal/hub/token/version", qparams={"username": "test_user"}
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 401
+
+        forged = jwt.encode(
+            {"sub": "test_user", "exp": 2**40},
+            Ed25519PrivateKey.generate(),
+            algorithm="EdDSA",
+        )
+        event = helpers.get_event(
+            path="/portal/hub/token/version",
+            headers={"authorization": f"Bearer {forged}"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 401
+
+    def test_jwks_after_rotation(self, lambda_context, helpers, lab_token_key):
+        event = helpers.get_event(path="/portal/hub/jwks.json")
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert ret["headers"]["Cache-Control"] == "public, max-age=300"
+        # The secret's first value was never a key:
+        assert len(json.loads(ret["body"])["keys"]) == 1
+
+        previous_key = Ed25519PrivateKey.generate()
+        lab_token_key[("fake-lab-token-secret", "AWSPREVIOUS")] = (
+            helpers.private_key_to_pem(previous_key)
+        )
+        lab_token.LAB_TOKEN_PREVIOUS_SECRET.clear()
+        ret = main.lambda_handler(event, lambda_context)
+        keys = json.loads(ret["body"])["keys"]
+        assert len(keys) == 2
+
+        # Tokens signed before the rotation still verify, with the published key:
+        _, previous_kid, _ = lab_token.get_previous_key()
+        assert keys[1]["kid"] == previous_kid
+        token = jwt.encode(
+            {"iss": lab_token.LAB_TOKEN_ISSUER, "sub": "test_user", "exp": 2**40},
+            previous_key,
+            algorithm="EdDSA",
+            headers={"kid": previous_kid},
+        )
+        assert lab_token.read_lab_token(token)["sub"] == "test_user"
+
+    def test_launch_lab_no_access(
+        self, monkeypatch, lambda_context, fake_auth, helpers, lab_token_key
+    ):
+        user = helpers.FakeUser()
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("util.user.user.LABS", helpers.FAKE_LABS)
+
+        event = helpers.get_event(
+            path="/portal/hub/launch/differentlab", cookies=fake_auth
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 403
+        assert not ret.get("cookies")
+
+        event = helpers.get_event(path="/portal/hub/launch/fakelab", cookies=fake_auth)
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 404
@@ -40,3 +40,36 @@ class TestRenderingTemplates:
         assert ret["statusCode"] == 200
         assert ret["body"].find('href="/portal/profile">Profile') > -1
         assert ret["body"].find('href="/portal/users">Manage Users') > -1
+
+    def test_fragments_cached(self, monkeypatch, lambda_context, fake_auth, helpers):
+        from util.labs import BaseLab
+
+        user = helpers.FakeUser()
+        monkeypatch.setattr("portal.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("util.user.user.LABS", helpers.FAKE_LABS)
+        monkeypatch.setattr(BaseLab, "is_healthy", lambda *args, **kwargs: True)
+
+        event = helpers.get_event(path="/portal", cookies=fake_auth)
+        first = main.lambda_handler(event, lambda_context)
+        assert first["body"].find('href="/portal/hub/launch/testlab"') > -1
+
+        # Lab cards and nav links come from the cache the second time around:
+        import util.format
+
+        render = util.format.jinja_template
+
+        def no_fragments(template_input, template_name):
+            assert template_name not in ("lab_card.j2", "navbar_links.j2")
+            return render(template_input, template_name)
+
+        monkeypatch.setattr("util.format.jinja_template", no_fragments)
+        second = main.lambda_handler(event, lambda_context)
+        assert second["body"] == first["body"]
+
+        # Different access is a different fragment:
+        user.access = ["user", "admin"]
+        monkeypatch.setattr("util.format.jinja_template", render)
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["body"].find('href="/portal/users">Manage Users') > -1
+        assert ret["body"].find('href="/portal/access/manage/testlab"') > -1
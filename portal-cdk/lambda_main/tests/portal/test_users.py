@@ -342,3 +342,87 @@ class TestUsersPages:
         assert ret["statusCode"] == 302
         assert ret["headers"].get("Location", "").find("success=True") != -1
         assert not locked_user.is_locked, "User should not be locked"
+
+    def test_user_ip_info_async(self, lambda_context, monkeypatch, fake_auth, helpers):
+        import json
+        import time
+
+        user = helpers.FakeUser(access=["admin", "user"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+
+        started_at = time.time() - 4
+        monkeypatch.setattr(
+            "portal.users.start_user_ip_logs_query",
+            lambda **kwargs: {"query_id": "query-1", "started_at": started_at},
+        )
+        polls = iter(
+            [
+                {"status": "Running", "complete": False, "results": [{"n": 1}]},
+                {"status": "Complete", "complete": True, "results": [{"n": 1}, {}]},
+            ]
+        )
+        monkeypatch.setattr(
+            "portal.users.poll_user_ip_logs_query", lambda query_id: next(polls)
+        )
+
+        event = helpers.get_event(
+            path="/portal/users/info",
+            cookies=fake_auth,
+            qparams={"username": "GeneralUser", "async": "true"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        body = json.loads(ret["body"])
+        assert body["complete"] is False
+        assert body["handle"]
+
+        event = helpers.get_event(
+            path="/portal/users/info/results",
+            cookies=fake_auth,
+            qparams={"handle": body["handle"]},
+        )
+        # Partial results while it runs, and how long to wait:
+        body = json.loads(main.lambda_handler(event, lambda_context)["body"])
+        assert body["status"] == "Running"
+        assert body["results"] == [{"n": 1}]
+        assert 1.5 <= body["retry_after"] <= 5
+
+        body = json.loads(main.lambda_handler(event, lambda_context)["body"])
+        assert body["complete"] is True
+        assert len(body["results"]) == 2
+        assert body["retry_after"] is None
+
+        event = helpers.get_event(
+            path="/portal/users/info/results",
+            cookies=fake_auth,
+            qparams={"handle": "not-a-handle"},
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
+
+    def test_user_ip_info_limit(self, lambda_context, monkeypatch, fake_auth, helpers):
+        user = helpers.FakeUser(access=["admin", "user"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("portal.users.is_ip_history_enabled", lambda: True)
+        history = []
+        monkeypatch.setattr(
+            "portal.users.get_user_ip_history",
+            lambda username, limit: history.append(limit) or [],
+        )
+
+        # Same limits for the history table as for the Insights query:
+        for limit in ("-1", "10001", "lots"):
+            event = helpers.get_event(
+                path="/portal/users/info",
+                cookies=fake_auth,
+                qparams={"username": "GeneralUser", "limit": limit},
+            )
+            assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
+        assert history == []
+
+        event = helpers.get_event(
+            path="/portal/users/info",
+            cookies=fake_auth,
+            qparams={"username": "GeneralUser", "limit": "10"},
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 200
+        assert history == [10]
@@ -11,6 +11,14 @@ class TestPortalIntegrations:
         assert "Log in" in ret["body"]
         assert "/login?client_id=fake-cognito-id&response_type=code" in ret["body"]
 
+    def test_identity_map_cleared(self, lambda_context, helpers):
+        from util.user.user import _IDENTITY_MAP
+
+        # Anything that loaded a User, not only the session, gets cleared:
+        _IDENTITY_MAP["stale_user"] = object()
+        main.lambda_handler(helpers.get_event(), lambda_context)
+        assert "stale_user" not in _IDENTITY_MAP
+
     def test_not_logged_in(self, lambda_context, helpers):
         event = helpers.get_event(path="/portal")
         ret = main.lambda_handler(event, lambda_context)
@@ -45,6 +53,83 @@ class TestPortalIntegrations:
         assert ret["statusCode"] == 200
         assert ret["headers"].get("Content-Type") == "text/css"
 
+    def test_static_caching(self, lambda_context, helpers):
+        import gzip
+        import base64
+
+        from static import get_asset, load_assets, static_url
+
+        # Only compressed once a client asks for it:
+        assert "gzip_body" not in vars(load_assets()["css/style.min.css"])
+
+        asset = get_asset("css/style.min.css")
+        url = static_url("css/style.min.css")
+        assert url == f"/static/css/style.min.css?v={asset.content_hash}"
+
+        event = helpers.get_event(
+            path="/static/css/style.min.css",
+            qparams={"v": asset.content_hash},
+            headers={"Accept-Encoding": "gzip, br"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert "immutable" in ret["headers"]["Cache-Control"]
+        assert ret["headers"]["ETag"] == asset.etag
+        assert ret["headers"]["Content-Encoding"] == "gzip"
+        assert gzip.decompress(base64.b64decode(ret["body"])) == asset.body
+
+        # Old (or missing) versions shouldn't be cached forever:
+        event = helpers.get_event(path="/static/css/style.min.css")
+        ret = main.lambda_handler(event, lambda_context)
+        assert "immutable" not in ret["headers"]["Cache-Control"]
+        assert "Content-Encoding" not in ret["headers"]
+
+        event = helpers.get_event(
+            path="/static/css/style.min.css", headers={"If-None-Match": asset.etag}
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 304
+        assert not ret["body"]
+
+        # PNGs are already compressed:
+        assert get_asset("img/osl_logo_v2_long.png").gzip_body is None
+
+    def test_static_fingerprinted(self, lambda_context, helpers, tmp_path):
+        import json
+
+        from static import get_asset, static_url, warm_assets
+        from static.build import build_static
+
+        manifest = build_static(build_dir=str(tmp_path))
+        published = manifest["css/style.min.css"]
+        asset = get_asset("css/style.min.css")
+        assert published == f"css/style.min.{asset.content_hash}.css"
+        assert (tmp_path / "static" / published).read_bytes() == asset.body
+
+        try:
+            warm_assets(build_dir=str(tmp_path))
+            assert static_url("css/style.min.css") == f"/static/{published}"
+
+            ret = main.lambda_handler(helpers.get_event(path="/"), lambda_context)
+            assert f'href="/static/{published}"' in ret["body"]
+
+            # Still works if it ends up at the Lambda:
+            event = helpers.get_event(path=f"/static/{published}")
+            ret = main.lambda_handler(event, lambda_context)
+            assert ret["statusCode"] == 200
+            assert ret["headers"]["Content-Type"] == "text/css"
+            assert "immutable" in ret["headers"]["Cache-Control"]
+
+            # A stale manifest is ignored, instead of pointing at the wrong file:
+            manifest["css/style.min.css"] = "css/style.min.0000.css"
+            (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+            warm_assets(build_dir=str(tmp_path))
+            assert static_url("css/style.min.css").endswith(
+                f"style.min.css?v={asset.content_hash}"
+            )
+        finally:
+            warm_assets()
+
     def test_user_home_page(self, monkeypatch, lambda_context, helpers, fake_auth):
         user = helpers.FakeUser()
         monkeypatch.setattr("portal.User", lambda *args, **kwargs: user)
@@ -247,6 +247,52 @@ class TestPortalAuth:
         }
         assert decrypt_data(json_payload["data"]) == expected_data
 
+    def test_post_portal_hub_auth_cached(
+        self, lambda_context, helpers, monkeypatch, fake_get_secret
+    ):
+        user = helpers.FakeUser()
+        monkeypatch.setattr("portal.hub.User", lambda *args, **kwargs: user)
+
+        body = b64encode(json.dumps({"username": "test_user"}).encode("ascii"))
+        event = helpers.get_event(path="/portal/hub/auth", method="POST", body=body)
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        etag = ret["headers"].get("ETag")
+        assert etag
+
+        # Same user, same record: served from the cache without re-encrypting
+        monkeypatch.setattr(
+            "portal.hub.encrypt_data",
+            lambda *args, **kwargs: pytest.fail("Payload should be cached"),
+        )
+        ret_cached = main.lambda_handler(event, lambda_context)
+        assert ret_cached["statusCode"] == 200
+        assert ret_cached["body"] == ret["body"]
+        assert ret_cached["headers"].get("ETag") == etag
+
+        # Client already has it
+        event = helpers.get_event(
+            path="/portal/hub/auth",
+            method="POST",
+            body=body,
+            headers={"If-None-Match": etag},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 304
+        assert ret["body"] == ""
+
+        # User record changed, so the ETag and payload have to change too
+        monkeypatch.undo()
+        monkeypatch.setattr("portal.hub.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr(
+            "aws_lambda_powertools.utilities.parameters.get_secret",
+            lambda a: "er9LnqEOiH+JLBsFCy0kVeba6ZSlG903cliU7VYKnM8=",
+        )
+        user._rec_counter += 1
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert ret["headers"].get("ETag") != etag
+
     def test_get_portal_hub_no_auth(self, lambda_context, helpers):
         event = helpers.get_event(path="/portal/hub", cookies={"foo": "bar"})
         ret = main.lambda_handler(event, lambda_context)
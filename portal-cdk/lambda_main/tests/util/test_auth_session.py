@@ -102,3 +102,43 @@ class TestAuthSession:
         assert current_session.user is None, (
             "User should still be None without a auth cookie"
         )
+
+    def test_session_public_route_skips_auth(
+        self, lambda_context, monkeypatch, helpers
+    ):
+        # If anything tries to validate the session, fail loudly:
+        monkeypatch.setattr(
+            "util.auth.refresh_map",
+            lambda *args, **kwargs: helpers.raise_error(
+                error=Exception("Public routes shouldn't resolve the session")
+            ),
+        )
+        from util.session import current_session
+
+        for path in ("/static/css/style.min.css", "/register", "/mfa"):
+            event = helpers.get_event(path=path, cookies={"portal-jwt": "bla"})
+            ret = main.lambda_handler(event, lambda_context)
+            assert ret["statusCode"] == 200, f"{path} should render without auth"
+            assert not current_session.user_resolved, (
+                f"{path} should not have resolved the session"
+            )
+
+    def test_session_user_resolved_once(
+        self, lambda_context, monkeypatch, helpers, fake_auth
+    ):
+        users_built = []
+
+        def fake_user(*args, **kwargs):
+            users_built.append(kwargs.get("username"))
+            return helpers.FakeUser()
+
+        monkeypatch.setattr("util.auth.User", fake_user)
+        from util.session import current_session
+
+        event = helpers.get_event(path="/static/css/style.min.css", cookies=fake_auth)
+        main.lambda_handler(event, lambda_context)
+        assert users_built == [], "User shouldn't be built before it's needed"
+
+        assert current_session.user.username == "test_user"
+        assert current_session.user.username == "test_user"
+        assert users_built == ["test_user"], "User should only be resolved once"
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+from dataclasses import asdict
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import main
+import util.labs
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+CATALOG_TABLE_NAME = "TestLabCatalogTable"
+
+
+@mock_aws
+class TestLabCatalog:
+    def setup_method(self, method):
+        dynamo = boto3.resource("dynamodb", region_name=REGION)
+        dynamo.create_table(
+            TableName=CATALOG_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "catalog", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "catalog", "AttributeType": "S"},
+            ],
+        )
+
+    def test_catalog_refresh(self, monkeypatch):
+        from util.labs.catalog import LabCatalog, lab_from_dict, save_lab_catalog
+        from util.exceptions import CatalogConflict
+
+        monkeypatch.setenv("LAB_CATALOG_TABLE_NAME", CATALOG_TABLE_NAME)
+        builtin_version = util.labs.LABS_VERSION
+
+        # Nothing saved yet, so still the built-in catalog:
+        other_container = LabCatalog(ttl=60)
+        assert other_container.refresh() is False
+        assert other_container.version == 0
+
+        labs = dict(util.labs.BUILTIN_LABS)
+        name, lab = next(iter(labs.items()))
+        config = asdict(lab)
+        config["allowed_profiles"] = ["new profile"]
+        labs[name] = lab_from_dict(name, config)
+        assert save_lab_catalog(labs, expected_version=0, updated_by="admin") == 1
+
+        # Saving applies it right away in this container:
+        assert util.labs.LABS[name].allowed_profiles == ["new profile"]
+        assert util.labs.LABS_VERSION == "catalog-1"
+        assert util.labs.LABS_VERSION != builtin_version
+
+        # Others only check once their last check expires:
+        assert other_container.refresh() is False
+        other_container._checked.expire(time.monotonic() + 61)
+        assert other_container.refresh() is True
+        assert other_container.version == 1
+
+        with pytest.raises(CatalogConflict):
+            save_lab_catalog(labs, expected_version=0, updated_by="admin")
+
+    def test_catalog_endpoints(self, monkeypatch, lambda_context, fake_auth, helpers):
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+
+        new_lab = {
+            "friendly_name": "New Lab",
+            "accessibility": "protected",
+            "allowed_profiles": ["m6a.large"],
+            "deployment_url": "https://example.com",
+        }
+        put_event = helpers.get_event(
+            path="/portal/access/catalog/newlab",
+            method="PUT",
+            cookies=fake_auth,
+            body=json.dumps({"version": 0, "lab": new_lab}),
+        )
+        ret = main.lambda_handler(put_event, lambda_context)
+        assert ret["statusCode"] == 400, "Catalog isn't configured yet"
+
+        monkeypatch.setenv("LAB_CATALOG_TABLE_NAME", CATALOG_TABLE_NAME)
+        ret = main.lambda_handler(put_event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert json.loads(ret["body"])["version"] == 1
+        assert util.labs.LABS["newlab"].friendly_name == "New Lab"
+
+        # Same base version again:
+        ret = main.lambda_handler(put_event, lambda_context)
+        assert ret["statusCode"] == 409
+
+        bad_event = helpers.get_event(
+            path="/portal/access/catalog/newlab",
+            method="PUT",
+            cookies=fake_auth,
+            body=json.dumps({"version": 1, "lab": {**new_lab, "accessibility": "x"}}),
+        )
+        assert main.lambda_handler(bad_event, lambda_context)["statusCode"] == 400
+
+        event = helpers.get_event(path="/portal/access/catalog", cookies=fake_auth)
+        body = json.loads(main.lambda_handler(event, lambda_context)["body"])
+        assert body["version"] == 1
+        assert body["labs"]["newlab"]["allowed_profiles"] == ["m6a.large"]
+
+        event = helpers.get_event(
+            path="/portal/access/catalog/newlab",
+            method="DELETE",
+            cookies=fake_auth,
+            qparams={"version": "1"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert "newlab" not in util.labs.LABS
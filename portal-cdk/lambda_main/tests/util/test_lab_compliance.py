@@ -0,0 +1,155 @@
+import os
+import json
+from dataclasses import asdict
+
+import boto3
+from moto import mock_aws
+
+import main
+import util.labs
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+USER_TABLE_NAME = "TestUserTable"
+CATALOG_TABLE_NAME = "TestLabCatalogTable"
+
+
+@mock_aws
+class TestLabCompliance:
+    def setup_method(self, method):
+        import util.user.dynamo_db
+
+        util.user.dynamo_db._DYNAMO_CLIENT = boto3.client(
+            "dynamodb", region_name=REGION
+        )
+        util.user.dynamo_db._DYNAMO_DB = boto3.resource("dynamodb", region_name=REGION)
+        util.user.dynamo_db._DYNAMO_DB.create_table(
+            TableName=USER_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "username", "AttributeType": "S"},
+                {"AttributeName": "country_code", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": util.user.dynamo_db.COUNTRY_CODE_INDEX,
+                    "KeySchema": [{"AttributeName": "country_code", "KeyType": "HASH"}],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+        )
+        table = util.user.dynamo_db._DYNAMO_DB.Table(USER_TABLE_NAME)
+        util.user.dynamo_db._DYNAMO_TABLE = table
+
+        lab = {"lab_profiles": ["m6a.large"]}
+        for item in [
+            {
+                "username": "us_member",
+                "country_code": "US",
+                "labs": {"test_prohibited": lab},
+            },
+            {
+                "username": "us_other",
+                "country_code": "US",
+                "labs": {"test_protected": lab},
+            },
+            {
+                "username": "us_admin",
+                "country_code": "US",
+                "access": ["user", "admin"],
+                "labs": {"test_prohibited": lab},
+            },
+            {
+                "username": "ca_member",
+                "country_code": "CA",
+                "labs": {"test_prohibited": lab, "test_protected": lab},
+            },
+            # Not in the index at all:
+            {"username": "no_country", "labs": {"test_prohibited": lab}},
+        ]:
+            table.put_item(Item={**item, "_rec_counter": 1})
+
+    def test_sweep_lab(self):
+        from util.labs.compliance import newly_prohibited, sweep_lab
+        from util.user.dynamo_db import get_item
+        from util.user.indexed import FACET_KEY, FACET_SEPARATOR
+
+        report = sweep_lab("test_prohibited")
+        assert report["countries"] == ["US"]
+        assert report["affected"] == [{"username": "us_member", "country_code": "US"}]
+        assert report["locked"] == []
+        assert not get_item("us_member").get("is_locked")
+
+        # Countries the lab doesn't prohibit are ignored:
+        assert sweep_lab("test_prohibited", ["CA"])["affected"] == []
+
+        report = sweep_lab("test_prohibited", lock=True)
+        assert report["locked"] == ["us_member"]
+        item = get_item("us_member")
+        assert item["is_locked"] is True
+        assert "locked" in item[FACET_KEY].split(FACET_SEPARATOR)
+        # Saved like any other change, so cached copies see it:
+        assert item["_rec_counter"] > 1
+        # Already locked:
+        assert sweep_lab("test_prohibited", lock=True)["locked"] == []
+
+        old_lab = util.labs.LABS["test_protected"]
+        config = asdict(old_lab)
+        config["ip_country_status"]["prohibited"] += ["CA", "US"]
+        new_lab = util.labs.BaseLab(**config)
+        assert newly_prohibited(old_lab, new_lab) == frozenset({"CA", "US"})
+        assert newly_prohibited(new_lab, old_lab) == frozenset()
+
+    def test_compliance_endpoints(
+        self, monkeypatch, lambda_context, fake_auth, helpers
+    ):
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+
+        event = helpers.get_event(
+            path="/portal/access/compliance/test_prohibited",
+            method="POST",
+            cookies=fake_auth,
+            body=json.dumps({"lock": True}),
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        body = json.loads(ret["body"])
+        assert body["locked"] == ["us_member"]
+
+        event = helpers.get_event(
+            path="/portal/access/compliance/test_prohibited",
+            method="POST",
+            cookies=fake_auth,
+            body=json.dumps({"countries": "US"}),
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
+
+        event = helpers.get_event(
+            path="/portal/access/compliance/dne", method="POST", cookies=fake_auth
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 404
+
+        # Prohibiting a country in the catalog reports who lost access:
+        boto3.resource("dynamodb", region_name=REGION).create_table(
+            TableName=CATALOG_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "catalog", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "catalog", "AttributeType": "S"}],
+        )
+        monkeypatch.setenv("LAB_CATALOG_TABLE_NAME", CATALOG_TABLE_NAME)
+        config = asdict(util.labs.LABS["test_protected"])
+        config["ip_country_status"]["prohibited"] += ["CA"]
+        event = helpers.get_event(
+            path="/portal/access/catalog/test_protected",
+            method="PUT",
+            cookies=fake_auth,
+            body=json.dumps({"version": 0, "lab": config}),
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        compliance = json.loads(ret["body"])["compliance"]
+        assert compliance["countries"] == ["CA"]
+        assert compliance["affected"] == [
+            {"username": "ca_member", "country_code": "CA"}
+        ]
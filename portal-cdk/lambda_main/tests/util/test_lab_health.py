@@ -0,0 +1,126 @@
+import os
+import json
+
+import boto3
+from moto import mock_aws
+
+import main
+import health_monitor
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+HEALTH_TABLE_NAME = "TestLabHealthTable"
+
+
+@mock_aws
+class TestLabHealthMonitor:
+    def setup_method(self, method):
+        import util.labs.health_history
+
+        dynamo = boto3.resource("dynamodb", region_name=REGION)
+        dynamo.create_table(
+            TableName=HEALTH_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[
+                {"AttributeName": "lab", "KeyType": "HASH"},
+                {"AttributeName": "checked_at", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "lab", "AttributeType": "S"},
+                {"AttributeName": "checked_at", "AttributeType": "N"},
+            ],
+        )
+        util.labs.health_history._HEALTH_TABLE = dynamo.Table(HEALTH_TABLE_NAME)
+
+    def test_record_health_checks(self, monkeypatch):
+        from util.labs.health_history import (
+            record_health_checks,
+            get_health_status,
+            get_health_stats,
+        )
+
+        for now, healthy, latency in (
+            (1000, True, 10),
+            (1060, False, 2000),
+            (1120, False, 2000),
+            (1180, True, 30),
+        ):
+            status = record_health_checks(
+                {"testlab": {"healthy": healthy, "latency_ms": latency}}, now=now
+            )
+            if now == 1120:
+                assert status["testlab"]["failures"] == 2, "Failures should add up"
+        assert status["testlab"]["failures"] == 0, "Healthy check resets failures"
+
+        # Too old, as far as the portal is concerned:
+        assert get_health_status() == {}
+        monkeypatch.setattr("util.labs.health_history.time.time", lambda: 1200)
+        assert get_health_status() == {
+            "testlab": {
+                "healthy": True,
+                "latency_ms": 30,
+                "failures": 0,
+                "checked_at": 1180,
+            }
+        }
+
+        stats = get_health_stats("testlab", since=0)
+        assert stats["checks"] == 4
+        assert stats["uptime"] == 0.5
+        assert stats["latency_ms"] == {"p50": 10, "p90": 30, "p99": 30}
+        assert get_health_stats("testlab", since=1100)["checks"] == 2
+
+    def test_monitor_status_used_for_portal(self, monkeypatch, helpers, lambda_context):
+        from util.labs import BaseLab
+        from util.labs.health import get_lab_health
+        from util.user.user import _IDENTITY_MAP
+
+        monkeypatch.setenv("LAB_HEALTH_TABLE_NAME", HEALTH_TABLE_NAME)
+        monkeypatch.setattr(
+            "health_monitor.LABS", {"testlab": helpers.FAKE_LABS["testlab"]}
+        )
+        monkeypatch.setattr(BaseLab, "is_healthy", lambda *args, **kwargs: True)
+        # Users loaded during the invoke don't outlive it:
+        monkeypatch.setitem(_IDENTITY_MAP, "test_user", helpers.FakeUser())
+        assert health_monitor.lambda_handler({}, lambda_context) == {
+            "labs": 1,
+            "unhealthy": [],
+        }
+        assert not _IDENTITY_MAP
+
+        # No more probing from the portal, for labs the monitor knows about:
+        probed = []
+
+        def fake_is_healthy(self, **kwargs):
+            probed.append(self.short_lab_name)
+            return False
+
+        monkeypatch.setattr(BaseLab, "is_healthy", fake_is_healthy)
+        labs = [helpers.FAKE_LABS["testlab"], helpers.FAKE_LABS["openlab"]]
+        assert get_lab_health(labs) == {"testlab": True, "openlab": False}
+        assert probed == ["openlab"]
+
+    def test_admin_lab_health(self, monkeypatch, lambda_context, fake_auth, helpers):
+        from util.labs.health_history import record_health_checks
+
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        monkeypatch.setattr("portal.access.LABS", {"testlab": None})
+
+        event = helpers.get_event(path="/portal/access/health", cookies=fake_auth)
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 400, "Monitor isn't configured yet"
+
+        monkeypatch.setenv("LAB_HEALTH_TABLE_NAME", HEALTH_TABLE_NAME)
+        record_health_checks({"testlab": {"healthy": True, "latency_ms": 12}})
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        body = json.loads(ret["body"])
+        assert body["labs"]["testlab"]["status"]["healthy"] is True
+        assert body["labs"]["testlab"]["uptime"] == 1
+        assert body["labs"]["testlab"]["latency_ms"]["p50"] == 12
+
+        event = helpers.get_event(
+            path="/portal/access/health", cookies=fake_auth, qparams={"hours": "x"}
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 400
@@ -78,3 +78,97 @@ class TestLabs:
         assert test_lab_goto_button["href"] == "#"
         assert test_lab_goto_button.get("disabled") is not None
         assert "unhealthy" in test_lab_goto_button["title"].lower()
+
+    def test_lab_health_cached(self, monkeypatch, helpers):
+        from util.labs.health import get_lab_health
+
+        checks = []
+
+        def fake_is_healthy(self, session=None):
+            checks.append(self.short_lab_name)
+            return self.short_lab_name == "testlab"
+
+        monkeypatch.setattr(BaseLab, "is_healthy", fake_is_healthy)
+        labs = [helpers.FAKE_LABS["testlab"], helpers.FAKE_LABS["openlab"]]
+
+        assert get_lab_health(labs) == {"testlab": True, "openlab": False}
+        assert sorted(checks) == ["openlab", "testlab"]
+
+        # Fresh results come straight from the cache:
+        assert get_lab_health(labs) == {"testlab": True, "openlab": False}
+        assert len(checks) == 2
+
+        # Stale results are still served, and refreshed in the background:
+        monkeypatch.setattr(BaseLab, "is_healthy", lambda *args, **kwargs: True)
+        assert get_lab_health(labs, ttl=0) == {"testlab": True, "openlab": False}
+        from util.labs.health import _IN_FLIGHT
+
+        for future in list(_IN_FLIGHT.values()):
+            future.result()
+        assert get_lab_health(labs) == {"testlab": True, "openlab": True}
+
+    def test_lab_access_policy(self, helpers):
+        from util.labs.policy import LabAccessPolicy, get_lab_access_policy
+
+        policy = LabAccessPolicy(helpers.FAKE_LABS)
+        user = policy.evaluate(False, "US", frozenset(["testlab", "openlab", "gone"]))
+        # Private labs are only visible to those who hold them:
+        assert user.visible == {"protectedlab", "testlab", "differentlab", "openlab"}
+        assert user.accessible == {"testlab", "openlab"}
+
+        # The default config prohibits KP, openlab's doesn't:
+        prohibited = policy.evaluate(False, "KP", frozenset(["testlab", "openlab"]))
+        assert prohibited.accessible == {"openlab"}
+
+        admin = policy.evaluate(True, "KP", frozenset())
+        assert admin.visible == admin.accessible == set(helpers.FAKE_LABS)
+
+        # Memoized per (role, country, labs):
+        assert policy.evaluate(False, "US", {"openlab", "testlab", "gone"}) is user
+
+        batch = policy.evaluate_many(
+            [
+                (False, "US", frozenset(["testlab", "openlab", "gone"])),
+                (True, "KP", frozenset()),
+                (False, "KP", frozenset(["testlab", "openlab"])),
+            ]
+        )
+        assert batch == [user, admin, prohibited]
+
+        compiled = get_lab_access_policy(helpers.FAKE_LABS)
+        assert get_lab_access_policy(helpers.FAKE_LABS) is compiled
+        assert get_lab_access_policy(dict(helpers.FAKE_LABS)) is not compiled
+
+    def test_batch_matches_policy(self, helpers):
+        import random
+
+        from util.labs.batch import BatchLabAccessEvaluator, UserColumns
+        from util.labs.policy import LabAccessPolicy
+
+        rng = random.Random(42)
+        lab_names = list(helpers.FAKE_LABS)
+        items = [
+            {
+                "username": f"user{i}",
+                "access": ["admin"] if rng.random() < 0.1 else ["user"],
+                "country_code": rng.choice(["US", "KP", "SY", None, "DE"]),
+                "labs": {name: {} for name in lab_names if rng.random() < 0.4},
+            }
+            for i in range(500)
+        ]
+
+        evaluator = BatchLabAccessEvaluator(helpers.FAKE_LABS)
+        matrix = evaluator.evaluate(UserColumns.from_items(items, evaluator.lab_names))
+        policy = LabAccessPolicy(helpers.FAKE_LABS)
+        for row, item in enumerate(items):
+            expected = policy.evaluate(
+                "admin" in item["access"], item["country_code"], frozenset(item["labs"])
+            )
+            for column, lab_name in enumerate(evaluator.lab_names):
+                assert matrix.visible[row, column] == (lab_name in expected.visible)
+                assert matrix.accessible[row, column] == (
+                    lab_name in expected.accessible
+                )
+
+        with pytest.raises(ValueError):
+            evaluator.evaluate(UserColumns.from_items(items, lab_names[:2]))
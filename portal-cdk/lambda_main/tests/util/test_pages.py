@@ -0,0 +1,54 @@
+import os
+
+import boto3
+from moto import mock_aws
+
+import main
+import prerender
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+BUCKET_NAME = "test-error-pages"
+
+
+@mock_aws
+class TestPrerender:
+    def test_prerender_pages(self, monkeypatch, lambda_context):
+        s3 = boto3.client("s3", region_name=REGION)
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": REGION},
+        )
+        monkeypatch.setenv("PRERENDER_BUCKET_NAME", BUCKET_NAME)
+
+        ret = prerender.lambda_handler({}, lambda_context)
+        assert sorted(ret["pages"]) == [
+            "prerendered/error.html",
+            "prerendered/index.html",
+            "prerendered/mfa.html",
+        ]
+
+        obj = s3.get_object(Bucket=BUCKET_NAME, Key="prerendered/index.html")
+        assert obj["ContentType"] == "text/html"
+        assert obj["CacheControl"] == prerender.PRERENDER_CACHE_CONTROL
+        landing = obj["Body"].read().decode("utf-8")
+        assert "Welcome to OpenScienceLab!" in landing
+        # The return path gets added by the browser instead:
+        assert "/auth&state=" not in landing
+        assert "a[data-return-state]" in landing
+
+        obj = s3.get_object(Bucket=BUCKET_NAME, Key="prerendered/mfa.html")
+        assert 'name="username"' in obj["Body"].read().decode("utf-8")
+
+    def test_error_page_status(self, lambda_context, helpers):
+        from util.pages import ANONYMOUS_PAGE_STATUS
+
+        # CloudFront puts the same status on the prerendered copy:
+        ret = main.lambda_handler(helpers.get_event(path="/error"), lambda_context)
+        assert ret["statusCode"] == ANONYMOUS_PAGE_STATUS["/error"] == 401
+
+    def test_lambda_pages_not_prerendered(self, lambda_context, helpers):
+        event = helpers.get_event(path="/", qparams={"return": "/portal"})
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert "&state=/portal" in ret["body"]
+        assert "a[data-return-state]" not in ret["body"]
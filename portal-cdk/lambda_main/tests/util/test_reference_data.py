@@ -0,0 +1,20 @@
+import pytest
+
+from util.reference_data import COUNTRIES, warm_reference_data
+
+
+def test_countries_read_only():
+    assert COUNTRIES["US"] == "United States"
+    # Same order as the file, for the profile page:
+    assert next(iter(COUNTRIES)) == "US"
+    with pytest.raises(TypeError):
+        COUNTRIES["XX"] = "Nowhere"
+
+
+def test_lab_lookup_sets(helpers):
+    lab = helpers.FAKE_LABS["testlab"]
+    assert warm_reference_data(helpers.FAKE_LABS) == len(helpers.FAKE_LABS)
+    assert lab.prohibited_countries == frozenset(lab.ip_country_status["prohibited"])
+    assert lab.allowed_profile_set == frozenset(lab.allowed_profiles)
+    # Computed once:
+    assert lab.prohibited_countries is lab.prohibited_countries
@@ -0,0 +1,71 @@
+import gzip
+from base64 import b64decode
+
+from aws_lambda_powertools.utilities.data_classes import APIGatewayProxyEventV2
+
+import main
+from util.responses import accepts_gzip, etag_matches
+
+
+class TestResponseNegotiation:
+    def test_large_response_compressed(self, lambda_context, helpers):
+        event = helpers.get_event(path="/")
+        plain = main.lambda_handler(event, lambda_context)
+        assert plain["statusCode"] == 200
+        assert "Content-Encoding" not in plain["headers"]
+        # Could have been compressed, so caches need to know it depends:
+        assert plain["headers"]["Vary"] == "Accept-Encoding"
+
+        event = helpers.get_event(path="/", headers={"Accept-Encoding": "gzip, br"})
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert ret["headers"]["Content-Encoding"] == "gzip"
+        assert ret["headers"]["Vary"] == "Accept-Encoding"
+        assert ret["isBase64Encoded"]
+        assert gzip.decompress(b64decode(ret["body"])).decode("utf-8") == plain["body"]
+        # Same content, different bytes, so the shared ETag has to be weak:
+        assert ret["headers"]["ETag"] == plain["headers"]["ETag"]
+        assert ret["headers"]["ETag"].startswith('W/"')
+
+        event = helpers.get_event(path="/", headers={"Accept-Encoding": "gzip;q=0"})
+        ret = main.lambda_handler(event, lambda_context)
+        assert "Content-Encoding" not in ret["headers"]
+
+    def test_conditional_get(self, lambda_context, helpers):
+        event = helpers.get_event(path="/")
+        ret = main.lambda_handler(event, lambda_context)
+        etag = ret["headers"]["ETag"]
+        assert etag.startswith('W/"')
+
+        event = helpers.get_event(path="/", headers={"If-None-Match": etag})
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 304
+        assert ret["body"] == ""
+        assert ret["headers"]["ETag"] == etag
+        assert ret["headers"]["Vary"] == "Accept-Encoding"
+
+        event = helpers.get_event(path="/", headers={"If-None-Match": '"stale"'})
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+
+    def test_etag_matches(self):
+        assert etag_matches('"a", "b"', '"b"')
+        assert etag_matches('W/"b"', '"b"')
+        assert etag_matches("*", '"b"')
+        assert not etag_matches(None, '"b"')
+        assert not etag_matches('"a"', '"b"')
+        assert etag_matches('"b"', 'W/"b"')
+
+    def test_accepts_gzip(self, helpers):
+        def accepts(accept_encoding):
+            event = helpers.get_event(headers={"accept-encoding": accept_encoding})
+            return accepts_gzip(APIGatewayProxyEventV2(event))
+
+        assert accepts("gzip")
+        assert accepts("br, GZIP;q=0.5")
+        assert accepts("*")
+        assert not accepts("gzip;q=0")
+        assert not accepts("br, gzip; q=0.000")
+        assert not accepts("identity, *;q=0")
+        assert not accepts("br")
+        assert not accepts("")
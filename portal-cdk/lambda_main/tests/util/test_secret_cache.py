@@ -0,0 +1,60 @@
+import pytest
+from opensarlab.auth import encryptedjwt
+
+from util.secret_cache import SecretCache
+
+SSO_TOKEN = "er9LnqEOiH+JLBsFCy0kVeba6ZSlG903cliU7VYKnM8="
+
+
+class TestSecretCache:
+    def test_secret_fetched_once(self, monkeypatch):
+        calls = []
+
+        def fake_get_secret(name):
+            calls.append(name)
+            return "secret-value"
+
+        monkeypatch.setattr(
+            "aws_lambda_powertools.utilities.parameters.get_secret", fake_get_secret
+        )
+        cache = SecretCache("my-secret", ttl=60, refresh_ahead=0)
+
+        assert cache.get() == "secret-value"
+        assert cache.get() == "secret-value"
+        assert calls == ["my-secret"], "Secret should only be fetched once"
+        assert cache.version == 1
+
+    def test_secret_expired_and_cleared(self, monkeypatch):
+        values = iter(["first", "second", "third"])
+        monkeypatch.setattr(
+            "aws_lambda_powertools.utilities.parameters.get_secret",
+            lambda name: next(values),
+        )
+        # A TTL of 0 means every call is a miss:
+        cache = SecretCache("my-secret", ttl=0)
+        assert cache.get() == "first"
+        assert cache.get() == "second"
+        assert cache.version == 2
+
+        cache = SecretCache("my-secret", ttl=60)
+        assert cache.get() == "third"
+        cache.clear()
+        # Cleared cache should fetch again:
+        with pytest.raises(StopIteration):
+            cache.get()
+
+    def test_prefetch_never_raises(self, monkeypatch, helpers):
+        monkeypatch.setattr(
+            "aws_lambda_powertools.utilities.parameters.get_secret",
+            lambda name: helpers.raise_error(error=Exception("No network")),
+        )
+        assert not SecretCache("my-secret").prefetch()
+        assert not SecretCache(None).prefetch()
+
+    def test_encrypt_compatible_with_encryptedjwt(self, fake_get_secret):
+        from util.auth import encrypt_data, decrypt_data
+
+        data = {"username": "test_user", "labs": ["testlab"]}
+        # Labs decrypt with opensarlab's encryptedjwt, so the format has to match:
+        assert encryptedjwt.decrypt(encrypt_data(data), sso_token=SSO_TOKEN) == data
+        assert decrypt_data(encryptedjwt.encrypt(data, sso_token=SSO_TOKEN)) == data
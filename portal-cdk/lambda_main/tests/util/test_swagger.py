@@ -5,6 +5,7 @@ SWAGGER_EXCLUDED_ENDPOINTS = {
         ("GET", "/portal/hub"),
         ("GET", "/portal/hub/home"),
         ("GET", "/portal/hub/auth"),
+        ("GET", "/portal/hub/launch/{lab_short_name}"),
     ],
     "portal_root": [
         ("GET", "/portal"),
@@ -45,9 +46,17 @@ SWAGGER_INCLUDED_ENDPOINTS = {
         ("GET", "/portal/access/labs/{username}"),
         ("PUT", "/portal/access/labs/{username}"),
         ("DELETE", "/portal/access/labs/{username}"),
+        ("GET", "/portal/access/health"),
+        ("GET", "/portal/access/report"),
+        ("GET", "/portal/access/catalog"),
+        ("PUT", "/portal/access/catalog/{shortname}"),
+        ("DELETE", "/portal/access/catalog/{shortname}"),
+        ("POST", "/portal/access/compliance/{shortname}"),
     ],
     "hub": [
         ("POST", "/portal/hub/auth"),
+        ("GET", "/portal/hub/jwks.json"),
+        ("GET", "/portal/hub/token/version"),
     ],
 }
 
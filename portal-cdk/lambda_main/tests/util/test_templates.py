@@ -0,0 +1,73 @@
+import os
+import shutil
+
+import pytest
+
+from jinja2 import FileSystemLoader, ModuleLoader
+
+from util.template_env import (
+    COMPILED_TEMPLATE_DIR,
+    ENV_OPTIONS,
+    MANIFEST_NAME,
+    TEMPLATE_DIR,
+    PortalEnvironment,
+    compile_templates,
+    compiled_templates_current,
+)
+
+
+class TestPrecompiledTemplates:
+    def test_compiled_templates_match_sources(self, tmp_path):
+        compiled_dir = str(tmp_path / "compiled")
+        names = compile_templates(compiled_dir)
+        assert "portal.j2" in names
+        assert compiled_templates_current(compiled_dir)
+
+        source_env = PortalEnvironment(
+            loader=FileSystemLoader(TEMPLATE_DIR), **ENV_OPTIONS
+        )
+        for name in names:
+            source, filename, _ = source_env.loader.get_source(source_env, name)
+            expected = source_env.compile(
+                source, name, filename, raw=True, defer_init=True
+            )
+            module_file = os.path.join(
+                compiled_dir, ModuleLoader.get_module_filename(name)
+            )
+            with open(module_file, "r") as f:
+                assert f.read() == expected, f"Compiled '{name}' doesn't match source"
+
+        # And they render the same thing:
+        compiled_env = PortalEnvironment(
+            loader=ModuleLoader(compiled_dir), **ENV_OPTIONS
+        )
+        assert compiled_env.get_template("noscript.j2").render() == (
+            source_env.get_template("noscript.j2").render()
+        )
+
+    def test_stale_compiled_templates_not_used(self, tmp_path):
+        template_dir = tmp_path / "templates"
+        compiled_dir = str(tmp_path / "compiled")
+        shutil.copytree(TEMPLATE_DIR, template_dir)
+        compile_templates(compiled_dir, str(template_dir))
+        assert compiled_templates_current(compiled_dir, str(template_dir))
+
+        with open(template_dir / "noscript.j2", "a") as f:
+            f.write("<!-- changed -->")
+        assert not compiled_templates_current(compiled_dir, str(template_dir))
+        assert not compiled_templates_current(str(tmp_path / "missing"))
+
+    def test_bundled_templates_are_current(self, tmp_path):
+        # Only exists after `make compile-templates`:
+        if not os.path.isdir(COMPILED_TEMPLATE_DIR):
+            pytest.skip("No compiled templates, run `make compile-templates`")
+        assert compiled_templates_current(), "Re-run `make compile-templates`"
+
+        # A fresh build from the same sources has to match what's bundled:
+        names = compile_templates(str(tmp_path))
+        for name in [MANIFEST_NAME, *map(ModuleLoader.get_module_filename, names)]:
+            with open(tmp_path / name, "r") as fresh:
+                with open(os.path.join(COMPILED_TEMPLATE_DIR, name), "r") as bundled:
+                    assert fresh.read() == bundled.read(), (
+                        f"Bundled '{name}' is stale, re-run `make compile-templates`"
+                    )
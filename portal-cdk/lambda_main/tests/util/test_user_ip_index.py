@@ -0,0 +1,187 @@
+import os
+import json
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import main
+from util.exceptions import MalformedRequest
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+USER_IP_INDEX_TABLE_NAME = "FAKE_USER_IP_INDEX_TABLE_NAME"
+
+
+def _event(username, ip_address, days_ago=0, country_code="US"):
+    return {
+        "username": username,
+        "ip_address": ip_address,
+        "country_code": country_code,
+        "access_roles": "user",
+        "timestamp": int((time.time() - days_ago * 86400) * 1000),
+    }
+
+
+@mock_aws
+class TestUserIpIndex:
+    def setup_method(self, method):
+        table = boto3.resource("dynamodb", region_name=REGION).create_table(
+            TableName=USER_IP_INDEX_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[
+                {"AttributeName": "address", "KeyType": "HASH"},
+                {"AttributeName": "username", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "address", "AttributeType": "S"},
+                {"AttributeName": "username", "AttributeType": "S"},
+            ],
+        )
+        self.table = table
+
+    def test_find_ip_users(self, monkeypatch):
+        from util.user_ip_index import find_ip_users, ip_keys, record_ip_use
+
+        monkeypatch.setattr("util.user_ip_index._ip_index_table", self.table)
+
+        assert ip_keys("10.1.2.3") == ("ip#10.1.2.3", "net#10.1.2.0/24")
+        assert ip_keys("2001:db8:0:1::5") == (
+            "ip#2001:db8:0:1::5",
+            "net#2001:db8:0:1::/64",
+        )
+
+        record_ip_use(
+            [
+                _event("miner1", "10.1.2.3", days_ago=2),
+                _event("miner1", "10.1.2.3"),
+                _event("miner2", "10.1.2.200", days_ago=1, country_code="CA"),
+                _event("old_user", "10.1.2.3", days_ago=60),
+                _event("elsewhere", "10.9.9.9"),
+                _event("v6_user", "2001:db8:0:1::5"),
+                _event("bad_ip", "not-an-ip"),
+            ]
+        )
+
+        users = find_ip_users("10.1.2.3")
+        assert [user["username"] for user in users] == ["miner1"]
+        assert users[0]["first_seen"] < users[0]["last_seen"]
+
+        users = find_ip_users("10.1.2.0/24")
+        assert [user["username"] for user in users] == ["miner1", "miner2"]
+        assert users[1]["country_code"] == "CA"
+        assert users[1]["ip_addresses"] == ["10.1.2.200"]
+
+        # Narrower than the indexed /24:
+        assert [user["username"] for user in find_ip_users("10.1.2.128/25")] == [
+            "miner2"
+        ]
+        users = find_ip_users("10.1.2.3", days=90)
+        assert "old_user" in {user["username"] for user in users}
+        assert [user["username"] for user in find_ip_users("2001:db8:0:1::/64")] == [
+            "v6_user"
+        ]
+
+        with pytest.raises(MalformedRequest):
+            find_ip_users("10.1.0.0/16")
+        with pytest.raises(MalformedRequest):
+            find_ip_users("bogus")
+
+    def test_out_of_order_batches(self, monkeypatch):
+        from util.user_ip_index import find_ip_users, record_ip_use
+
+        monkeypatch.setattr("util.user_ip_index._ip_index_table", self.table)
+
+        record_ip_use([_event("miner1", "10.1.2.3", days_ago=1, country_code="CA")])
+        newest = self.table.get_item(
+            Key={"address": "ip#10.1.2.3", "username": "miner1"}
+        )
+        # A batch from before that one, from another address in the subnet too:
+        record_ip_use(
+            [
+                _event("miner1", "10.1.2.3", days_ago=3, country_code="US"),
+                _event("miner1", "10.1.2.4", days_ago=2, country_code="US"),
+            ]
+        )
+        item = self.table.get_item(
+            Key={"address": "ip#10.1.2.3", "username": "miner1"}
+        )["Item"]
+        assert item["last_seen"] == newest["Item"]["last_seen"]
+        assert item["first_seen"] < item["last_seen"]
+        assert item["country_code"] == "CA"
+
+        users = find_ip_users("10.1.2.0/24")
+        assert users[0]["ip_addresses"] == ["10.1.2.3", "10.1.2.4"]
+        assert users[0]["last_seen"] == item["last_seen"]
+        # Each address keeps its own last_seen:
+        assert find_ip_users("10.1.2.4/32")[0]["last_seen"] < item["last_seen"]
+
+    def test_subnet_addresses_trimmed(self, monkeypatch):
+        from util.user_ip_index import USER_IP_INDEX_DAYS, record_ip_use
+
+        monkeypatch.setattr("util.user_ip_index._ip_index_table", self.table)
+
+        record_ip_use([_event("miner1", "10.1.2.3", days_ago=USER_IP_INDEX_DAYS + 1)])
+        record_ip_use([_event("miner1", "10.1.2.4")])
+        item = self.table.get_item(
+            Key={"address": "net#10.1.2.0/24", "username": "miner1"}
+        )["Item"]
+        assert list(item["addresses"]) == ["10.1.2.4"]
+
+    def test_flush_updates_ip_index(self, monkeypatch):
+        from cachetools import TTLCache
+        from util.user_ip_index import find_ip_users
+        from util.user_ip_logs_stream import queue_user_ip_log, flush_user_ip_logs
+
+        monkeypatch.setenv("USER_IP_INDEX_TABLE_NAME", USER_IP_INDEX_TABLE_NAME)
+        monkeypatch.setattr("util.user_ip_index._ip_index_table", self.table)
+        monkeypatch.setattr(
+            "util.user_ip_logs_stream._ip_history_recent",
+            TTLCache(maxsize=10, ttl=300),
+        )
+        # Only the index is checked here, not CloudWatch:
+        monkeypatch.setattr(
+            "util.user_ip_logs_stream._put_ip_log_events", lambda events: {}
+        )
+
+        queue_user_ip_log(
+            username="fakeuser",
+            ip_address="192.0.2.10",
+            country_code="US",
+            access_roles="user",
+        )
+        assert flush_user_ip_logs() == 1
+        assert [user["username"] for user in find_ip_users("192.0.2.10")] == [
+            "fakeuser"
+        ]
+
+    def test_ip_endpoint(self, monkeypatch, lambda_context, fake_auth, helpers):
+        from util.user_ip_index import record_ip_use
+
+        monkeypatch.setattr("util.user_ip_index._ip_index_table", self.table)
+        record_ip_use([_event("miner1", "10.1.2.3")])
+
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+        event = helpers.get_event(
+            path="/portal/users/ip",
+            cookies=fake_auth,
+            qparams={"address": "10.1.2.0/24", "days": "7"},
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
+
+        monkeypatch.setenv("USER_IP_INDEX_TABLE_NAME", USER_IP_INDEX_TABLE_NAME)
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        body = json.loads(ret["body"])
+        assert [user["username"] for user in body["users"]] == ["miner1"]
+        assert body["days"] == 7
+
+        # Nothing older than USER_IP_INDEX_DAYS is kept to look through:
+        for days in ("0", "91"):
+            event = helpers.get_event(
+                path="/portal/users/ip",
+                cookies=fake_auth,
+                qparams={"address": "10.1.2.0/24", "days": days},
+            )
+            assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
@@ -4,12 +4,19 @@ import json
 import boto3
 from moto import mock_aws
 
-from util.user_ip_logs_stream import send_user_ip_logs, get_user_ip_logs
+from util.user_ip_logs_stream import (
+    send_user_ip_logs,
+    get_user_ip_logs,
+    queue_user_ip_log,
+    flush_user_ip_logs,
+    get_recent_user_ips,
+)
 from util.exceptions import EnvironmentNotSet
 
 REGION = os.getenv("STACK_REGION", "us-west-2")
 USER_IP_LOGS_GROUP_NAME = "FAKE_USER_IP_LOGS_GROUP_NAME"
 USER_IP_LOGS_STREAM_NAME = "FAKE_USER_IP_LOGS_STREAM_NAME"
+USER_IP_HISTORY_TABLE_NAME = "FAKE_USER_IP_HISTORY_TABLE_NAME"
 
 
 @mock_aws
@@ -83,6 +90,36 @@ class TestUserIpLogsClass:
 
         assert response["events"] == []
 
+    def test_user_ip_logs_buffered(self, monkeypatch):
+        monkeypatch.setenv("USER_IP_LOGS_GROUP_NAME", USER_IP_LOGS_GROUP_NAME)
+        monkeypatch.setenv("USER_IP_LOGS_STREAM_NAME", USER_IP_LOGS_STREAM_NAME)
+        monkeypatch.setattr("util.user_ip_logs_stream.USER_IP_LOGS_BATCH_SIZE", 2)
+
+        def get_events():
+            return self.logs_client.get_log_events(
+                logGroupName=USER_IP_LOGS_GROUP_NAME,
+                logStreamName=USER_IP_LOGS_STREAM_NAME,
+                startFromHead=True,
+            )["events"]
+
+        # Under the size/age thresholds, nothing is sent inside the request:
+        queue_user_ip_log(**self.message)
+        assert flush_user_ip_logs(after_response=False) == 0
+        assert get_events() == []
+
+        # Hitting the batch size sends everything:
+        queue_user_ip_log(**self.message)
+        assert flush_user_ip_logs(after_response=False) == 2
+        assert len(get_events()) == 2
+
+        # After the response, always send what's left:
+        queue_user_ip_log(**self.message)
+        assert flush_user_ip_logs() == 1
+        assert flush_user_ip_logs() == 0
+        assert [event["message"] for event in get_events()] == [
+            json.dumps(self.message)
+        ] * 3
+
     def test_user_get_logs_from_cloudwatch(self, monkeypatch):
         monkeypatch.setenv("USER_IP_LOGS_GROUP_NAME", USER_IP_LOGS_GROUP_NAME)
         monkeypatch.setenv("USER_IP_LOGS_STREAM_NAME", USER_IP_LOGS_STREAM_NAME)
@@ -111,3 +148,78 @@ class TestUserIpLogsClass:
 
         query_value: str = results[0]["@message"]
         assert json.dumps(self.message) == query_value
+
+    def test_user_ip_history(self, monkeypatch):
+        from cachetools import TTLCache
+
+        monkeypatch.setenv("USER_IP_LOGS_GROUP_NAME", USER_IP_LOGS_GROUP_NAME)
+        monkeypatch.setenv("USER_IP_LOGS_STREAM_NAME", USER_IP_LOGS_STREAM_NAME)
+        monkeypatch.setenv("USER_IP_HISTORY_TABLE_NAME", USER_IP_HISTORY_TABLE_NAME)
+        table = boto3.resource("dynamodb", region_name=REGION).create_table(
+            TableName=USER_IP_HISTORY_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[
+                {"AttributeName": "username", "KeyType": "HASH"},
+                {"AttributeName": "timestamp", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "username", "AttributeType": "S"},
+                {"AttributeName": "timestamp", "AttributeType": "N"},
+            ],
+        )
+        monkeypatch.setattr("util.user_ip_logs_stream._ip_history_table", table)
+        monkeypatch.setattr(
+            "util.user_ip_logs_stream._ip_history_recent",
+            TTLCache(maxsize=10, ttl=300),
+        )
+
+        # The same IP over and over is only kept once:
+        for _ in range(3):
+            queue_user_ip_log(**self.message)
+        queue_user_ip_log(**{**self.message, "ip_address": "10.0.0.1"})
+        assert flush_user_ip_logs() == 4
+        send_user_ip_logs(**self.message)
+        assert table.scan()["Count"] == 2
+
+        results = get_recent_user_ips("fakeuser", limit=5)
+        assert [result["ip_address"] for result in results] == ["10.0.0.1", "0.0.0.0"]
+        assert results[0]["access_roles"] == "user"
+        assert results[0]["@timestamp"] >= results[1]["@timestamp"]
+        assert get_recent_user_ips("fakeuser", limit=1)[0]["ip_address"] == "10.0.0.1"
+        assert get_recent_user_ips("someoneelse") == []
+
+    def test_user_ip_logs_query_reused(self, monkeypatch):
+        from util.user_ip_logs_stream import (
+            start_user_ip_logs_query,
+            poll_user_ip_logs_query,
+        )
+
+        monkeypatch.setenv("USER_IP_LOGS_GROUP_NAME", USER_IP_LOGS_GROUP_NAME)
+        monkeypatch.setenv("USER_IP_LOGS_STREAM_NAME", USER_IP_LOGS_STREAM_NAME)
+        send_user_ip_logs(**self.message)
+
+        started = []
+        start_query = self.logs_client.start_query
+
+        def counting_start_query(**kwargs):
+            started.append(kwargs)
+            return start_query(**kwargs)
+
+        monkeypatch.setattr(self.logs_client, "start_query", counting_start_query)
+        query_override = "fields @message"
+
+        # Async: a handle right away, then results when polled:
+        query = start_user_ip_logs_query(query_override=query_override)
+        assert "results" not in query
+        response = poll_user_ip_logs_query(query["query_id"])
+        assert response["complete"] is True
+        assert len(response["results"]) == 1
+
+        # The same lookup again doesn't start another query:
+        assert start_user_ip_logs_query(query_override=query_override)["results"]
+        assert len(get_user_ip_logs(query_override=query_override)) == 1
+        assert len(started) == 1
+
+        # A different one does:
+        get_user_ip_logs(query_override="fields @timestamp")
+        assert len(started) == 2
@@ -0,0 +1,175 @@
+import os
+import json
+import datetime
+
+import boto3
+from moto import mock_aws
+
+import main
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+USER_TABLE_NAME = "TestUserTable"
+
+
+def _timestamp(date: str) -> int:
+    return int(
+        datetime.datetime.fromisoformat(date).replace(tzinfo=datetime.UTC).timestamp()
+    )
+
+
+@mock_aws
+class TestUserActivity:
+    def setup_method(self, method):
+        import util.user.dynamo_db
+        from util.user.activity import activity_fields
+
+        util.user.dynamo_db._DYNAMO_CLIENT = boto3.client(
+            "dynamodb", region_name=REGION
+        )
+        util.user.dynamo_db._DYNAMO_DB = boto3.resource("dynamodb", region_name=REGION)
+        util.user.dynamo_db._DYNAMO_DB.create_table(
+            TableName=USER_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "username", "AttributeType": "S"},
+                {"AttributeName": "activity_bucket", "AttributeType": "S"},
+                {"AttributeName": "last_activity", "AttributeType": "N"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": util.user.dynamo_db.ACTIVITY_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "activity_bucket", "KeyType": "HASH"},
+                        {"AttributeName": "last_activity", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "KEYS_ONLY"},
+                }
+            ],
+        )
+        table = util.user.dynamo_db._DYNAMO_DB.Table(USER_TABLE_NAME)
+        util.user.dynamo_db._DYNAMO_TABLE = table
+
+        for username, date in [
+            ("dec_user", "2024-12-31T23:00:00"),
+            ("jan_user1", "2025-01-05T00:00:00"),
+            ("jan_user2", "2025-01-20T00:00:00"),
+            ("feb_user", "2025-02-10T00:00:00"),
+            ("active_user", "2025-03-15T00:00:00"),
+        ]:
+            table.put_item(
+                Item={
+                    "username": username,
+                    "_rec_counter": 1,
+                    **activity_fields(_timestamp(date)),
+                }
+            )
+        # Hasn't logged in since activity was tracked:
+        table.put_item(
+            Item={
+                "username": "old_user",
+                "_rec_counter": 1,
+                "last_cookie_assignment": "2024-11-02 10:00:00",
+            }
+        )
+
+    def test_activity_buckets(self):
+        from util.user.activity import activity_buckets
+
+        assert activity_buckets(
+            _timestamp("2024-11-15T00:00:00"), _timestamp("2025-02-01T00:00:00")
+        ) == ["2024-11", "2024-12", "2025-01"]
+
+    def test_get_inactive_users(self):
+        from util.user.activity import get_inactive_users, iter_inactive_users
+
+        before = _timestamp("2025-03-01T00:00:00")
+        after = _timestamp("2024-10-01T00:00:00")
+
+        users, cursor = get_inactive_users(before, after, limit=2)
+        assert [user["username"] for user in users] == ["dec_user", "jan_user1"]
+        assert cursor is not None
+        users, cursor = get_inactive_users(before, after, limit=2, cursor=cursor)
+        assert [user["username"] for user in users] == ["jan_user2", "feb_user"]
+
+        batches = list(iter_inactive_users(before, after, batch_size=3))
+        assert [len(batch) for batch in batches] == [3, 1]
+        assert "active_user" not in {user["username"] for user in batches[-1]}
+
+    def test_login_and_backfill(self):
+        from util.user.user import User
+        from util.user.activity import activity_bucket, backfill_activity
+        from util.user.dynamo_db import get_item
+
+        user = User("dec_user")
+        rec_counter = get_item("dec_user")["_rec_counter"]
+        user.update_last_cookie_assignment()
+        item = get_item("dec_user")
+        assert item["activity_bucket"] == activity_bucket(int(item["last_activity"]))
+        assert item["activity_bucket"] == user.activity_bucket
+        assert item["last_cookie_assignment"]
+        # One write for all three:
+        assert item["_rec_counter"] == rec_counter + 1
+
+        # Recent enough, not written again:
+        user.record_activity()
+        assert get_item("dec_user")["_rec_counter"] == rec_counter + 1
+
+        # A login after the backfill scanned it wins:
+        scanned = {"username": "old_user", **get_item("old_user")}
+        User("old_user").update_last_cookie_assignment()
+        assert not backfill_activity(scanned)
+        assert get_item("old_user")["activity_bucket"] != "2024-11"
+
+    def test_record_activity(self):
+        from util.user.user import User
+        from util.user.dynamo_db import get_item
+
+        # Still on the refresh cookie from their last login:
+        user = User("feb_user")
+        user.record_activity()
+        item = get_item("feb_user")
+        assert item["last_activity"] > _timestamp("2025-02-10T00:00:00")
+        assert item["last_cookie_assignment"] is None
+
+    def test_activity_migration(self, lambda_context):
+        import migrate
+        from util.user.dynamo_db import get_item
+
+        ret = migrate.lambda_handler({"migration": "activity"}, lambda_context)
+        assert ret == {"migration": "activity", "updated": 1, "next": None}
+        item = get_item("old_user")
+        assert item["activity_bucket"] == "2024-11"
+        assert item["_rec_counter"] == 2
+        # Nothing left to do:
+        ret = migrate.lambda_handler({"migration": "activity"}, lambda_context)
+        assert ret["updated"] == 0
+
+    def test_inactive_endpoint(self, monkeypatch, lambda_context, fake_auth, helpers):
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+
+        qparams = {"before": "2025-02-01", "after": "2024-12-01", "limit": "2"}
+        event = helpers.get_event(
+            path="/portal/users/inactive", cookies=fake_auth, qparams=qparams
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        body = json.loads(ret["body"])
+        assert [user["username"] for user in body["users"]] == ["dec_user", "jan_user1"]
+
+        event = helpers.get_event(
+            path="/portal/users/inactive",
+            cookies=fake_auth,
+            qparams={**qparams, "next": body["next"]},
+        )
+        body = json.loads(main.lambda_handler(event, lambda_context)["body"])
+        assert [user["username"] for user in body["users"]] == ["jan_user2"]
+        assert body["next"] is None
+
+        event = helpers.get_event(
+            path="/portal/users/inactive",
+            cookies=fake_auth,
+            qparams={"before": "last week"},
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
@@ -0,0 +1,114 @@
+import os
+import json
+
+import boto3
+from moto import mock_aws
+
+import main
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+USER_TABLE_NAME = "TestUserTable"
+
+
+@mock_aws
+class TestEmailLookup:
+    def setup_method(self, method):
+        import util.user.dynamo_db
+
+        util.user.dynamo_db._DYNAMO_CLIENT = boto3.client(
+            "dynamodb", region_name=REGION
+        )
+        util.user.dynamo_db._DYNAMO_DB = boto3.resource("dynamodb", region_name=REGION)
+        util.user.dynamo_db._DYNAMO_DB.create_table(
+            TableName=USER_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "username", "AttributeType": "S"},
+                {"AttributeName": "email_normalized", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": util.user.dynamo_db.EMAIL_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "email_normalized", "KeyType": "HASH"}
+                    ],
+                    "Projection": {"ProjectionType": "KEYS_ONLY"},
+                }
+            ],
+        )
+        util.user.dynamo_db._DYNAMO_TABLE = util.user.dynamo_db._DYNAMO_DB.Table(
+            USER_TABLE_NAME
+        )
+
+    def test_find_by_email(self):
+        import util.user.dynamo_db
+        from util.user.user import User, clear_identity_map
+        from util.user.dynamo_db import get_item, get_usernames_by_email
+
+        user = User("test_user")
+        user.email = "Test.User@Example.com"
+        assert get_item("test_user")["email_normalized"] == "test.user@example.com"
+        assert User.find_by_email(" test.user@EXAMPLE.com") is user
+        assert User.find_by_email("someone@example.com") is None
+
+        # Changing it moves the user in the index:
+        user.email = "new@example.com"
+        assert User.find_by_email("test.user@example.com") is None
+        assert User.find_by_email("new@example.com") is user
+
+        # Clearing it takes the user out of the index:
+        user.email = None
+        assert "email_normalized" not in get_item("test_user")
+        assert get_usernames_by_email("new@example.com") == []
+
+        # Users saved before the index are added the next time they load:
+        util.user.dynamo_db._DYNAMO_TABLE.put_item(
+            Item={"username": "old_user", "email": "Old@Example.com", "_rec_counter": 1}
+        )
+        clear_identity_map()
+        User("old_user")
+        assert "email_normalized" in get_item("old_user")
+        assert get_usernames_by_email("old@example.com") == ["old_user"]
+
+    def test_email_migration(self, monkeypatch, lambda_context):
+        import migrate
+        import util.user.dynamo_db
+        from util.user.dynamo_db import get_item, get_usernames_by_email
+
+        table = util.user.dynamo_db._DYNAMO_TABLE
+        for username, email in [("old_user", "Old@Example.com"), ("no_email", None)]:
+            table.put_item(
+                Item={"username": username, "email": email, "_rec_counter": 1}
+            )
+
+        # Found by the fallback until it's indexed:
+        assert get_usernames_by_email("old@example.com") == ["old_user"]
+        monkeypatch.setattr("util.user.dynamo_db.EMAIL_INDEX_BACKFILLED", True)
+        assert get_usernames_by_email("old@example.com") == []
+
+        ret = migrate.lambda_handler({"migration": "email"}, lambda_context)
+        assert ret == {"migration": "email", "updated": 1, "next": None}
+        assert get_item("old_user")["email_normalized"] == "old@example.com"
+        assert "email_normalized" not in get_item("no_email")
+        assert get_usernames_by_email("old@example.com") == ["old_user"]
+
+    def test_lookup_endpoint(self, monkeypatch, lambda_context, fake_auth, helpers):
+        from util.user.user import User
+
+        User("test_user").email = "test_user@example.com"
+
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+
+        event = helpers.get_event(
+            path="/portal/users/lookup",
+            cookies=fake_auth,
+            qparams={"email": "TEST_USER@example.com"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert json.loads(ret["body"])["usernames"] == ["test_user"]
+
+        event = helpers.get_event(path="/portal/users/lookup", cookies=fake_auth)
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
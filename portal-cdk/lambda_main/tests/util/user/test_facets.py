@@ -0,0 +1,159 @@
+import os
+import json
+
+import boto3
+from moto import mock_aws
+
+import main
+
+REGION = os.getenv("STACK_REGION", "us-west-2")
+USER_TABLE_NAME = "TestUserTable"
+
+
+@mock_aws
+class TestUserFacets:
+    def setup_method(self, method):
+        import util.user.dynamo_db
+        from util.user.indexed import FACET_INDEX, FACET_KEY
+
+        util.user.dynamo_db._DYNAMO_CLIENT = boto3.client(
+            "dynamodb", region_name=REGION
+        )
+        util.user.dynamo_db._DYNAMO_DB = boto3.resource("dynamodb", region_name=REGION)
+        util.user.dynamo_db._DYNAMO_DB.create_table(
+            TableName=USER_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "username", "AttributeType": "S"},
+                {"AttributeName": FACET_KEY, "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": FACET_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": FACET_KEY, "KeyType": "HASH"},
+                        {"AttributeName": "username", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+        )
+        util.user.dynamo_db._DYNAMO_TABLE = util.user.dynamo_db._DYNAMO_DB.Table(
+            USER_TABLE_NAME
+        )
+
+        from util.user.user import User
+
+        # New users need a profile update, and have no labs:
+        User("new_user")
+        admin = User("admin_user")
+        admin.access = ["user", "admin"]
+        admin.require_profile_update = False
+        locked = User("locked_user")
+        locked.is_locked = True
+        locked.require_profile_update = False
+        locked.labs = {"testlab": {"lab_profiles": ["m6a.large"]}}
+
+    def _usernames(self, **kwargs) -> list[str]:
+        from util.user.dynamo_db import get_all_items
+
+        return sorted(item["username"] for item in get_all_items(**kwargs))
+
+    def test_facet_keys(self):
+        from util.user.indexed import facet_keys_with
+
+        keys = facet_keys_with(["admin", "locked"])
+        assert len(keys) == 4
+        assert keys[0] == "admin#locked"
+        assert "admin#locked#no_labs#profile_update" in keys
+        assert len(facet_keys_with([])) == 16
+
+    def test_facet_filters(self, monkeypatch):
+        from util.user.user import User
+
+        monkeypatch.setattr("util.user.dynamo_db.FACET_INDEX_BACKFILLED", True)
+        assert self._usernames(facets=["admin"]) == ["admin_user"]
+        assert self._usernames(facets=["locked"]) == ["locked_user"]
+        assert self._usernames(facets=["profile_update"]) == ["new_user"]
+        assert self._usernames(facets=["no_labs"]) == ["admin_user", "new_user"]
+        assert self._usernames(facets=["no_labs", "profile_update"]) == ["new_user"]
+        assert self._usernames(facets=["no_labs"], username_filter="admin") == [
+            "admin_user"
+        ]
+
+        # Facets follow the attributes they come from:
+        user = User("locked_user")
+        user.is_locked = False
+        user.labs = {}
+        assert self._usernames(facets=["locked"]) == []
+        assert "locked_user" in self._usernames(facets=["no_labs"])
+
+    def _put_old_admin(self):
+        import util.user.dynamo_db
+
+        # Saved before facet_key existed:
+        util.user.dynamo_db._DYNAMO_TABLE.put_item(
+            Item={
+                "username": "old_admin",
+                "access": ["user", "admin"],
+                "labs": {},
+                "require_profile_update": False,
+                "_rec_counter": 1,
+            }
+        )
+
+    def test_facets_synced_on_load(self, monkeypatch):
+        from util.user.user import User
+        from util.user.dynamo_db import get_item
+
+        self._put_old_admin()
+        # Until the migration has run, it's worked out from the item:
+        assert "old_admin" in self._usernames(facets=["admin", "no_labs"])
+
+        monkeypatch.setattr("util.user.dynamo_db.FACET_INDEX_BACKFILLED", True)
+        assert "old_admin" not in self._usernames(facets=["admin"])
+        User("old_admin")
+        assert get_item("old_admin")["facet_key"] == "admin#no_labs"
+        assert "old_admin" in self._usernames(facets=["admin", "no_labs"])
+
+    def test_facets_migration(self, monkeypatch, lambda_context):
+        import migrate
+        from util.user.dynamo_db import get_item
+
+        self._put_old_admin()
+        ret = migrate.lambda_handler({"migration": "facets"}, lambda_context)
+        assert ret == {"migration": "facets", "updated": 1, "next": None}
+        assert get_item("old_admin")["facet_key"] == "admin#no_labs"
+
+        monkeypatch.setattr("util.user.dynamo_db.FACET_INDEX_BACKFILLED", True)
+        assert self._usernames(facets=["admin"]) == ["admin_user", "old_admin"]
+
+    def test_users_list_endpoint(self, monkeypatch, lambda_context, fake_auth, helpers):
+        monkeypatch.setattr("util.user.dynamo_db.FACET_INDEX_BACKFILLED", True)
+        user = helpers.FakeUser(access=["user", "admin"])
+        monkeypatch.setattr("util.auth.User", lambda *args, **kwargs: user)
+
+        event = helpers.get_event(
+            path="/portal/users/list",
+            cookies=fake_auth,
+            qparams={"facets": "no_labs,admin"},
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        body = json.loads(ret["body"])
+        assert [user["username"] for user in body["users"]] == ["admin_user"]
+        assert body["exceeded"] is False
+
+        event = helpers.get_event(
+            path="/portal/users", cookies=fake_auth, qparams={"facets": "locked"}
+        )
+        ret = main.lambda_handler(event, lambda_context)
+        assert ret["statusCode"] == 200
+        assert "/portal/profile/form/locked_user" in ret["body"]
+        assert "/portal/profile/form/new_user" not in ret["body"]
+
+        event = helpers.get_event(
+            path="/portal/users/list", cookies=fake_auth, qparams={"facets": "bogus"}
+        )
+        assert main.lambda_handler(event, lambda_context)["statusCode"] == 400
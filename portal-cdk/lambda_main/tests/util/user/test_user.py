@@ -219,7 +219,7 @@ class TestUserClass:
         assert username not in [x["username"] for x in get_all_items()]
 
     def test_user_profile_in_cache(self, monkeypatch):
-        from util.user.user import User
+        from util.user.user import User, clear_identity_map
         from util.user.dynamo_db import is_cached
 
         monkeypatch.setattr(
@@ -229,13 +229,17 @@ class TestUserClass:
         username = "test_user_cache1"
         assert not is_cached(username)
 
+        ## Each User below pretends to be a different request, so
+        #  clear the identity map to hit the profile cache instead.
         # Create a user
         _user_copy_0 = User(username=username)
+        clear_identity_map()
 
         # Pull a user, this will be cached since it is not a create
         user_copy_1 = User(username=username)
         assert is_cached(username)
         assert not user_copy_1.is_admin()
+        clear_identity_map()
 
         # Mutate cache
         from util.user.dynamo_db import PROFILE_CACHE
@@ -249,14 +253,40 @@ class TestUserClass:
         # Remove item from cache
         user_copy_1.remove_user()
         assert not is_cached(username)
+        clear_identity_map()
 
         # ensure cache record counter is increment
         user_copy_3 = User(username=username)
         uc3_counter_initial = user_copy_3._rec_counter
         user_copy_3.access = list(user_copy_3.access) + ["admin"]
+        clear_identity_map()
         user_copy_4 = User(username=username)
         assert user_copy_4._rec_counter != uc3_counter_initial
 
+    def test_user_identity_map(self, monkeypatch):
+        from util.user.user import User, clear_identity_map
+
+        username = "test_user_identity"
+        user_1 = User(username=username)
+
+        # Nothing should hit the DB while the user is in the identity map:
+        monkeypatch.setattr(
+            "util.user.user.get_item",
+            lambda *args, **kwargs: pytest.fail("User should not be re-loaded"),
+        )
+        user_2 = User(username=username, create_if_missing=False)
+        assert user_2 is user_1, "Same username should be the same User in a request"
+
+        user_2.email = "identity@user.com"
+        assert user_1.email == "identity@user.com"
+
+        # Next request gets a fresh copy:
+        monkeypatch.undo()
+        clear_identity_map()
+        user_3 = User(username=username)
+        assert user_3 is not user_1
+        assert user_3.email == "identity@user.com"
+
     def test_user_is_locked_method(self):
         from util.user.user import User
 
@@ -313,9 +343,12 @@ class TestUserClass:
         assert user1.ip_address is None
         assert user1.country_code is None
 
-        update_user_ip_in_db(**message)
+        assert update_user_ip_in_db(**message), "New IP should be written"
 
         user2 = User(username=message["username"])
 
         assert user2.ip_address == "0.0.0.0"
         assert user2.country_code == "ZZ"
+
+        # Same values again shouldn't touch the DB:
+        assert not update_user_ip_in_db(**message, user=user2)
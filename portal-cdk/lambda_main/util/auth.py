@@ -15,13 +15,13 @@ from util.exceptions import (
 from util.session import current_session, PortalAuth
 from util.format import render_template
 import util.cognito
-from util.user_ip_logs_stream import send_user_ip_logs, update_user_ip_in_db
+from util.secret_cache import SecretCache
+from util.user_ip_logs_stream import queue_user_ip_log, update_user_ip_in_db
 
 import requests
 import jwt
 from jwt.algorithms import RSAAlgorithm
 from opensarlab.auth import encryptedjwt
-from aws_lambda_powertools.utilities import parameters
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.middleware_factory import lambda_handler_decorator
 
@@ -38,13 +38,15 @@ TOKEN_URL = f"{util.cognito.COGNITO_HOST}/oauth2/token"
 REVOKE_TOKEN_URL = f"{util.cognito.COGNITO_HOST}/oauth2/revoke"
 
 SSO_TOKEN_SECRET_NAME = os.getenv("SSO_TOKEN_SECRET_NAME")
+# Long-lived cache of the SSO secret, instead of the 5-second Powertools default:
+SSO_SECRET = SecretCache(SSO_TOKEN_SECRET_NAME)
 
 JWT_VALIDATION = None
 USER_PROFILES = {}
 
 
 def encrypt_data(data: dict | str) -> str:
-    sso_token = parameters.get_secret(SSO_TOKEN_SECRET_NAME)
+    sso_token = SSO_SECRET.get()
     try:
         return encryptedjwt.encrypt(data, sso_token=sso_token)
     except encryptedjwt.BadTokenException as e:
@@ -58,7 +60,7 @@ def encrypt_data(data: dict | str) -> str:
 
 
 def decrypt_data(data):
-    sso_token = parameters.get_secret(SSO_TOKEN_SECRET_NAME)
+    sso_token = SSO_SECRET.get()
     return encryptedjwt.decrypt(data, sso_token=sso_token)
 
 
@@ -268,12 +270,59 @@ def delete_cookies():
     return cookies
 
 
+def resolve_session_user():
+    """
+    Exchange the session cookie for a validated User. Registered by `process_auth`
+    and only run the first time `current_session.user` is read.
+    """
+    jwt_cookie = current_session.auth.cognito.raw
+    if not jwt_cookie:
+        logger.debug(f"No {COGNITO_JWT_COOKIE} cookie provided")
+        return None
+
+    # jwt_cookie is the Cognito REFRESH token
+    # Attempt to convert REFRESH to ACCESS token
+    tokens = refresh_map(jwt_cookie)
+    access_token = tokens.get("access_token")
+    validated_access_jwt = validate_jwt(access_token)
+    validated_id_jwt = validate_jwt(
+        tokens.get("id_token"),
+        aud=util.cognito.COGNITO_CLIENT_ID,
+    )
+    logger.debug({"validated_access_jwt": validated_access_jwt})
+    logger.debug({"validated_id_jwt": validated_id_jwt})
+
+    if not validated_access_jwt:
+        return None
+
+    jwt_username = validated_access_jwt["username"]
+    logger.debug("JWT Username is %s", jwt_username)
+    current_session.auth.cognito.decoded = validated_access_jwt
+    current_session.auth.cognito.username = jwt_username
+    current_session.auth.cognito.email = validated_id_jwt["email"]
+    current_session.auth.cognito.valid = True
+
+    # Get User info
+    user = User(username=jwt_username)
+    # Check that we have the correct email
+    if user.email != validated_id_jwt["email"]:
+        logger.debug(
+            "Setting user %s email to %s",
+            jwt_username,
+            validated_id_jwt["email"],
+        )
+        user.email = validated_id_jwt["email"]
+    # Refresh cookies last weeks without a login, so sessions count as activity too:
+    user.record_activity()
+
+    return user
+
+
 @lambda_handler_decorator
 def process_auth(handler, event, context):
     # Cookies we care about:
     cookies = get_cookies_from_event(event)
     current_session.auth = PortalAuth()
-    current_session.user = None
 
     if cookies.get(PORTAL_USER_COOKIE):
         portal_username_cookie = cookies.get(PORTAL_USER_COOKIE)
@@ -282,42 +331,10 @@ def process_auth(handler, event, context):
         logger.debug(f"No {PORTAL_USER_COOKIE} cookie provided")
 
     if cookies.get(COGNITO_JWT_COOKIE):
-        # jwt_cookie is the Cognito REFRESH token
-        jwt_cookie = cookies.get(COGNITO_JWT_COOKIE)
-        current_session.auth.cognito.raw = jwt_cookie
-
-        # Attempt to convert REFRESH to ACCESS token
-        tokens = refresh_map(jwt_cookie)
-        access_token = tokens.get("access_token")
-        validated_access_jwt = validate_jwt(access_token)
-        validated_id_jwt = validate_jwt(
-            tokens.get("id_token"),
-            aud=util.cognito.COGNITO_CLIENT_ID,
-        )
-        logger.debug({"validated_access_jwt": validated_access_jwt})
-        logger.debug({"validated_id_jwt": validated_id_jwt})
-
-        if validated_access_jwt:
-            jwt_username = validated_access_jwt["username"]
-            logger.debug("JWT Username is %s", jwt_username)
-            current_session.auth.cognito.decoded = validated_access_jwt
-            current_session.auth.cognito.username = jwt_username
-            current_session.auth.cognito.email = validated_id_jwt["email"]
-            current_session.auth.cognito.valid = True
-
-            # Get User info
-            current_session.user = User(username=jwt_username)
-            # Check that we have the correct email
-            if current_session.user.email != validated_id_jwt["email"]:
-                logger.debug(
-                    "Setting user %s email to %s",
-                    jwt_username,
-                    validated_id_jwt["email"],
-                )
-                current_session.user.email = validated_id_jwt["email"]
+        current_session.auth.cognito.raw = cookies.get(COGNITO_JWT_COOKIE)
 
-    else:
-        logger.debug(f"No {COGNITO_JWT_COOKIE} cookie provided")
+    # Only pay for token validation + User lookup if the route asks for the user:
+    current_session.defer_user(resolve_session_user)
 
     # process the actual request
     return handler(event, context)
@@ -328,7 +345,8 @@ def require_access(access="user", human: bool = False):
         def wrapper(*args, **kwargs):
             # app is pulled in from outer scope via a function attribute
 
-            # Check for cookie auth
+            # Check for cookie auth (resolves the session, if it hasn't been yet)
+            _ = current_session.user
             username = current_session.auth.cognito.username
 
             if not username:
@@ -369,7 +387,8 @@ def require_access(access="user", human: bool = False):
                 ip_address = ip_address_with_port.rsplit(":", 1)[0]
 
                 if ip_address != "0.0.0.0" and country_code != "ZZ":
-                    send_user_ip_logs(
+                    # Buffered, gets sent to CloudWatch after the response:
+                    queue_user_ip_log(
                         **{
                             "ip_address": ip_address,
                             "country_code": country_code,
@@ -377,11 +396,13 @@ def require_access(access="user", human: bool = False):
                             "access_roles": ",".join(current_session.user.access),
                         }
                     )
+                    # Only writes if they changed:
                     update_user_ip_in_db(
                         **{
                             "ip_address": ip_address,
                             "country_code": country_code,
                             "username": username,
+                            "user": current_session.user,
                         }
                     )
 
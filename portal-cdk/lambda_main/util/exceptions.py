@@ -38,6 +38,15 @@ class BadSsoToken(GenericFatalError):
         super().__init__(message, error_code, extra_info)
 
 
+class BadLabToken(GenericFatalError):
+    """
+    Raised if a lab token isn't valid, or the key to sign them with isn't.
+    """
+
+    def __init__(self, message, error_code=401, extra_info=None):
+        super().__init__(message, error_code, extra_info)
+
+
 class DbError(GenericFatalError):
     """
     Raised if there is a problem with the DB.
@@ -119,3 +128,12 @@ class EnvironmentNotSet(GenericFatalError):
 
     def __init__(self, message, error_code=400, extra_info=None):
         super().__init__(message, error_code, extra_info)
+
+
+class CatalogConflict(GenericFatalError):
+    """
+    Raised if the lab catalog changed since the version a write was based on.
+    """
+
+    def __init__(self, message, error_code=409, extra_info=None):
+        super().__init__(message, error_code, extra_info)
@@ -1,30 +1,27 @@
 import json
-import os
 import ast
-import copy
 
 from util.responses import wrap_response
 from util.session import current_session
 from util.cognito import LOGIN_URL, LOGOUT_URL, FORGOT_PASSWORD_URL, SIGNUP_URL
+from static import static_url
+from util.template_env import (
+    build_environment,
+    uses_compiled_templates,
+    warm_template_cache,
+)
 
-from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+from cachetools import LRUCache
+from markupsafe import Markup
 
 from aws_lambda_powertools import Logger
 
 logger = Logger(child=True)
 
-# Get current file location template loading
-absolute_path = os.path.abspath(__file__)
-current_directory = os.path.dirname(absolute_path)
-
-ENV = Environment(
-    loader=FileSystemLoader(f"{current_directory}/../templates/"),
-    autoescape=select_autoescape(),
-    undefined=StrictUndefined,
-    trim_blocks=True,
-    lstrip_blocks=True,
-    keep_trailing_newline=True,
-)
+# Uses the precompiled templates when they're bundled, see util/template_env.py
+ENV = build_environment()
+# Versioned asset URLs, so browsers can cache them forever:
+ENV.globals["static_url"] = static_url
 
 NAV_BAR_OPTIONS = [
     {
@@ -67,11 +64,48 @@ NAV_BAR_OPTIONS = [
 ]
 
 
+# Rendered fragments that only depend on a handful of inputs (lab cards, nav links),
+# keyed by (template_name, key). See render_fragment().
+FRAGMENT_CACHE = LRUCache(maxsize=256)
+
+
+def warm_templates() -> None:
+    # Pay for loading templates during init, not during the first request:
+    count = warm_template_cache(ENV)
+    logger.debug(
+        "Loaded %s templates (precompiled: %s)", count, uses_compiled_templates(ENV)
+    )
+
+
 def jinja_template(template_input, template_name):
     template = ENV.get_template(template_name)
     return template.render(**template_input)
 
 
+def render_fragment(template_name: str, key: tuple, template_input: dict) -> Markup:
+    """
+    Render a template, or re-use the last render with the same key.
+    `key` has to cover everything in `template_input` that can change the output.
+    """
+    cache_key = (template_name, key)
+    fragment = FRAGMENT_CACHE.get(cache_key)
+    if fragment is None:
+        fragment = Markup(jinja_template(template_input, template_name))
+        FRAGMENT_CACHE[cache_key] = fragment
+    return fragment
+
+
+def render_nav_links(is_admin: bool) -> Markup:
+    nav_bar_options = [
+        option
+        for option in NAV_BAR_OPTIONS
+        if option["visible"] or (is_admin and option.get("requires_admin"))
+    ]
+    return render_fragment(
+        "navbar_links.j2", (is_admin,), {"nav_bar_options": nav_bar_options}
+    )
+
+
 def render_template(content, input=None, name=None, title=None):
     # Check for a logged-out return path
     current_event = current_session.app.current_event
@@ -86,17 +120,17 @@ def render_template(content, input=None, name=None, title=None):
 
     username = current_session.auth.cognito.username
 
+    # Only use the user if the route already resolved it. Rendering
+    # a public page shouldn't be what triggers a session lookup.
+    user = current_session.user if current_session.user_resolved else None
+
     # Manage restrict access
-    nav_bar_options = copy.deepcopy(NAV_BAR_OPTIONS)
-    for option in nav_bar_options:
-        if current_session.user and option.get("requires_admin"):
-            if "admin" in current_session.user.access:
-                option["visible"] = True
+    is_admin = bool(user) and "admin" in user.access
 
     # Create input dict for jinja formatting
     template_input = {
         "content": content,
-        "nav_bar_options": nav_bar_options,
+        "nav_links": render_nav_links(is_admin),
         "username": username,
         "title": title,
         "login_url": LOGIN_URL,
@@ -106,6 +140,8 @@ def render_template(content, input=None, name=None, title=None):
         "return_path": f"&state={return_path}" if return_path else "",
         "reset_password_url": FORGOT_PASSWORD_URL,
         "reset_mfa_url": "/mfa",
+        # Served from S3, see util/pages.py:
+        "prerendered": False,
     }
     if input:
         template_input.update(input)
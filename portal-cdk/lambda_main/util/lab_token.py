@@ -0,0 +1,168 @@
+"""
+Short-lived, signed lab access tokens.
+
+When a user launches a lab from the portal, we hand them a token (as a cookie
+scoped to that lab) signed with the portal's Ed25519 key. Labs verify it locally
+against the published JWKS (`/portal/hub/jwks.json`), so they only need to call
+back to the portal when the token is missing, expired, or its `ver` claim is out
+of date (`/portal/hub/token/version`, authenticated with the token itself).
+
+The private key is a PEM in Secrets Manager, named by `LAB_TOKEN_SECRET_NAME`. After
+it's rotated, the previous version's key (AWSPREVIOUS) is still published and
+accepted, so tokens and JWKS labs already have keep working until they expire.
+"""
+
+import os
+import json
+import time
+import hashlib
+import functools
+
+import jwt
+from jwt.algorithms import OKPAlgorithm
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from aws_lambda_powertools import Logger
+
+import util.labs
+from util.exceptions import BadLabToken
+from util.secret_cache import SecretCache
+from util.user import User
+
+logger = Logger(child=True)
+
+LAB_TOKEN_COOKIE = "portal-lab-token"
+LAB_TOKEN_ALGORITHM = "EdDSA"
+# Seconds a lab token is valid for:
+LAB_TOKEN_TTL = int(os.getenv("LAB_TOKEN_TTL", str(5 * 60)))
+LAB_TOKEN_ISSUER = f"https://{os.getenv('DEPLOYMENT_HOSTNAME', 'localhost')}"
+
+LAB_TOKEN_SECRET = SecretCache(os.getenv("LAB_TOKEN_SECRET_NAME"))
+LAB_TOKEN_PREVIOUS_SECRET = SecretCache(
+    os.getenv("LAB_TOKEN_SECRET_NAME"), version_stage="AWSPREVIOUS"
+)
+
+
+@functools.lru_cache(maxsize=2)
+def _load_signing_key(private_key_pem: str) -> tuple[Ed25519PrivateKey, str, dict]:
+    """Parse the key (and build its JWK) once per secret value."""
+    try:
+        private_key = serialization.load_pem_private_key(
+            private_key_pem.encode("utf-8"), password=None
+        )
+    except (ValueError, TypeError) as e:
+        raise BadLabToken(
+            "Lab token signing key is not a valid PEM", error_code=500
+        ) from e
+    if not isinstance(private_key, Ed25519PrivateKey):
+        raise BadLabToken(
+            "Lab token signing key must be an Ed25519 key", error_code=500
+        )
+
+    public_bytes = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw,
+    )
+    kid = hashlib.sha256(public_bytes).hexdigest()[:16]
+    jwk = OKPAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    jwk |= {"kid": kid, "alg": LAB_TOKEN_ALGORITHM, "use": "sig"}
+    return private_key, kid, jwk
+
+
+def get_signing_key() -> tuple[Ed25519PrivateKey, str, dict]:
+    return _load_signing_key(LAB_TOKEN_SECRET.get())
+
+
+def get_previous_key() -> tuple[Ed25519PrivateKey, str, dict] | None:
+    """The key from before the last rotation, None if there isn't a usable one."""
+    try:
+        return _load_signing_key(LAB_TOKEN_PREVIOUS_SECRET.get())
+    except Exception as e:
+        # Never rotated, or the secret's first value wasn't a key:
+        logger.debug(f"No previous lab token key: {e}")
+        return None
+
+
+def get_jwks() -> dict:
+    """Public keys labs use to verify lab tokens."""
+    _, kid, jwk = get_signing_key()
+    keys = [jwk]
+    previous = get_previous_key()
+    if previous and previous[1] != kid:
+        keys.append(previous[2])
+    return {"keys": keys}
+
+
+def _user_claims(user: User, lab_access: dict | None) -> dict:
+    """The claims that come from the user, for the lab the token is for."""
+    return {
+        "admin": user.is_admin(),
+        "roles": sorted(user.access),
+        "lab_access": lab_access,
+        "country_code": user.profile["country_of_residence"],
+        "force_user_profile_update": user.require_profile_update,
+    }
+
+
+def lab_token_version(user: User, lab_access: dict | None) -> str:
+    """
+    Changes whenever the token's claims for this lab would, or the user is locked, or
+    the lab config changed. Labs compare this against the token's `ver` claim to catch
+    revoked access early, and unrelated writes (activity, IPs) don't invalidate it.
+    """
+    versioned = _user_claims(user, lab_access) | {
+        "is_locked": bool(user.is_locked),
+        "labs_version": util.labs.LABS_VERSION,
+    }
+    config = json.dumps(versioned, sort_keys=True, default=str)
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+
+
+def issue_lab_token(user: User, lab_short_name: str, lab_access: dict) -> str:
+    private_key, kid, _ = get_signing_key()
+    now = int(time.time())
+    claims = {
+        "iss": LAB_TOKEN_ISSUER,
+        "sub": user.username,
+        "aud": lab_short_name,
+        "iat": now,
+        "exp": now + LAB_TOKEN_TTL,
+        "ver": lab_token_version(user, lab_access),
+        **_user_claims(user, lab_access),
+    }
+    logger.debug(f"Issuing lab token for {user.username} to {lab_short_name}")
+    return jwt.encode(
+        claims, private_key, algorithm=LAB_TOKEN_ALGORITHM, headers={"kid": kid}
+    )
+
+
+def read_lab_token(token: str) -> dict:
+    """
+    Claims of a lab token we issued (for any lab), if it hasn't expired.
+    Raises `BadLabToken` otherwise.
+    """
+    private_key, kid, _ = get_signing_key()
+    try:
+        token_kid = jwt.get_unverified_header(token).get("kid")
+        if token_kid not in (None, kid):
+            # Signed before the last rotation:
+            previous = get_previous_key()
+            if previous and previous[1] == token_kid:
+                private_key = previous[0]
+        return jwt.decode(
+            token,
+            private_key.public_key(),
+            algorithms=[LAB_TOKEN_ALGORITHM],
+            issuer=LAB_TOKEN_ISSUER,
+            options={"verify_aud": False, "require": ["sub", "exp"]},
+        )
+    except jwt.InvalidTokenError as e:
+        raise BadLabToken(f"Lab token is not valid: {e}") from e
+
+
+def lab_token_cookie(token: str, lab_short_name: str) -> str:
+    # Only ever sent to the lab it was issued for:
+    return (
+        f"{LAB_TOKEN_COOKIE}={token}; Path=/lab/{lab_short_name}/; "
+        f"Max-Age={LAB_TOKEN_TTL}; Secure; HttpOnly; SameSite=Lax"
+    )
@@ -1,6 +1,9 @@
 from .base_lab import BaseLab, daac_limited_restricted_status
 
 import os
+import json
+import hashlib
+from dataclasses import asdict
 
 PROD_LABS = {
     "smce-prod-opensarlab": BaseLab(
@@ -205,7 +208,24 @@ NON_PROD_LABS = {
     ),
 }
 
+# The built-in catalog. LABS starts as a copy of it, and is updated in place when
+# the lab catalog (util/labs/catalog.py) loads a newer version:
 if os.getenv("IS_PROD", "false").lower() == "true":
-    LABS: dict[str, BaseLab] = PROD_LABS
+    BUILTIN_LABS: dict[str, BaseLab] = PROD_LABS
 else:
-    LABS: dict[str, BaseLab] = NON_PROD_LABS
+    BUILTIN_LABS: dict[str, BaseLab] = NON_PROD_LABS
+LABS: dict[str, BaseLab] = dict(BUILTIN_LABS)
+
+
+def labs_version(labs: dict[str, BaseLab]) -> str:
+    """
+    Short hash of the lab config. Anything cached from LABS (like the hub
+    auth payload) should be keyed on this, so a config change invalidates it.
+    """
+    config = json.dumps(
+        {name: asdict(lab) for name, lab in labs.items()}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+
+
+LABS_VERSION = labs_version(LABS)
@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+from functools import cached_property
 import requests
 
 
@@ -26,11 +27,28 @@ class BaseLab:
     crypto_remediation_role_arn: str = None
     default_profiles: list = field(default_factory=lambda: [])
 
-    def is_healthy(self) -> bool:
+    # Set lookups, computed once. They aren't fields, so they're left out of asdict():
+    @cached_property
+    def prohibited_countries(self) -> frozenset[str]:
+        return frozenset(self.ip_country_status["prohibited"])
+
+    @cached_property
+    def allowed_profile_set(self) -> frozenset[str]:
+        return frozenset(self.allowed_profiles)
+
+    @property
+    def health_url(self) -> str:
+        return f"{self.deployment_url}/lab/{self.short_lab_name}/hub/health"
+
+    def is_healthy(
+        self, session: requests.Session = None, timeout: float = 0.1
+    ) -> bool:
+        # Pass a session to re-use its connection pool between checks:
+        getter = session.get if session else requests.get
         try:
-            ret = requests.get(
-                url=f"{self.deployment_url}/lab/{self.short_lab_name}/hub/health",
-                timeout=0.1,
+            ret = getter(
+                url=self.health_url,
+                timeout=timeout,
                 verify=False,
             )
         except requests.exceptions.ReadTimeout:
@@ -0,0 +1,148 @@
+"""
+Lab access for many users at once, for reports and exports.
+
+Same rules as `LabAccessPolicy` (util/labs/policy.py), but users come in as
+columns (username, country code, admin flag, and a lab membership bitmap), and
+the visibility/access matrices are computed with NumPy instead of per user.
+"""
+
+from dataclasses import dataclass
+from typing import Iterable
+
+import numpy as np
+
+import util.labs
+from util.labs import BaseLab
+
+
+@dataclass(frozen=True)
+class UserColumns:
+    usernames: np.ndarray  # (users,) str
+    country_codes: np.ndarray  # (users,) str, "" if unknown
+    is_admin: np.ndarray  # (users,) bool
+    lab_members: np.ndarray  # (users, labs) bool, columns in `lab_names` order
+    lab_names: tuple[str, ...]
+
+    @classmethod
+    def from_items(cls, items: Iterable[dict], lab_names: Iterable[str]):
+        """Columns from user table items (like `get_all_items()` returns)."""
+        items = list(items)
+        lab_names = tuple(lab_names)
+        lab_index = {name: i for i, name in enumerate(lab_names)}
+
+        lab_members = np.zeros((len(items), len(lab_names)), dtype=bool)
+        for row, item in enumerate(items):
+            for lab_name in item.get("labs") or {}:
+                # Labs that were removed from the config don't count:
+                if lab_name in lab_index:
+                    lab_members[row, lab_index[lab_name]] = True
+
+        return cls(
+            usernames=np.array([item["username"] for item in items], dtype=str),
+            country_codes=np.array(
+                [item.get("country_code") or "" for item in items], dtype=str
+            ),
+            is_admin=np.array(
+                ["admin" in (item.get("access") or []) for item in items], dtype=bool
+            ),
+            lab_members=lab_members,
+            lab_names=lab_names,
+        )
+
+
+@dataclass(frozen=True)
+class AccessMatrix:
+    usernames: np.ndarray
+    lab_names: tuple[str, ...]
+    # All (users, labs) bool:
+    members: np.ndarray
+    visible: np.ndarray
+    accessible: np.ndarray
+    geo_blocked: np.ndarray
+
+    def lab_summary(self) -> dict[str, dict[str, int]]:
+        members = self.members.sum(axis=0)
+        visible = self.visible.sum(axis=0)
+        accessible = self.accessible.sum(axis=0)
+        geo_blocked = self.geo_blocked.sum(axis=0)
+        return {
+            lab_name: {
+                "members": int(members[i]),
+                "visible": int(visible[i]),
+                "accessible": int(accessible[i]),
+                "geo_blocked": int(geo_blocked[i]),
+            }
+            for i, lab_name in enumerate(self.lab_names)
+        }
+
+    def lab_members(self, lab_name: str) -> list[dict]:
+        """Every member of `lab_name`, with whether they can actually use it."""
+        column = self.lab_names.index(lab_name)
+        rows = np.flatnonzero(self.members[:, column])
+        return [
+            {
+                "username": str(self.usernames[row]),
+                "accessible": bool(self.accessible[row, column]),
+                "geo_blocked": bool(self.geo_blocked[row, column]),
+            }
+            for row in rows
+        ]
+
+
+class BatchLabAccessEvaluator:
+    def __init__(self, labs: dict[str, BaseLab]):
+        self.lab_names = tuple(labs)
+        self.private = np.array(
+            [lab.accessibility == "private" for lab in labs.values()], dtype=bool
+        )
+        # One row per country that's prohibited anywhere, plus an all-False row
+        # at the end for every other country:
+        self.countries = sorted(
+            {code for lab in labs.values() for code in lab.prohibited_countries}
+        )
+        self.prohibited = np.zeros(
+            (len(self.countries) + 1, len(self.lab_names)), dtype=bool
+        )
+        for row, country_code in enumerate(self.countries):
+            for column, lab in enumerate(labs.values()):
+                self.prohibited[row, column] = country_code in lab.prohibited_countries
+        self._country_rows = {code: row for row, code in enumerate(self.countries)}
+
+    def evaluate(self, users: UserColumns) -> AccessMatrix:
+        if users.lab_names != self.lab_names:
+            raise ValueError("UserColumns were built for a different set of labs")
+
+        # Only map each distinct country once, not once per user:
+        codes, inverse = np.unique(users.country_codes, return_inverse=True)
+        code_rows = np.array(
+            [self._country_rows.get(code, len(self.countries)) for code in codes],
+            dtype=np.intp,
+        )
+        prohibited = self.prohibited[code_rows[inverse.reshape(-1)]]
+
+        admin = users.is_admin[:, np.newaxis]
+        held = users.lab_members
+        geo_blocked = held & prohibited & ~admin
+        return AccessMatrix(
+            usernames=users.usernames,
+            lab_names=self.lab_names,
+            members=held,
+            visible=admin | ~self.private | held,
+            accessible=admin | (held & ~prohibited),
+            geo_blocked=geo_blocked,
+        )
+
+
+# (labs, LABS_VERSION, evaluator) for the last compiled evaluator
+_COMPILED: tuple | None = None
+
+
+def get_batch_evaluator(
+    labs: dict[str, BaseLab] | None = None,
+) -> BatchLabAccessEvaluator:
+    global _COMPILED
+    labs = util.labs.LABS if labs is None else labs
+    version = util.labs.LABS_VERSION
+    if _COMPILED is None or _COMPILED[0] is not labs or _COMPILED[1] != version:
+        _COMPILED = (labs, version, BatchLabAccessEvaluator(labs))
+    return _COMPILED[2]
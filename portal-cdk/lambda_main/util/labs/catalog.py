@@ -0,0 +1,220 @@
+"""
+The lab catalog: LABS as a versioned document in DynamoDB, so lab config changes
+(profiles, country lists, descriptions...) apply within seconds, without a deploy.
+
+The catalog table holds:
+    - catalog="current": {version, labs (JSON), updated_at, updated_by}
+    - catalog="v<version>": a copy of every version that was saved, for history.
+
+Until a catalog is saved, the built-in configs in util/labs/__init__.py are
+version 0. `refresh_lab_catalog()` runs at the start of every request, and once
+the last check is LAB_CATALOG_TTL seconds old, reads just the version number. When
+it changed, the whole document is loaded, swapped into `util.labs.LABS` in place (so
+every `from util.labs import LABS` sees it), and `util.labs.LABS_VERSION` changes, so
+everything cached from LABS is rebuilt.
+
+New labs still need a deploy for their CloudFront `/lab/<name>/*` behavior.
+"""
+
+import os
+import time
+import json
+import threading
+from dataclasses import asdict
+
+import boto3
+from cachetools import TTLCache
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from aws_lambda_powertools import Logger
+
+import util.labs
+from util.labs import BaseLab
+from util.exceptions import CatalogConflict, MalformedRequest
+
+logger = Logger(child=True)
+
+CURRENT_KEY = {"catalog": "current"}
+# Seconds a container goes without checking for a newer catalog. The check is one
+# consistent read of just the version number, so it can stay short:
+LAB_CATALOG_TTL = int(os.getenv("LAB_CATALOG_TTL", "10"))
+LAB_ACCESSIBILITY = ("public", "protected", "private")
+
+_CATALOG_TABLE = None
+
+
+def is_lab_catalog_enabled() -> bool:
+    return bool(os.getenv("LAB_CATALOG_TABLE_NAME"))
+
+
+def _get_catalog_table():
+    global _CATALOG_TABLE  # pylint: disable=global-statement
+    if not _CATALOG_TABLE:
+        _CATALOG_TABLE = boto3.resource(
+            "dynamodb", region_name=os.getenv("STACK_REGION", "us-west-2")
+        ).Table(os.getenv("LAB_CATALOG_TABLE_NAME"))
+    return _CATALOG_TABLE
+
+
+def lab_from_dict(short_lab_name: str, config: dict) -> BaseLab:
+    """A BaseLab from (untrusted) config. Raises MalformedRequest if it isn't one."""
+    config = {**config, "short_lab_name": short_lab_name}
+    try:
+        lab = BaseLab(**config)
+    except TypeError as e:
+        raise MalformedRequest(f"Invalid lab config for {short_lab_name}: {e}") from e
+
+    if lab.accessibility not in LAB_ACCESSIBILITY:
+        raise MalformedRequest(f"'accessibility' must be one of {LAB_ACCESSIBILITY}")
+    for field in ("allowed_profiles", "default_profiles"):
+        if not isinstance(getattr(lab, field), list):
+            raise MalformedRequest(f"'{field}' must be a list")
+    status = lab.ip_country_status
+    if not isinstance(status, dict) or not all(
+        isinstance(status.get(key), list) for key in ("limited", "prohibited")
+    ):
+        raise MalformedRequest(
+            "'ip_country_status' must have 'limited' and 'prohibited' lists"
+        )
+    return lab
+
+
+def labs_to_json(labs: dict[str, BaseLab]) -> str:
+    return json.dumps({name: asdict(lab) for name, lab in labs.items()})
+
+
+def labs_from_json(labs_json: str) -> dict[str, BaseLab]:
+    return {
+        name: lab_from_dict(name, config)
+        for name, config in json.loads(labs_json).items()
+    }
+
+
+class LabCatalog:
+    def __init__(self, ttl: int = LAB_CATALOG_TTL):
+        self.version = 0
+        # Holds the version while it's fresh, nothing means it's time to check:
+        self._checked = TTLCache(maxsize=1, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _apply(self, version: int, labs: dict[str, BaseLab]) -> None:
+        # Readers in other threads never see it empty or half loaded, only (briefly)
+        # with labs that are about to be removed:
+        util.labs.LABS.update(labs)
+        for short_lab_name in set(util.labs.LABS) - set(labs):
+            util.labs.LABS.pop(short_lab_name, None)
+        util.labs.LABS_VERSION = (
+            util.labs.labs_version(labs) if version == 0 else f"catalog-{version}"
+        )
+        self.version = version
+        logger.info(f"Lab catalog is now version {version}, with {len(labs)} labs")
+
+    def _due(self) -> bool:
+        return "version" not in self._checked
+
+    def refresh(self, force: bool = False) -> bool:
+        """Load a newer catalog if there is one. True if LABS changed."""
+        if not is_lab_catalog_enabled():
+            return False
+        if not force and not self._due():
+            return False
+
+        with self._lock:
+            # Someone else might have checked while we waited:
+            if not force and not self._due():
+                return False
+            self._checked["version"] = self.version
+
+            table = _get_catalog_table()
+            try:
+                # Just the version, most checks stop here:
+                item = table.get_item(
+                    Key=CURRENT_KEY, ProjectionExpression="version", ConsistentRead=True
+                ).get("Item")
+                version = int(item["version"]) if item else 0
+                if version == self.version:
+                    return False
+                if version == 0:
+                    self._apply(0, util.labs.BUILTIN_LABS)
+                    return True
+
+                item = table.get_item(Key=CURRENT_KEY, ConsistentRead=True)["Item"]
+                labs = labs_from_json(item["labs"])
+            except (ClientError, KeyError, ValueError, MalformedRequest) as e:
+                # Keep serving what we have, and try again next check:
+                logger.error(f"Could not refresh the lab catalog: {e}")
+                return False
+
+            self._apply(int(item["version"]), labs)
+            return True
+
+    def reset(self) -> None:
+        """Back to the built-in catalog (version 0)."""
+        with self._lock:
+            self._checked.clear()
+            self._apply(0, util.labs.BUILTIN_LABS)
+
+
+LAB_CATALOG = LabCatalog()
+
+
+def refresh_lab_catalog() -> bool:
+    return LAB_CATALOG.refresh()
+
+
+def save_lab_catalog(
+    labs: dict[str, BaseLab], expected_version: int, updated_by: str
+) -> int:
+    """
+    Save `labs` as the next catalog version, if the current one is still
+    `expected_version`. Raises CatalogConflict otherwise. Returns the new version.
+    """
+    table = _get_catalog_table()
+    new_version = expected_version + 1
+    document = {
+        "version": new_version,
+        "labs": labs_to_json(labs),
+        "updated_at": int(time.time()),
+        "updated_by": updated_by,
+    }
+    if expected_version == 0:
+        condition = Attr("catalog").not_exists()
+    else:
+        condition = Attr("version").eq(expected_version)
+
+    try:
+        table.put_item(Item={**CURRENT_KEY, **document}, ConditionExpression=condition)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        raise CatalogConflict(
+            f"Lab catalog is no longer version {expected_version}, reload and retry"
+        ) from e
+    table.put_item(Item={"catalog": f"v{new_version}", **document})
+
+    # This container sees its own change right away:
+    LAB_CATALOG.refresh(force=True)
+    return new_version
+
+
+def _labs_at_version(expected_version: int) -> dict[str, BaseLab]:
+    # Edits have to start from the version the caller saw, not a stale copy:
+    LAB_CATALOG.refresh(force=True)
+    if LAB_CATALOG.version != expected_version:
+        raise CatalogConflict(
+            f"Lab catalog is version {LAB_CATALOG.version}, not {expected_version}"
+        )
+    return dict(util.labs.LABS)
+
+
+def put_lab(lab: BaseLab, expected_version: int, updated_by: str) -> int:
+    """Add or replace one lab in the catalog."""
+    labs = _labs_at_version(expected_version)
+    labs[lab.short_lab_name] = lab
+    return save_lab_catalog(labs, expected_version, updated_by)
+
+
+def remove_lab(short_lab_name: str, expected_version: int, updated_by: str) -> int:
+    labs = _labs_at_version(expected_version)
+    labs.pop(short_lab_name)
+    return save_lab_catalog(labs, expected_version, updated_by)
@@ -0,0 +1,97 @@
+"""
+Compliance sweeps: who loses access to a lab when its prohibited countries change.
+
+Only users in the affected countries are read, through the sparse country_code
+index on the user table, and each one is checked with the same `LabAccessPolicy`
+the portal uses. Optionally they're locked, through `User` like any other change.
+"""
+
+from typing import Iterable
+
+from aws_lambda_powertools import Logger
+
+import util.labs
+from util.labs import BaseLab
+from util.labs.policy import get_lab_access_policy
+from util.exceptions import LabDoesNotExist, UserNotFound
+from util.user import User
+from util.user.dynamo_db import get_users_in_countries
+
+logger = Logger(child=True)
+
+
+def newly_prohibited(old_lab: BaseLab | None, new_lab: BaseLab) -> frozenset[str]:
+    """Countries prohibited from `new_lab` that weren't from `old_lab`."""
+    if old_lab is None:
+        return new_lab.prohibited_countries
+    return new_lab.prohibited_countries - old_lab.prohibited_countries
+
+
+def sweep_lab(
+    short_lab_name: str,
+    countries: Iterable[str] | None = None,
+    lock: bool = False,
+    labs: dict[str, BaseLab] | None = None,
+) -> dict:
+    """
+    Find the members of `short_lab_name` in `countries` (default: all of its
+    prohibited countries) that can no longer use it, and lock them if `lock`.
+    """
+    labs = util.labs.LABS if labs is None else labs
+    if short_lab_name not in labs:
+        raise LabDoesNotExist(f"Lab {short_lab_name} does not exist")
+    lab = labs[short_lab_name]
+
+    # Countries that don't block this lab can't take access away:
+    if countries is None:
+        countries = lab.prohibited_countries
+    countries = frozenset(countries) & lab.prohibited_countries
+
+    policy = get_lab_access_policy(labs)
+
+    def loses_access(item) -> bool:
+        permissions = policy.evaluate(
+            "admin" in (item.get("access") or []),
+            item.get("country_code"),
+            frozenset(item.get("labs") or {}),
+        )
+        return short_lab_name not in permissions.accessible
+
+    affected = [
+        item
+        for item in get_users_in_countries(countries, lab_short_name=short_lab_name)
+        if loses_access(item)
+    ]
+
+    locked = []
+    if lock:
+        for item in affected:
+            ## The index is eventually consistent, so check the current item again.
+            #  Saving through User bumps _rec_counter and keeps facet_key in sync.
+            try:
+                user = User(item["username"], create_if_missing=False)
+            except UserNotFound:
+                continue
+            if user.is_locked or not loses_access(dict(user)):
+                continue
+            user.is_locked = True
+            locked.append(user.username)
+        locked.sort()
+        if locked:
+            logger.warning(
+                f"Locked {len(locked)} users in {sorted(countries)} "
+                f"for {short_lab_name}"
+            )
+
+    return {
+        "lab": short_lab_name,
+        "countries": sorted(countries),
+        "affected": sorted(
+            (
+                {"username": item["username"], "country_code": item["country_code"]}
+                for item in affected
+            ),
+            key=lambda user: user["username"],
+        ),
+        "locked": locked,
+    }
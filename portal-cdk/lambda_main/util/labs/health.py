@@ -0,0 +1,147 @@
+"""
+Lab health checks for the portal home page.
+
+Every lab is probed at once on a small thread pool (sharing one connection pool),
+and results are cached for `LAB_HEALTH_TTL` seconds. Once a result is stale, it's
+still served while a fresh check runs in the background (stale-while-revalidate),
+so only the very first page load in a container waits on the labs.
+
+If the scheduled health monitor is deployed (LAB_HEALTH_TABLE_NAME is set), its
+latest results are used instead, and labs are only probed here if it's missing them.
+
+from util.labs.health import get_lab_health
+lab_health = get_lab_health(LABS.values())  # {"short_lab_name": True, ...}
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from aws_lambda_powertools import Logger
+
+from .base_lab import BaseLab
+from .health_history import get_health_status, is_health_monitor_enabled
+
+logger = Logger(child=True)
+
+# Seconds a health check result is considered fresh:
+LAB_HEALTH_TTL = int(os.getenv("LAB_HEALTH_TTL", "30"))
+LAB_HEALTH_WORKERS = int(os.getenv("LAB_HEALTH_WORKERS", "8"))
+
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://", HTTPAdapter(pool_connections=LAB_HEALTH_WORKERS, pool_maxsize=2)
+)
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=LAB_HEALTH_WORKERS, thread_name_prefix="lab-health"
+)
+
+# health_url -> (is_healthy, time.monotonic() it was checked)
+_HEALTH_CACHE: dict[str, tuple[bool, float]] = {}
+# The monitor's status item, and time.monotonic() it was read
+_MONITOR_STATUS: tuple[dict, float] = ({}, 0.0)
+# health_url -> Future of the check currently running
+_IN_FLIGHT: dict[str, Future] = {}
+_LOCK = threading.Lock()
+
+
+def _check_lab(lab: BaseLab) -> bool:
+    try:
+        healthy = lab.is_healthy(session=_SESSION)
+    except Exception as e:
+        logger.warning(f"Health check for {lab.short_lab_name} failed: {e}")
+        healthy = False
+    with _LOCK:
+        _HEALTH_CACHE[lab.health_url] = (healthy, time.monotonic())
+        _IN_FLIGHT.pop(lab.health_url, None)
+    return healthy
+
+
+def _start_check(lab: BaseLab) -> Future:
+    """Must be called with _LOCK held. Never runs two checks for the same lab."""
+    future = _IN_FLIGHT.get(lab.health_url)
+    if future is None:
+        future = _EXECUTOR.submit(_check_lab, lab)
+        _IN_FLIGHT[lab.health_url] = future
+    return future
+
+
+def _get_monitor_status(ttl: int) -> dict:
+    global _MONITOR_STATUS  # pylint: disable=global-statement
+    status, read_at = _MONITOR_STATUS
+    if time.monotonic() - read_at >= ttl:
+        try:
+            status = get_health_status()
+        except Exception as e:
+            logger.warning(f"Could not read lab health status: {e}")
+            status = {}
+        _MONITOR_STATUS = (status, time.monotonic())
+    return status
+
+
+def get_lab_health(labs, ttl: int = LAB_HEALTH_TTL) -> dict[str, bool]:
+    """Health of each lab, keyed by short_lab_name."""
+    labs = list(labs)
+    health = {}
+    if is_health_monitor_enabled():
+        status = _get_monitor_status(ttl)
+        health = {
+            lab.short_lab_name: status[lab.short_lab_name]["healthy"]
+            for lab in labs
+            if lab.short_lab_name in status
+        }
+        labs = [lab for lab in labs if lab.short_lab_name not in health]
+
+    now = time.monotonic()
+    waiting = {}
+    with _LOCK:
+        for lab in labs:
+            cached = _HEALTH_CACHE.get(lab.health_url)
+            if cached is None:
+                # Never checked, we have to wait for this one:
+                waiting[lab.short_lab_name] = _start_check(lab)
+                continue
+            healthy, checked_at = cached
+            if now - checked_at >= ttl:
+                # Serve the stale value, refresh for next time:
+                _start_check(lab)
+            health[lab.short_lab_name] = healthy
+
+    # All of these run at the same time, so this waits for the slowest one only:
+    for short_lab_name, future in waiting.items():
+        health[short_lab_name] = future.result()
+    return health
+
+
+def probe_labs(labs, timeout: float) -> dict[str, dict]:
+    """
+    Check every lab right now (concurrently), for the health monitor.
+    Returns {short_lab_name: {"healthy": bool, "latency_ms": int}}.
+    """
+
+    def _timed_check(lab: BaseLab) -> dict:
+        start = time.perf_counter()
+        try:
+            healthy = lab.is_healthy(session=_SESSION, timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Health check for {lab.short_lab_name} failed: {e}")
+            healthy = False
+        return {
+            "healthy": healthy,
+            "latency_ms": int((time.perf_counter() - start) * 1000),
+        }
+
+    futures = {lab.short_lab_name: _EXECUTOR.submit(_timed_check, lab) for lab in labs}
+    return {
+        short_lab_name: future.result() for short_lab_name, future in futures.items()
+    }
+
+
+def clear_lab_health() -> None:
+    global _MONITOR_STATUS  # pylint: disable=global-statement
+    with _LOCK:
+        _HEALTH_CACHE.clear()
+        _MONITOR_STATUS = ({}, 0.0)
@@ -0,0 +1,133 @@
+"""
+Lab health, as recorded by the scheduled health monitor (`health_monitor.py`).
+
+The health table holds:
+    - One status item (lab="_status"), with the latest result for every lab.
+      This is all the portal pages need to read.
+    - One history item per lab per check (lab=<short_lab_name>, checked_at=<epoch>),
+      expired by DynamoDB after LAB_HEALTH_HISTORY_DAYS.
+"""
+
+import os
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+STATUS_KEY = {"lab": "_status", "checked_at": 0}
+LAB_HEALTH_HISTORY_DAYS = int(os.getenv("LAB_HEALTH_HISTORY_DAYS", "7"))
+# A status older than this is ignored, the monitor probably isn't running:
+LAB_HEALTH_STATUS_MAX_AGE = int(os.getenv("LAB_HEALTH_STATUS_MAX_AGE", str(5 * 60)))
+
+_HEALTH_TABLE = None
+
+
+def is_health_monitor_enabled() -> bool:
+    return bool(os.getenv("LAB_HEALTH_TABLE_NAME"))
+
+
+def _get_health_table():
+    global _HEALTH_TABLE  # pylint: disable=global-statement
+    if not _HEALTH_TABLE:
+        _HEALTH_TABLE = boto3.resource(
+            "dynamodb", region_name=os.getenv("STACK_REGION", "us-west-2")
+        ).Table(os.getenv("LAB_HEALTH_TABLE_NAME"))
+    return _HEALTH_TABLE
+
+
+def get_health_status() -> dict:
+    """
+    Latest check for every lab, as
+    {short_lab_name: {"healthy", "latency_ms", "failures", "checked_at"}}.
+    Empty if there isn't a recent one.
+    """
+    item = _get_health_table().get_item(Key=STATUS_KEY).get("Item")
+    if not item or time.time() - int(item["updated_at"]) > LAB_HEALTH_STATUS_MAX_AGE:
+        return {}
+    # DynamoDB hands numbers back as Decimal:
+    return {
+        short_lab_name: {
+            "healthy": bool(result["healthy"]),
+            "latency_ms": int(result["latency_ms"]),
+            "failures": int(result["failures"]),
+            "checked_at": int(result["checked_at"]),
+        }
+        for short_lab_name, result in item["labs"].items()
+    }
+
+
+def record_health_checks(results: dict, now: int = None) -> dict:
+    """
+    Save the results of a monitor run (`{short_lab_name: {"healthy", "latency_ms"}}`).
+    Returns the new status.
+    """
+    now = int(now or time.time())
+    table = _get_health_table()
+
+    previous = table.get_item(Key=STATUS_KEY).get("Item", {}).get("labs", {})
+    status = {}
+    for short_lab_name, result in results.items():
+        failures = 0
+        if not result["healthy"]:
+            failures = int(previous.get(short_lab_name, {}).get("failures", 0)) + 1
+        status[short_lab_name] = {
+            "healthy": result["healthy"],
+            "latency_ms": int(result["latency_ms"]),
+            "failures": failures,
+            "checked_at": now,
+        }
+
+    expires_at = now + LAB_HEALTH_HISTORY_DAYS * 24 * 60 * 60
+    with table.batch_writer() as batch:
+        batch.put_item(Item={**STATUS_KEY, "updated_at": now, "labs": status})
+        for short_lab_name, result in status.items():
+            batch.put_item(
+                Item={
+                    "lab": short_lab_name,
+                    "checked_at": now,
+                    "healthy": result["healthy"],
+                    "latency_ms": result["latency_ms"],
+                    "expires_at": expires_at,
+                }
+            )
+    return status
+
+
+def _percentile(sorted_values: list, percent: int) -> int | None:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, -(-percent * len(sorted_values) // 100))
+    return int(sorted_values[rank - 1])
+
+
+def get_health_stats(short_lab_name: str, since: int) -> dict:
+    """Uptime and latency percentiles of a lab, from the history since `since` (epoch)."""
+    table = _get_health_table()
+    query_params = {
+        "KeyConditionExpression": Key("lab").eq(short_lab_name)
+        & Key("checked_at").gte(since),
+        "ProjectionExpression": "healthy, latency_ms",
+    }
+    response = table.query(**query_params)
+    items = response.get("Items", [])
+    while "LastEvaluatedKey" in response:
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        response = table.query(**query_params)
+        items.extend(response.get("Items", []))
+
+    healthy_checks = sum(1 for item in items if item["healthy"])
+    # Failed checks just hit the timeout, don't let them skew the latency:
+    latencies = sorted(int(item["latency_ms"]) for item in items if item["healthy"])
+    return {
+        "checks": len(items),
+        "uptime": round(healthy_checks / len(items), 4) if items else None,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+        },
+    }
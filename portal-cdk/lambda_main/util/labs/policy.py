@@ -0,0 +1,94 @@
+"""
+Which labs a user can see and use, compiled once from the lab configs.
+
+A user's lab permissions only depend on (is_admin, country_code, labs held), so a
+`LabAccessPolicy` answers them with set operations and remembers the answer for
+each combination. `get_lab_access_policy` re-compiles it when the configs change.
+"""
+
+from dataclasses import dataclass
+from typing import Iterable
+
+from cachetools import LRUCache
+
+import util.labs
+from util.labs import BaseLab
+
+
+@dataclass(frozen=True)
+class LabPermissions:
+    visible: frozenset[str]
+    accessible: frozenset[str]
+
+
+# (is_admin, country_code, labs_held)
+AccessSubject = tuple[bool, str | None, frozenset[str]]
+
+
+def access_subject(user) -> AccessSubject:
+    return (user.is_admin(), user.country_code, frozenset(user.labs))
+
+
+class LabAccessPolicy:
+    def __init__(self, labs: dict[str, BaseLab], cache_size: int = 4096):
+        self.lab_names = frozenset(labs)
+        # Only private labs are hidden from users that don't hold them:
+        self.private_labs = frozenset(
+            name for name, lab in labs.items() if lab.accessibility == "private"
+        )
+        self.open_labs = self.lab_names - self.private_labs
+        # {country_code: labs it's prohibited from}
+        prohibited_labs: dict[str, set[str]] = {}
+        for name, lab in labs.items():
+            for country_code in lab.prohibited_countries:
+                prohibited_labs.setdefault(country_code, set()).add(name)
+        self.prohibited_labs = {
+            country_code: frozenset(names)
+            for country_code, names in prohibited_labs.items()
+        }
+        self._admin = LabPermissions(visible=self.lab_names, accessible=self.lab_names)
+        self._cache = LRUCache(maxsize=cache_size)
+
+    def _evaluate(self, is_admin: bool, country_code, labs_held) -> LabPermissions:
+        if is_admin:
+            return self._admin
+        held = labs_held & self.lab_names
+        return LabPermissions(
+            visible=self.open_labs | held,
+            accessible=held - self.prohibited_labs.get(country_code, frozenset()),
+        )
+
+    def evaluate(
+        self, is_admin: bool, country_code: str | None, labs_held: frozenset[str]
+    ) -> LabPermissions:
+        key = (bool(is_admin), country_code, frozenset(labs_held))
+        permissions = self._cache.get(key)
+        if permissions is None:
+            permissions = self._evaluate(*key)
+            self._cache[key] = permissions
+        return permissions
+
+    def evaluate_many(self, subjects: Iterable[AccessSubject]) -> list[LabPermissions]:
+        """Permissions for each subject, in order. Repeated subjects are only evaluated once."""
+        answers: dict[AccessSubject, LabPermissions] = {}
+        results = []
+        for is_admin, country_code, labs_held in subjects:
+            key = (bool(is_admin), country_code, frozenset(labs_held))
+            if key not in answers:
+                # Batches can be much bigger than the cache, so don't fill it:
+                answers[key] = self._cache.get(key) or self._evaluate(*key)
+            results.append(answers[key])
+        return results
+
+
+# (labs, LABS_VERSION, policy) for the last compiled policy
+_COMPILED: tuple | None = None
+
+
+def get_lab_access_policy(labs: dict[str, BaseLab] | None = None) -> LabAccessPolicy:
+    global _COMPILED
+    labs = util.labs.LABS if labs is None else labs
+    version = util.labs.LABS_VERSION
+    if _COMPILED is None or _COMPILED[0] is not labs or _COMPILED[1] != version:
+        _COMPILED = (labs, version, LabAccessPolicy(labs))
+    return _COMPILED[2]
@@ -0,0 +1,83 @@
+"""
+Pages that look the same for every anonymous visitor.
+
+Their routes render them on demand, and `prerender.py` renders them once per deploy
+into the error bucket, where CloudFront serves them without invoking the Lambda.
+Anyone with a `portal-jwt` cookie is still sent on to `/portal` (see the
+CloudFront Function in the CDK stack).
+"""
+
+from types import SimpleNamespace
+
+from util.format import render_template
+from util.session import current_session, PortalAuth
+
+from aws_lambda_powertools.utilities.data_classes import APIGatewayProxyEventV2
+
+# S3 keys are '<PRERENDER_PREFIX><file name>':
+PRERENDER_PREFIX = "prerendered/"
+
+
+def landing_page(prerendered: bool = False) -> str:
+    return render_template(
+        content="Welcome to OpenScienceLab",
+        title="OpenScienceLab",
+        name="landing.j2",
+        input={"prerendered": prerendered},
+    )
+
+
+def error_page(prerendered: bool = False) -> str:
+    return render_template(
+        content="An unexpected error has occurred",
+        name="error.j2",
+        title="OpenScienceLab: Something went wrong",
+        input={"prerendered": prerendered},
+    )
+
+
+def mfa_request_page(
+    username: str = "", warning: str = "", prerendered: bool = False
+) -> str:
+    req_content = render_template(
+        name="mfa_reset_request.j2",
+        input={"username": username, "warning": warning},
+        content="",
+    )
+    return render_template(
+        content=req_content,
+        title="OpenScienceLab - MFA Reset",
+        name="logged-out.j2",
+        input={"prerendered": prerendered},
+    )
+
+
+# {request path: (file name, renderer)}
+ANONYMOUS_PAGES = {
+    "/": ("index.html", landing_page),
+    "/error": ("error.html", error_page),
+    "/mfa": ("mfa.html", mfa_request_page),
+}
+# {request path: status code}, for the ones that aren't a 200. S3 serves everything
+# as a 200, so CloudFront sets these on the prerendered copies (see the CDK stack):
+ANONYMOUS_PAGE_STATUS = {"/error": 401}
+
+
+def _use_anonymous_session() -> None:
+    # What process_auth leaves behind for a visitor without cookies:
+    current_session.auth = PortalAuth()
+    current_session.user = None
+    current_session.app = SimpleNamespace(
+        current_event=APIGatewayProxyEventV2(
+            {"rawPath": "/", "queryStringParameters": {}, "cookies": []}
+        )
+    )
+
+
+def render_anonymous_pages() -> dict[str, str]:
+    """{file name: html} for every page in ANONYMOUS_PAGES, as an anonymous visitor."""
+    _use_anonymous_session()
+    return {
+        file_name: render(prerendered=True)
+        for file_name, render in ANONYMOUS_PAGES.values()
+    }
@@ -0,0 +1,97 @@
+"""
+Run work after the response has been sent, instead of inside the request.
+
+Lambda freezes the container once the handler returns, *unless* an extension is
+still busy. So we register an internal extension (a thread in this process) that
+waits for each invoke to finish, then runs the registered hooks while the
+client already has its response.
+
+Outside of Lambda (tests, local), or if registration fails, the hooks run at the
+end of the handler with `after_response=False`, so they can decide to only do
+work once a threshold is hit.
+
+from util.post_response import register_post_response_hook
+register_post_response_hook(my_flush_function)  # my_flush_function(after_response: bool)
+"""
+
+import os
+import threading
+
+import requests
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+EXTENSION_NAME = "portal-post-response"
+
+_HOOKS = []
+_REQUEST_DONE = threading.Event()
+_EXTENSION_ID = None
+
+
+def register_post_response_hook(hook) -> None:
+    if hook not in _HOOKS:
+        _HOOKS.append(hook)
+
+
+def _run_hooks(after_response: bool) -> None:
+    for hook in _HOOKS:
+        try:
+            hook(after_response=after_response)
+        except Exception as e:
+            # Never let background work break a request (or kill the extension):
+            logger.exception(f"Post-response hook {hook.__name__} failed: {e}")
+
+
+def _extension_url(path: str) -> str:
+    return f"http://{os.environ['AWS_LAMBDA_RUNTIME_API']}/2020-01-01/extension/{path}"
+
+
+def _extension_loop(extension_id: str) -> None:
+    headers = {"Lambda-Extension-Identifier": extension_id}
+    while True:
+        # Blocks until the next invoke starts. Calling it again tells Lambda we're done.
+        requests.get(_extension_url("event/next"), headers=headers, timeout=None)
+        # Wait for the handler to hand back its response:
+        _REQUEST_DONE.wait()
+        _REQUEST_DONE.clear()
+        _run_hooks(after_response=True)
+
+
+def start_post_response_extension() -> bool:
+    """
+    Register the internal extension. Has to be called during init (at import time).
+    """
+    global _EXTENSION_ID  # pylint: disable=global-statement
+    if _EXTENSION_ID:
+        return True
+    if not os.getenv("AWS_LAMBDA_RUNTIME_API"):
+        # Not running in Lambda
+        return False
+    if os.getenv("POST_RESPONSE_EXTENSION", "true").lower() != "true":
+        return False
+
+    try:
+        response = requests.post(
+            _extension_url("register"),
+            headers={"Lambda-Extension-Name": EXTENSION_NAME},
+            json={"events": ["INVOKE"]},
+            timeout=2,
+        )
+        extension_id = response.headers["Lambda-Extension-Identifier"]
+    except Exception as e:
+        logger.warning(f"Could not register {EXTENSION_NAME} extension: {e}")
+        return False
+
+    threading.Thread(target=_extension_loop, args=(extension_id,), daemon=True).start()
+    _EXTENSION_ID = extension_id
+    logger.debug("Registered %s extension %s", EXTENSION_NAME, extension_id)
+    return True
+
+
+def request_finished() -> None:
+    """Call at the end of every invoke, once the response is ready."""
+    if _EXTENSION_ID:
+        _REQUEST_DONE.set()
+    else:
+        _run_hooks(after_response=False)
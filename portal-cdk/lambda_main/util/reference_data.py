@@ -0,0 +1,35 @@
+"""
+Constant inputs that only change with a deploy: the country list, and lookup sets
+derived from the lab configs.
+
+Everything here is loaded once per container (see `warm_reference_data`, called
+during init) into read-only structures, so handlers never re-read or re-parse
+them per request.
+"""
+
+import os
+import json
+from types import MappingProxyType
+
+from util.labs import LABS
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+
+
+def _load_countries(path: str = os.path.join(DATA_DIR, "countries.json")):
+    with open(path, "r", encoding="utf-8") as f:
+        # Keeps the file's order, which is the order the profile page lists them in:
+        return MappingProxyType(json.load(f))
+
+
+# {"US": "United States", ...}
+COUNTRIES = _load_countries()
+
+
+def warm_reference_data(labs=None) -> int:
+    """Precompute each lab's lookup sets (see BaseLab). Returns how many labs."""
+    labs = LABS if labs is None else labs
+    for lab in labs.values():
+        lab.prohibited_countries
+        lab.allowed_profile_set
+    return len(labs)
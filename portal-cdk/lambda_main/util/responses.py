@@ -1,4 +1,9 @@
+import os
+import gzip
 import json
+import base64
+import hashlib
+import binascii
 from base64 import b64decode
 from urllib.parse import parse_qs
 from typing import Any
@@ -10,10 +15,109 @@ from aws_lambda_powertools.event_handler import (
 )
 
 from util.exceptions import MalformedRequest
+from util.session import current_session
 
 
 logger = Logger(child=True)
 
+# Smaller bodies aren't worth the CPU (or the gzip header overhead):
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+
+
+def weak_etag(body: str | bytes) -> str:
+    """
+    Weak, since the same body can go out gzipped or not. (A strong ETag would have
+    to be different for each encoding.)
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match can be a list, or '*'. Compared weakly, like RFC 9110 says to."""
+    if not if_none_match:
+        return False
+    etag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def accepts_gzip(event) -> bool:
+    """If Accept-Encoding allows gzip, by name or '*', with a q-value above 0."""
+    qvalues = {}
+    for encoding in (event.headers.get("accept-encoding") or "").lower().split(","):
+        name, *params = encoding.split(";")
+        qvalue = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[name.strip()] = qvalue
+    for name in ("gzip", "x-gzip", "*"):
+        if name in qvalues:
+            return qvalues[name] > 0
+    return False
+
+
+def add_vary(headers: dict, header: str) -> None:
+    vary = [v.strip() for v in headers.get("Vary", "").split(",") if v.strip()]
+    if header.lower() not in (v.lower() for v in vary):
+        headers["Vary"] = ", ".join([*vary, header])
+
+
+def _current_event():
+    # Only set while the app is resolving a request:
+    app = current_session.app
+    return getattr(app, "current_event", None) if app else None
+
+
+def _negotiate(response_payload: dict, event) -> dict:
+    """Answer conditional GETs with a 304, and compress what's left if we can."""
+    body = response_payload["body"]
+    headers = dict(response_payload.get("headers") or {})
+    body_bytes = body.encode("utf-8") if isinstance(body, str) else body
+
+    # Whether it's compressed depends on Accept-Encoding, so caches have to know,
+    # even when this client didn't get it compressed:
+    negotiable = len(body_bytes) >= COMPRESS_MIN_BYTES
+    if negotiable:
+        add_vary(headers, "Accept-Encoding")
+
+    # Only GET/HEAD are conditional, and routes can set their own ETag (/portal/hub/auth):
+    if (
+        response_payload["status_code"] == 200
+        and event.http_method in ("GET", "HEAD")
+        and "ETag" not in headers
+    ):
+        etag = weak_etag(body_bytes)
+        headers["ETag"] = etag
+        if etag_matches(event.headers.get("if-none-match"), etag):
+            response_payload["status_code"] = 304
+            response_payload["body"] = ""
+            response_payload["headers"] = {
+                k: v for k, v in headers.items() if k in ("ETag", "Vary")
+            }
+            return response_payload
+
+    if negotiable and accepts_gzip(event):
+        # Bytes bodies get base64 encoded by Powertools:
+        response_payload["body"] = gzip.compress(body_bytes, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+        if "ETag" in headers and not headers["ETag"].startswith("W/"):
+            # A route's strong ETag no longer describes these exact bytes:
+            headers["ETag"] = f"W/{headers['ETag']}"
+
+    response_payload["headers"] = headers
+    return response_payload
+
 
 def wrap_response(body, code=200, content_type=None, headers=None, cookies=None):
     response_payload = {
@@ -35,9 +139,34 @@ def wrap_response(body, code=200, content_type=None, headers=None, cookies=None)
 
         response_payload["cookies"] = cookies
 
+    event = _current_event()
+    if event is not None:
+        response_payload = _negotiate(response_payload, event)
+
     return Response(**response_payload)
 
 
+def encode_token(value: dict | None) -> str | None:
+    """Opaque URL-safe token for a dict, like a page cursor or a query handle."""
+    if value is None:
+        return None
+    # LastEvaluatedKey has Decimals in it:
+    return base64.urlsafe_b64encode(json.dumps(value, default=int).encode()).decode()
+
+
+def decode_token(token: str | None, name: str) -> dict | None:
+    """The dict from `encode_token`. `name` is the parameter it came in, for errors."""
+    if not token:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError) as e:
+        raise MalformedRequest(f"Invalid '{name}' value: {token}") from e
+    if not isinstance(value, dict):
+        raise MalformedRequest(f"Invalid '{name}' value: {token}")
+    return value
+
+
 def json_body_to_dict(body: str) -> dict:
     """Converts a JSON body to a python dictionary
 
@@ -0,0 +1,110 @@
+"""
+Long-lived, in-process cache for Secrets Manager values.
+
+Powertools only caches `parameters.get_secret` for 5 seconds by default, which
+means hot endpoints keep paying a Secrets Manager round trip. `SecretCache` keeps
+the value for a (configurable) long TTL, refreshes it in the background shortly
+before it expires, and makes sure only one caller fetches it on a cold miss.
+
+from util.secret_cache import SecretCache
+SSO_SECRET = SecretCache(os.getenv("SSO_TOKEN_SECRET_NAME"))
+SSO_SECRET.prefetch()  # During Lambda init
+sso_token = SSO_SECRET.get()
+"""
+
+import os
+import time
+import threading
+
+from aws_lambda_powertools.utilities import parameters
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+# Seconds to keep a secret before it's considered expired:
+DEFAULT_SECRET_TTL = int(os.getenv("SECRET_CACHE_TTL", str(60 * 60)))
+# Seconds before expiry where a background refresh kicks off:
+DEFAULT_REFRESH_AHEAD = int(os.getenv("SECRET_CACHE_REFRESH_AHEAD", str(5 * 60)))
+
+
+class SecretCache:
+    def __init__(
+        self,
+        secret_name: str,
+        ttl: int = DEFAULT_SECRET_TTL,
+        refresh_ahead: int = DEFAULT_REFRESH_AHEAD,
+        version_stage: str | None = None,
+    ):
+        self.secret_name = secret_name
+        # Like "AWSPREVIOUS", the current version if it's not set:
+        self.version_stage = version_stage
+        self.ttl = ttl
+        # Never start refreshing before the value is even cached:
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self._value = None
+        self._expires_at = 0.0
+        self._version = 0
+        # Single-flight: only one thread fetches at a time.
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self) -> str:
+        # Looked up at call time (not imported directly), so it can be monkeypatched:
+        if self.version_stage:
+            value = parameters.get_secret(
+                self.secret_name, VersionStage=self.version_stage
+            )
+        else:
+            value = parameters.get_secret(self.secret_name)
+        if value != self._value:
+            self._version += 1
+        self._value = value
+        self._expires_at = time.monotonic() + self.ttl
+        return value
+
+    def _background_refresh(self) -> None:
+        try:
+            with self._lock:
+                self._fetch()
+        except Exception as e:
+            # Keep serving the old value, the next miss will try again:
+            logger.warning(f"Background refresh of {self.secret_name} failed: {e}")
+        finally:
+            self._refreshing = False
+
+    def get(self) -> str:
+        now = time.monotonic()
+        if self._value is not None and now < self._expires_at:
+            # Still valid, but kick off a refresh if we're close to expiring:
+            if now >= self._expires_at - self.refresh_ahead and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._background_refresh, daemon=True).start()
+            return self._value
+
+        with self._lock:
+            # Another caller might have fetched it while we waited on the lock:
+            if self._value is not None and time.monotonic() < self._expires_at:
+                return self._value
+            logger.debug("Fetching secret %s", self.secret_name)
+            return self._fetch()
+
+    def prefetch(self) -> bool:
+        """Warm the cache during init. Never raises, failures will be retried on use."""
+        if not self.secret_name:
+            return False
+        try:
+            self.get()
+        except Exception as e:
+            logger.warning(f"Could not prefetch secret {self.secret_name}: {e}")
+            return False
+        return True
+
+    @property
+    def version(self) -> int:
+        """Increments every time the fetched secret value changes."""
+        return self._version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
@@ -33,23 +33,58 @@ class PortalAuth:
         return self
 
 
-def current_session():
-    if not current_session.auth:
-        current_session.auth = PortalAuth()
-    return dict(
-        auth=current_session.auth,
-        user=current_session.user,
-        app=current_session.app,
-    )
+class PortalSession:
+    """
+    Per-request session state, shared through `current_session`.
 
+    'user' is resolved lazily: `process_auth` only registers a loader, and the
+    (expensive) token exchange + DB lookup runs the first time something reads
+    `current_session.user`. Routes that never ask for it (static files, public
+    pages, lab-facing endpoints) never touch Cognito or DynamoDB.
+    """
 
-current_session.auth = None
+    def __init__(self):
+        self.auth = None
+        # Global access to the app.current_event
+        self.app = None
+        # Fill in later with User Object
+        self._user = None
+        self._user_loader = None
 
-# Fill in later with User Object
-current_session.user = None
+    def __call__(self):
+        if not self.auth:
+            self.auth = PortalAuth()
+        return dict(
+            auth=self.auth,
+            user=self.user,
+            app=self.app,
+        )
 
-# Global access to the app.current_event
-current_session.app = None
+    @property
+    def user(self):
+        if self._user_loader:
+            # Clear it first, so a loader that raises isn't retried on every access:
+            loader, self._user_loader = self._user_loader, None
+            self._user = loader()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        self._user_loader = None
+        self._user = value
+
+    @property
+    def user_resolved(self) -> bool:
+        """If reading 'user' is free, or will trigger the loader."""
+        return self._user_loader is None
+
+    def defer_user(self, loader) -> None:
+        """Set the callable that resolves 'user' on first access."""
+        self._user = None
+        self._user_loader = loader
+
+
+current_session = PortalSession()
 
 # print(PortalAuth().add_cognito({"raw":"blablabla"}).add_hub_auth({"value":"joe"}))
 #
@@ -0,0 +1,111 @@
+"""
+The Jinja environment for `templates/`, and the bundle-time step that precompiles it.
+
+At bundle time (`make compile-templates`, or `python -m util.template_env` from
+lambda_main/), every template is compiled into a Python module in
+`compiled_templates/`, along with a manifest of the sources they were built from.
+At runtime the compiled modules are loaded with a `ModuleLoader`, so a cold
+container doesn't have to parse and compile templates during its first request.
+
+If there's no compiled output, or it's out of date with the sources (like while
+developing), templates are loaded from the filesystem as usual.
+"""
+
+import os
+import json
+import hashlib
+import posixpath
+
+from jinja2 import (
+    ChoiceLoader,
+    Environment,
+    FileSystemLoader,
+    ModuleLoader,
+    StrictUndefined,
+    select_autoescape,
+)
+
+_LAMBDA_MAIN = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TEMPLATE_DIR = os.path.join(_LAMBDA_MAIN, "templates")
+COMPILED_TEMPLATE_DIR = os.path.join(_LAMBDA_MAIN, "compiled_templates")
+MANIFEST_NAME = "manifest.json"
+
+# Compiled templates depend on these, so they're shared by both environments:
+ENV_OPTIONS = {
+    "autoescape": select_autoescape(),
+    "undefined": StrictUndefined,
+    "trim_blocks": True,
+    "lstrip_blocks": True,
+    "keep_trailing_newline": True,
+}
+
+SOURCE_LOADER = FileSystemLoader(TEMPLATE_DIR)
+
+
+class PortalEnvironment(Environment):
+    def join_path(self, template: str, parent: str) -> str:
+        # Templates include './navbar.j2', which has to be the same (compiled) template
+        # as 'navbar.j2', instead of missing the ModuleLoader and re-compiling it:
+        return posixpath.normpath(template)
+
+
+def _source_hashes(template_dir: str = TEMPLATE_DIR) -> dict[str, str]:
+    loader = FileSystemLoader(template_dir)
+    hashes = {}
+    for name in loader.list_templates():
+        with open(os.path.join(template_dir, name), "rb") as f:
+            hashes[name] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def compiled_templates_current(
+    compiled_dir: str = COMPILED_TEMPLATE_DIR, template_dir: str = TEMPLATE_DIR
+) -> bool:
+    """True if `compiled_dir` was built from exactly the current templates."""
+    try:
+        with open(os.path.join(compiled_dir, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest == _source_hashes(template_dir)
+
+
+def compile_templates(
+    compiled_dir: str = COMPILED_TEMPLATE_DIR, template_dir: str = TEMPLATE_DIR
+) -> list[str]:
+    """Compile every template into `compiled_dir`. Returns the template names."""
+    env = PortalEnvironment(loader=FileSystemLoader(template_dir), **ENV_OPTIONS)
+    os.makedirs(compiled_dir, exist_ok=True)
+    # Syntax errors should fail the build, not show up as a missing template later:
+    env.compile_templates(compiled_dir, zip=None, ignore_errors=False)
+
+    hashes = _source_hashes(template_dir)
+    with open(os.path.join(compiled_dir, MANIFEST_NAME), "w") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    return sorted(hashes)
+
+
+def build_environment() -> Environment:
+    if compiled_templates_current():
+        # Fall back to the sources for anything that isn't compiled:
+        loader = ChoiceLoader([ModuleLoader(COMPILED_TEMPLATE_DIR), SOURCE_LOADER])
+    else:
+        loader = SOURCE_LOADER
+    return PortalEnvironment(loader=loader, **ENV_OPTIONS)
+
+
+def uses_compiled_templates(env: Environment) -> bool:
+    return isinstance(env.loader, ChoiceLoader)
+
+
+def warm_template_cache(env: Environment) -> int:
+    """Load every template into the environment's cache. Done during Lambda init."""
+    names = SOURCE_LOADER.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+if __name__ == "__main__":
+    compiled = compile_templates()
+    print(f"Compiled {len(compiled)} templates into {COMPILED_TEMPLATE_DIR}")
@@ -1 +1 @@
-from .user import User  # noqa: F401
+from .user import User, clear_identity_map  # noqa: F401
@@ -0,0 +1,130 @@
+"""
+When users were last active, and finding the ones that haven't been.
+
+Every login stores `last_activity` (epoch seconds) and `activity_bucket` (its UTC
+month, "YYYY-MM"), which the sparse activity_bucket-index is keyed on. So does the
+first request of a session each day, for users that stay logged in on a refresh
+cookie. Users inactive since a date are found by querying each month bucket in the
+window, instead of scanning the table and parsing `last_cookie_assignment` strings.
+
+Users that haven't logged in since it was added are backfilled by the "activity"
+migration (migrate.py).
+"""
+
+import datetime
+from typing import Iterator
+
+from boto3.dynamodb.conditions import Attr
+
+from .dynamo_db import query_activity_bucket, update_item_if
+
+ACTIVITY_BUCKET_FORMAT = "%Y-%m"
+# Sessions are used on every request, so activity is only written again this late:
+ACTIVITY_RESOLUTION_SECONDS = 24 * 60 * 60
+# How far back from `before` a sweep looks, if it isn't told:
+ACTIVITY_LOOKBACK_DAYS = 365
+LAST_COOKIE_ASSIGNMENT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def activity_bucket(timestamp: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.UTC).strftime(
+        ACTIVITY_BUCKET_FORMAT
+    )
+
+
+def activity_fields(timestamp: int) -> dict:
+    """The attributes to write when a user is active at `timestamp`."""
+    return {"last_activity": timestamp, "activity_bucket": activity_bucket(timestamp)}
+
+
+def activity_buckets(after: int, before: int) -> list[str]:
+    """Every bucket that [after, before) touches, oldest first."""
+    month = datetime.datetime.fromtimestamp(after, tz=datetime.UTC).replace(day=1)
+    last = activity_bucket(before - 1)
+    buckets = [month.strftime(ACTIVITY_BUCKET_FORMAT)]
+    while buckets[-1] < last:
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+        buckets.append(month.strftime(ACTIVITY_BUCKET_FORMAT))
+    return buckets
+
+
+def get_inactive_users(
+    before: int,
+    after: int | None = None,
+    limit: int = 500,
+    cursor: dict | None = None,
+) -> tuple[list[dict], dict | None]:
+    """
+    One page (up to `limit`) of users last active in [after, before), oldest bucket
+    first, as {"username", "last_activity"}. `after` defaults to
+    ACTIVITY_LOOKBACK_DAYS before `before`.
+
+    Returns (users, cursor). Pass the cursor back for the next page, None means done.
+    """
+    if after is None:
+        after = before - ACTIVITY_LOOKBACK_DAYS * 24 * 60 * 60
+    buckets = activity_buckets(after, before)
+    start_key = None
+    if cursor:
+        if cursor.get("bucket") not in buckets:
+            raise ValueError(f"Cursor bucket {cursor.get('bucket')} is out of range")
+        buckets = buckets[buckets.index(cursor["bucket"]) :]
+        start_key = cursor.get("key")
+
+    users = []
+    for i, bucket in enumerate(buckets):
+        while True:
+            items, start_key = query_activity_bucket(
+                bucket, after, before, limit - len(users), start_key
+            )
+            users.extend(
+                {
+                    "username": item["username"],
+                    "last_activity": int(item["last_activity"]),
+                }
+                for item in items
+            )
+            if len(users) >= limit:
+                if start_key:
+                    return users, {"bucket": bucket, "key": start_key}
+                if i + 1 < len(buckets):
+                    return users, {"bucket": buckets[i + 1], "key": None}
+                return users, None
+            if not start_key:
+                break
+    return users, None
+
+
+def iter_inactive_users(
+    before: int, after: int | None = None, batch_size: int = 500
+) -> Iterator[list[dict]]:
+    """Every user last active in [after, before), in batches for downstream jobs."""
+    cursor = None
+    while True:
+        users, cursor = get_inactive_users(before, after, batch_size, cursor)
+        if users:
+            yield users
+        if cursor is None:
+            return
+
+
+# Users the "activity" backfill applies to:
+NEEDS_ACTIVITY_BACKFILL = (
+    Attr("last_activity").not_exists() & Attr("last_cookie_assignment").exists()
+)
+
+
+def backfill_activity(item: dict) -> bool:
+    """
+    Index a user that hasn't logged in since activity was tracked, from their
+    `last_cookie_assignment`. Only the activity attributes are written, and only if
+    a login didn't set them first. Returns whether it was written.
+    """
+    last_login = datetime.datetime.strptime(
+        item["last_cookie_assignment"], LAST_COOKIE_ASSIGNMENT_FORMAT
+    ).replace(tzinfo=datetime.UTC)
+    return update_item_if(
+        item["username"],
+        activity_fields(int(last_login.timestamp())),
+        Attr("last_activity").not_exists(),
+    )
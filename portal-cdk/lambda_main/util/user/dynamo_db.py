@@ -3,14 +3,25 @@
 import datetime
 import os
 import json
+from typing import Iterable
 
 from cachetools import TTLCache
 import boto3
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 
 from util.labs import LABS
 from util.exceptions import LabDoesNotExist
 
+from .indexed import (
+    FACET_INDEX,
+    FACET_KEY,
+    facet_keys_with,
+    has_facets,
+    item_values,
+    normalize_email,
+)
+
 from aws_lambda_powertools import Logger
 
 
@@ -24,6 +35,18 @@ _DYNAMO_TABLE = None
 # Keys that this module manages, that you don't want the rest of the code messing with.
 RESTRICTED_KEYS = ["username", "created_at", "last_update"]
 
+# Sparse GSI on country_code, only users with one are in it (see portal_cdk_stack.py):
+COUNTRY_CODE_INDEX = "country_code-index"
+# Sparse GSI on (activity_bucket, last_activity), for finding inactive users:
+ACTIVITY_INDEX = "activity_bucket-index"
+# GSI on email_normalized, kept in sync by User (see util/user/user.py):
+EMAIL_INDEX = "email_normalized-index"
+# Set once the "email" migration (migrate.py) has indexed every user. Until then,
+# lookups the index misses fall back to scanning the users it hasn't got yet:
+EMAIL_INDEX_BACKFILLED = os.getenv("EMAIL_INDEX_BACKFILLED", "false").lower() == "true"
+# Same, for the "facets" migration. Until then, facet filters scan the table:
+FACET_INDEX_BACKFILLED = os.getenv("FACET_INDEX_BACKFILLED", "false").lower() == "true"
+
 # Profile cache, upto 100 items, max life 5mins
 PROFILE_CACHE = TTLCache(maxsize=100, ttl=5 * 60)
 
@@ -148,8 +171,10 @@ def get_record_counter(table, username) -> int:
     return int(response["Item"]["_rec_counter"])
 
 
-def pull_all_pagination(table, limit, username_filter, filterexpr=None):
-    table_scan_params = {}
+def pull_all_pagination(table, limit, username_filter, filterexpr=None, query=None):
+    """Scans the table, or runs `query` (Query params) if given, until `limit`."""
+    read = table.query if query else table.scan
+    table_scan_params = dict(query or {})
 
     if username_filter:
         username_filter = Attr("username").contains(username_filter)
@@ -161,11 +186,11 @@ def pull_all_pagination(table, limit, username_filter, filterexpr=None):
     if filterexpr:
         table_scan_params["FilterExpression"] = filterexpr
 
-    response = table.scan(**table_scan_params)
+    response = read(**table_scan_params)
     items = response.get("Items", [])
     while "LastEvaluatedKey" in response:
         table_scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-        response = table.scan(**table_scan_params)
+        response = read(**table_scan_params)
         items.extend(response.get("Items", []))
 
         # Break if we meet a set limit, and we're not filtering
@@ -175,18 +200,63 @@ def pull_all_pagination(table, limit, username_filter, filterexpr=None):
     return items
 
 
-def get_all_items(limit=None, username_filter=None) -> list:
+def scan_page(
+    filterexpr=None, limit: int = 1000, start_key: dict | None = None
+) -> tuple[list[dict], dict | None]:
+    """
+    One page of a table scan (up to `limit` items read, before filtering), for
+    callers that page through the table across requests instead of in one.
+    Returns (items, start_key of the next page, or None when done).
+    """
+    _client, _db, table = _get_dynamo()
+    scan_params = {"Limit": limit}
+    if filterexpr is not None:
+        scan_params["FilterExpression"] = filterexpr
+    if start_key:
+        scan_params["ExclusiveStartKey"] = start_key
+    response = table.scan(**scan_params)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def get_all_items(limit=None, username_filter=None, facets=()) -> list:
     """
     Returns all items in the DB.
     Need to page because there's a 100 item limit.
 
     limit: A maximum list return length
     username_filter: Only return users matching filter
+    facets: Only return users in all of these (see util/user/indexed.py). Queries
+        the facet index for each facet_key that has them, instead of scanning.
 
     """
     _client, _db, table = _get_dynamo()
-    logger.info(f"Pulling rows from {table}, limit={limit}, filter={username_filter}")
-    items = pull_all_pagination(table, limit, username_filter)
+    logger.info(
+        f"Pulling rows from {table}, limit={limit}, filter={username_filter}, "
+        f"facets={facets}"
+    )
+    if facets and FACET_INDEX_BACKFILLED:
+        items = []
+        for key in facet_keys_with(facets):
+            query = {
+                "IndexName": FACET_INDEX,
+                "KeyConditionExpression": Key(FACET_KEY).eq(key),
+            }
+            items.extend(
+                pull_all_pagination(
+                    table, limit and limit - len(items), username_filter, query=query
+                )
+            )
+            if limit and len(items) >= limit:
+                break
+    elif facets:
+        # Users saved before facet_key don't have it yet, so work it out for all:
+        items = [
+            item
+            for item in pull_all_pagination(table, None, username_filter)
+            if has_facets(item_values(item), facets)
+        ]
+    else:
+        items = pull_all_pagination(table, limit, username_filter)
     logger.info(f"Fetched {len(items)} rows from {table} w/ filter={username_filter}")
 
     # Bound the return set if limit provided
@@ -196,12 +266,13 @@ def get_all_items(limit=None, username_filter=None) -> list:
     return items
 
 
-def update_item(username: str, updates: dict) -> bool:
+def update_item(username: str, updates: dict, remove: Iterable[str] = ()) -> bool:
     """
     Updates fields in an existing item. (Will create fields if they don't exist.)
 
     updates: dict, each key-value pair is a different field that'll be updated. fields not
     listed will be left alone.
+    remove: fields to delete from the item, like sparse index keys that no longer apply.
     """
     _client, _db, table = _get_dynamo()
     # "Cast" to a plain dict, so it can be serialized to JSON.
@@ -225,6 +296,10 @@ def update_item(username: str, updates: dict) -> bool:
         # (It'll look up the real value in the map above.)
         [f"#{alpha(k)}=:{alpha(k)}" for k in updates.keys()]
     )
+    remove = [k for k in remove if k not in updates]
+    if remove:
+        expression_attribute_names |= {f"#{alpha(k)}": k for k in remove}
+        update_expression += " REMOVE " + ", ".join(f"#{alpha(k)}" for k in remove)
     table.update_item(
         Key={"username": username},
         ExpressionAttributeNames=expression_attribute_names,
@@ -281,3 +356,131 @@ def get_users_with_lab(
         return items[:limit]
 
     return items
+
+
+# Returns the users in any of the given countries, optionally only those in a lab
+def get_users_in_countries(
+    country_codes, lab_short_name: str | None = None
+) -> list[dict]:
+    _client, _db, table = _get_dynamo()
+    items = []
+    for country_code in sorted(country_codes):
+        query_params = {
+            "IndexName": COUNTRY_CODE_INDEX,
+            "KeyConditionExpression": Key("country_code").eq(country_code),
+        }
+        if lab_short_name:
+            query_params["FilterExpression"] = Attr(f"labs.{lab_short_name}").exists()
+
+        response = table.query(**query_params)
+        items.extend(response.get("Items", []))
+        while "LastEvaluatedKey" in response:
+            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+            response = table.query(**query_params)
+            items.extend(response.get("Items", []))
+    return items
+
+
+def update_item_if(
+    username: str, updates: dict, condition, remove: Iterable[str] = ()
+) -> bool:
+    """
+    Like update_item, for backfills writing attributes onto items they scanned.
+    `condition` (and the item still existing) is checked in the same write instead
+    of reading the item first, and _rec_counter is added to, not set from a read, so
+    a save that happened since the scan is never overwritten.
+
+    Returns False if the item is gone or `condition` no longer holds.
+    """
+    _client, _db, table = _get_dynamo()
+    # "Cast" to a plain dict, so it can be serialized to JSON.
+    updates = json.loads(json.dumps(updates, default=str))
+    updates["last_update"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    remove = [k for k in remove if k not in updates]
+
+    expression_attribute_names = {f"#{alpha(k)}": k for k in [*updates, *remove]}
+    expression_attribute_names["#reccounter"] = "_rec_counter"
+    expression_attribute_values = {f":{alpha(k)}": v for k, v in updates.items()}
+    expression_attribute_values[":one"] = 1
+    update_expression = "SET " + ", ".join(
+        [f"#{alpha(k)}=:{alpha(k)}" for k in updates.keys()]
+    )
+    update_expression += " ADD #reccounter :one"
+    if remove:
+        update_expression += " REMOVE " + ", ".join(f"#{alpha(k)}" for k in remove)
+    try:
+        table.update_item(
+            Key={"username": username},
+            ExpressionAttributeNames=expression_attribute_names,
+            ExpressionAttributeValues=expression_attribute_values,
+            UpdateExpression=update_expression,
+            ConditionExpression=Attr("username").exists() & condition,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+
+    _del_cache(username)
+    return True
+
+
+def query_activity_bucket(
+    bucket: str,
+    after: int,
+    before: int,
+    limit: int,
+    start_key: dict | None = None,
+) -> tuple[list[dict], dict | None]:
+    """
+    One page of the users in activity `bucket` last active in [after, before).
+    Returns (items, LastEvaluatedKey); items only have the index keys.
+    """
+    _client, _db, table = _get_dynamo()
+    query_params = {
+        "IndexName": ACTIVITY_INDEX,
+        "KeyConditionExpression": Key("activity_bucket").eq(bucket)
+        & Key("last_activity").between(after, before - 1),
+        "Limit": limit,
+    }
+    if start_key:
+        query_params["ExclusiveStartKey"] = start_key
+    response = table.query(**query_params)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def get_usernames_by_email(email: str) -> list[str]:
+    """Every username with this email (normally just one), from a single Query."""
+    email = normalize_email(email)
+    if not email:
+        return []
+    _client, _db, table = _get_dynamo()
+    response = table.query(
+        IndexName=EMAIL_INDEX,
+        KeyConditionExpression=Key("email_normalized").eq(email),
+    )
+    usernames = [item["username"] for item in response.get("Items", [])]
+    if not usernames and not EMAIL_INDEX_BACKFILLED:
+        usernames = _scan_usernames_by_email(table, email)
+    return sorted(usernames)
+
+
+def _scan_usernames_by_email(table, email: str) -> list[str]:
+    # Only the users the index doesn't have. Emails are compared normalized, which
+    # a FilterExpression can't do, so only the two attributes are read:
+    scan_params = {
+        "FilterExpression": Attr("email").exists()
+        & Attr("email_normalized").not_exists(),
+        "ProjectionExpression": "username, email",
+    }
+    usernames = []
+    while True:
+        response = table.scan(**scan_params)
+        usernames.extend(
+            item["username"]
+            for item in response.get("Items", [])
+            if normalize_email(item["email"]) == email
+        )
+        if "LastEvaluatedKey" not in response:
+            return usernames
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
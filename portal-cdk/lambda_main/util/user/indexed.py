@@ -0,0 +1,80 @@
+"""
+Attributes that are only in the DB, derived from User attributes, so sparse GSIs
+can find users without a scan. User keeps them in sync on every write, and the
+migrations in util/user/migrations.py fill them in for users saved before.
+
+    - email_normalized: lower-cased email, for the email index.
+    - facet_key: every facet that applies, sorted and joined by FACET_SEPARATOR
+      (like "admin#no_labs"), or not there when none do, for the admin user table's
+      filters. One index covers every facet, since DynamoDB only adds one GSI per
+      table update. A filter queries each key that has its facets in it.
+"""
+
+from itertools import combinations
+from typing import Mapping
+
+from .defaults import defaults
+
+FACET_KEY = "facet_key"
+FACET_INDEX = "facet_key-index"
+FACET_SEPARATOR = "#"
+
+# {facet: (User attribute it follows, whether it applies)}
+FACETS = {
+    "locked": ("is_locked", bool),
+    "admin": ("access", lambda access: "admin" in (access or ())),
+    "profile_update": ("require_profile_update", bool),
+    "no_labs": ("labs", lambda labs: not labs),
+}
+
+# User attributes that have something derived from them:
+INDEXED_KEYS = frozenset({"email"} | {source for source, _ in FACETS.values()})
+
+
+def normalize_email(email: str | None) -> str:
+    return (email or "").strip().lower()
+
+
+def facet_key(values: Mapping) -> str | None:
+    """The facet_key for a user with these attributes, None if no facet applies."""
+    applying = [
+        facet for facet, (source, applies) in FACETS.items() if applies(values[source])
+    ]
+    return FACET_SEPARATOR.join(sorted(applying)) or None
+
+
+def has_facets(values: Mapping, facets) -> bool:
+    return all(FACETS[facet][1](values[FACETS[facet][0]]) for facet in facets)
+
+
+def facet_keys_with(facets) -> list[str]:
+    """Every facet_key that has all of `facets` in it."""
+    others = sorted(set(FACETS) - set(facets))
+    return [
+        FACET_SEPARATOR.join(sorted({*facets, *extra}))
+        for count in range(len(others) + 1)
+        for extra in combinations(others, count)
+    ]
+
+
+def item_values(item: Mapping) -> dict:
+    """An item's INDEXED_KEYS the way User loads them, with defaults for missing ones."""
+    return {
+        key: defaults.get(key) if item.get(key) is None else item[key]
+        for key in INDEXED_KEYS
+    }
+
+
+def derived_attributes(
+    values: Mapping, key: str | None = None
+) -> dict[str, str | None]:
+    """
+    {attribute: value} derived from a user's INDEXED_KEYS `values`, or only the ones
+    that follow `key` if it's given. None means remove it from the item.
+    """
+    derived = {}
+    if key in (None, "email"):
+        derived["email_normalized"] = normalize_email(values["email"]) or None
+    if key is None or any(source == key for source, _ in FACETS.values()):
+        derived[FACET_KEY] = facet_key(values)
+    return derived
@@ -0,0 +1,84 @@
+"""
+Backfills for attributes added to the user table after users already existed.
+
+Each one scans for the items it applies to and fixes them one conditional write
+at a time (`update_item_if`), so it can run while the portal is live without
+losing a save. They're run by hand through migrate.py, not from an API request.
+"""
+
+from typing import Callable, NamedTuple
+
+from boto3.dynamodb.conditions import Attr
+from aws_lambda_powertools import Logger
+
+from .activity import NEEDS_ACTIVITY_BACKFILL, backfill_activity
+from .dynamo_db import scan_page, update_item_if
+from .indexed import FACET_KEY, facet_key, item_values, normalize_email
+
+logger = Logger(child=True)
+
+# Items read per scan page:
+MIGRATION_PAGE_SIZE = 1000
+
+
+class Migration(NamedTuple):
+    # FilterExpression for the items it applies to:
+    applies: object
+    # Fixes one item, returns whether it wrote anything:
+    backfill: Callable[[dict], bool]
+
+
+def backfill_email(item: dict) -> bool:
+    """Index a user saved before email_normalized, unless their email changed since."""
+    email_normalized = normalize_email(item["email"])
+    if not email_normalized:
+        return False
+    return update_item_if(
+        item["username"],
+        {"email_normalized": email_normalized},
+        Attr("email").eq(item["email"]),
+    )
+
+
+def backfill_facets(item: dict) -> bool:
+    """Index a user saved before facet_key, unless they were saved since the scan."""
+    key = facet_key(item_values(item))
+    if key is None:
+        return False
+    if "_rec_counter" in item:
+        unchanged = Attr("_rec_counter").eq(item["_rec_counter"])
+    else:
+        unchanged = Attr("_rec_counter").not_exists()
+    return update_item_if(item["username"], {FACET_KEY: key}, unchanged)
+
+
+MIGRATIONS = {
+    "activity": Migration(NEEDS_ACTIVITY_BACKFILL, backfill_activity),
+    # Once it's done, set EMAIL_INDEX_BACKFILLED (util/user/dynamo_db.py):
+    "email": Migration(
+        Attr("email").exists() & Attr("email_normalized").not_exists(),
+        backfill_email,
+    ),
+    # Once it's done, set FACET_INDEX_BACKFILLED (util/user/dynamo_db.py):
+    "facets": Migration(Attr(FACET_KEY).not_exists(), backfill_facets),
+}
+
+
+def run_migration(
+    name: str, pages: int, start_key: dict | None = None
+) -> tuple[int, dict | None]:
+    """
+    Runs up to `pages` scan pages of migration `name`, from `start_key`.
+    Returns (items updated, start_key to continue from, or None when it's done).
+    """
+    migration = MIGRATIONS[name]
+    updated = 0
+    for _ in range(pages):
+        items, start_key = scan_page(
+            migration.applies, limit=MIGRATION_PAGE_SIZE, start_key=start_key
+        )
+        updated += sum(migration.backfill(item) for item in items)
+        if start_key is None:
+            break
+    logger.info({"migration": name, "updated": updated, "done": start_key is None})
+    return updated, start_key
@@ -1,17 +1,31 @@
 """User Class to abstract the rest of the code using the database."""
 
 import json
+import time
 import datetime
 import frozendict
 from typing import Any
 from util.exceptions import DbError, CognitoError, UserNotFound
 from util.cognito import delete_user_from_user_pool
 from util.labs import LABS
-
-from .dynamo_db import get_item, create_item, update_item, delete_item
+from util.labs.policy import get_lab_access_policy
+
+from aws_lambda_powertools import Logger
+
+from .dynamo_db import (
+    get_item,
+    create_item,
+    update_item,
+    delete_item,
+    get_usernames_by_email,
+)
+from .activity import ACTIVITY_RESOLUTION_SECONDS, activity_fields
+from .indexed import INDEXED_KEYS, derived_attributes
 from .defaults import defaults
 from .validator_map import validator_map, validate
 
+logger = Logger(child=True)
+
 
 def create_lab_structure(
     lab_profiles: list[str],
@@ -26,8 +40,27 @@ def create_lab_structure(
     }
 
 
+## Request-scoped identity map: Every 'User(username)' during one invoke returns
+#  the same object, so it's only loaded from the DB once. Every Lambda handler that
+#  can load users clears it when the invoke ends (main, health_monitor, migrate).
+_IDENTITY_MAP: dict[str, "User"] = {}
+
+
+def clear_identity_map() -> None:
+    _IDENTITY_MAP.clear()
+
+
 class User:
+    def __new__(cls, username: str, create_if_missing: bool = True):
+        if username in _IDENTITY_MAP:
+            return _IDENTITY_MAP[username]
+        return super().__new__(cls)
+
     def __init__(self, username: str, create_if_missing: bool = True):
+        # Already loaded during this request, don't hit the DB again:
+        if _IDENTITY_MAP.get(username) is self:
+            return
+
         ## Using super to avoid setattr validation. 'username'
         #  should NOT be modified like the other attributes.
         super().__setattr__("username", username)
@@ -51,9 +84,57 @@ class User:
             if key in db_info:
                 # You just loaded it to the DB, the one time you don't have to save it:
                 self.__setattr__(key, db_info[key], _save=False)
-            else:
+        # After the rest, so what's derived from several of them is saved right:
+        for key in validator_map:
+            if key not in db_info:
                 self.__setattr__(key, None)
 
+        ## Users saved before an index existed get added the first time they load:
+        if db_info:
+            self._sync_derived(db_info)
+
+        _IDENTITY_MAP[self.username] = self
+
+    @classmethod
+    def find_by_email(cls, email: str):
+        """The user with this email (case-insensitive), or None."""
+        usernames = get_usernames_by_email(email)
+        if not usernames:
+            return None
+        if len(usernames) > 1:
+            logger.warning(f"Multiple users with email {email}: {usernames}")
+        return cls(usernames[0], create_if_missing=False)
+
+    def _indexed_values(self) -> dict:
+        # Not all set yet while loading, the last one to be set saves it right:
+        return {key: getattr(self, key, None) for key in INDEXED_KEYS}
+
+    def _save(self, key, value) -> None:
+        # Anything derived from it (util/user/indexed.py) goes in the same write:
+        updates = {key: value}
+        remove = []
+        derived = derived_attributes(self._indexed_values(), key)
+        for attribute, derived_value in derived.items():
+            if derived_value is None:
+                remove.append(attribute)
+            else:
+                updates[attribute] = derived_value
+        update_item(self.username, updates, remove=remove)
+
+    def _sync_derived(self, db_info: dict) -> None:
+        updates = {}
+        remove = []
+        derived = derived_attributes(self._indexed_values())
+        for attribute, value in derived.items():
+            if db_info.get(attribute) == value:
+                continue
+            if value is None:
+                remove.append(attribute)
+            else:
+                updates[attribute] = value
+        if updates or remove:
+            update_item(self.username, updates, remove=remove)
+
     def __setattr__(self, key, value, _save=True):
         # If it's already that value, do nothing:
         if hasattr(self, key) and self.__getattribute__(key) == value:
@@ -78,7 +159,7 @@ class User:
         super().__setattr__(key, frozendict.deepfreeze(value))
         ## Update the DB:
         if _save:
-            update_item(self.username, {key: value})
+            self._save(key, value)
 
     def __str__(self):
         """What to display if you print this object."""
@@ -95,11 +176,32 @@ class User:
         default_val = defaults.get(key, None)
         return value == default_val
 
+    def _save_all(self, updates: dict) -> None:
+        for key, value in updates.items():
+            self.__setattr__(key, value, _save=False)
+        # One write for all of them, instead of one per attribute:
+        update_item(self.username, updates)
+
     def update_last_cookie_assignment(self) -> None:
-        self.last_cookie_assignment = datetime.datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S"
+        now = datetime.datetime.now()
+        self._save_all(
+            {
+                "last_cookie_assignment": now.strftime("%Y-%m-%d %H:%M:%S"),
+                **activity_fields(int(now.timestamp())),
+            }
         )
 
+    def record_activity(self) -> None:
+        """
+        For requests on a session that was already logged in. Only written once
+        the last activity is ACTIVITY_RESOLUTION_SECONDS old, not on every request.
+        """
+        now = int(time.time())
+        last_activity = self.last_activity or 0
+        if now - last_activity < ACTIVITY_RESOLUTION_SECONDS:
+            return
+        self._save_all(activity_fields(now))
+
     # Lab manipulation methods
     def set_labs(self, formatted_labs: dict) -> None:
         self.labs = formatted_labs
@@ -141,6 +243,7 @@ class User:
 
         # Delete item from dynamodb
         delete_item(self.username)
+        _IDENTITY_MAP.pop(self.username, None)
 
         # ensure item is deleted
         if get_item(self.username):
@@ -149,53 +252,26 @@ class User:
         return True
 
 
-def _can_user_see_lab(user: User, lab) -> bool:
-    if user.is_admin():
-        return True
-    # user is not admin
-    if lab.short_lab_name not in user.labs and lab.accessibility == "private":
-        return False
-    # user has access, or lab is protected or public
-    return True
-
-
-def _can_user_access_lab(user: User, lab) -> bool:
-    if user.is_admin():
-        return True
-    # user is not admin
-    if user.country_code in lab.ip_country_status["prohibited"]:
-        return False
-    # user not georestricted
-    if lab.short_lab_name not in user.labs:
-        return False
-    # user has access
-    return True
-
-
 # returns labs filtered by user access
 def filter_lab_access(user: User) -> dict:
-    # Dynamically create can_user_x flags
-    user_lab_permissions = {}
-    for labname, lab_info in LABS.items():
-        user_lab_permissions[labname] = {
-            "can_user_see_lab": _can_user_see_lab(user, lab_info),
-            "can_user_access_lab": _can_user_access_lab(user, lab_info),
+    permissions = get_lab_access_policy(LABS).evaluate(
+        user.is_admin(), user.country_code, frozenset(user.labs)
+    )
+
+    # can_user_*_lab exists for EVERY viewable lab:
+    lab_access = {}
+    for labname in LABS:
+        if labname not in permissions.visible:
+            continue
+        lab_access[labname] = {
+            "can_user_see_lab": True,
+            "can_user_access_lab": labname in permissions.accessible,
         }
         ## ONLY if user has access to the lab, add their lab info
-        # (can_user_*_lab must exist for EVERY lab)
         if labname in user.labs:
-            # if user has access, add user.labs access info
-            user_lab_permissions[labname] |= user.labs[labname]
+            lab_access[labname] |= user.labs[labname]
 
     return {
-        "viewable_labs_config": {
-            labname: LABS[labname]
-            for labname in user_lab_permissions.keys()
-            if user_lab_permissions[labname]["can_user_see_lab"]
-        },
-        "lab_access": {
-            labname: access
-            for labname, access in user_lab_permissions.items()
-            if user_lab_permissions[labname]["can_user_see_lab"]
-        },
+        "viewable_labs_config": {labname: LABS[labname] for labname in lab_access},
+        "lab_access": lab_access,
     }
@@ -16,6 +16,8 @@ validator_map = {
     "access": list,
     "profile": validate_profile,
     "last_cookie_assignment": str,
+    "last_activity": int,
+    "activity_bucket": str,
     "require_profile_update": bool,
     "labs": dict,
     "email": str,
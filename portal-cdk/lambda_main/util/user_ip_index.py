@@ -0,0 +1,214 @@
+"""
+Which users came from an IP address or subnet, for abuse investigations.
+
+The IP index table has one item per (address key, username), where the address key
+is 'ip#<address>' or 'net#<network>' (the address's /24 for IPv4, /64 for IPv6).
+Each item has first_seen/last_seen, the country code as of last_seen, and
+`addresses`, {address: last seen} for every address in it. Written next to the user
+IP history (see `user_ip_logs_stream`), and expires USER_IP_INDEX_DAYS after last
+being seen. Batches can arrive out of order, so every write only moves times outward,
+and subnet addresses not seen for USER_IP_INDEX_DAYS are dropped.
+"""
+
+import os
+import time
+import ipaddress
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from util.exceptions import MalformedRequest
+
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+USER_IP_INDEX_DAYS = int(os.getenv("USER_IP_INDEX_DAYS", "90"))
+# {IP version: prefix length of the subnet items}
+SUBNET_PREFIX = {4: 24, 6: 64}
+
+_ip_index_table = None
+
+
+def is_ip_index_enabled() -> bool:
+    return bool(os.getenv("USER_IP_INDEX_TABLE_NAME"))
+
+
+def _get_ip_index_table():
+    global _ip_index_table
+    if not _ip_index_table:
+        _ip_index_table = boto3.resource(
+            "dynamodb", region_name=os.getenv("STACK_REGION", "us-west-2")
+        ).Table(os.getenv("USER_IP_INDEX_TABLE_NAME"))
+    return _ip_index_table
+
+
+def _subnet(address) -> ipaddress.IPv4Network | ipaddress.IPv6Network:
+    return ipaddress.ip_network(
+        f"{address}/{SUBNET_PREFIX[address.version]}", strict=False
+    )
+
+
+def ip_keys(ip_address: str) -> tuple[str, str]:
+    """The (address, subnet) keys an IP is indexed under."""
+    address = ipaddress.ip_address(ip_address)
+    return f"ip#{address}", f"net#{_subnet(address)}"
+
+
+def _update_if(table, key: dict, update: str, condition: str, values: dict, **kwargs):
+    """update_item, or None if `condition` failed."""
+    try:
+        return table.update_item(
+            Key=key,
+            UpdateExpression=update,
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            **kwargs,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return None
+
+
+def _trim_addresses(table, key: dict, addresses: dict, seen: int) -> None:
+    # Only subnets collect addresses, drop the ones that would have expired:
+    cutoff = seen - USER_IP_INDEX_DAYS * 24 * 60 * 60
+    stale = [ip for ip, last_seen in addresses.items() if last_seen < cutoff]
+    if not stale:
+        return
+    names = {f"#ip{i}": ip for i, ip in enumerate(stale)}
+    _update_if(
+        table,
+        key,
+        "REMOVE " + ", ".join(f"addresses.{name}" for name in names),
+        # Unless one was seen again since:
+        " AND ".join(f"addresses.{name} < :cutoff" for name in names),
+        {":cutoff": cutoff},
+        ExpressionAttributeNames=names,
+    )
+
+
+def _record_address_use(
+    table, address_key: str, username: str, ip_address: str, seen: int, country: str
+) -> None:
+    key = {"address": address_key, "username": username}
+    latest = {
+        ":seen": seen,
+        ":country": country,
+        ":expires": seen + USER_IP_INDEX_DAYS * 24 * 60 * 60,
+    }
+    # Usually the newest use yet:
+    response = _update_if(
+        table,
+        key,
+        "SET last_seen = :seen, country_code = :country, expires_at = :expires,"
+        " addresses.#ip = :seen",
+        "last_seen < :seen",
+        latest,
+        ExpressionAttributeNames={"#ip": ip_address},
+        ReturnValues="ALL_NEW",
+    )
+    if response:
+        _trim_addresses(table, key, response["Attributes"]["addresses"], seen)
+        return
+    # Or the first:
+    created = _update_if(
+        table,
+        key,
+        "SET first_seen = :seen, last_seen = :seen, country_code = :country,"
+        " expires_at = :expires, addresses = :addresses",
+        "attribute_not_exists(last_seen)",
+        latest | {":addresses": {ip_address: seen}},
+    )
+    if created:
+        return
+    # Or an older one that came in late, which can only move times further out:
+    _update_if(
+        table,
+        key,
+        "SET addresses.#ip = :seen",
+        "attribute_not_exists(addresses.#ip) OR addresses.#ip < :seen",
+        {":seen": seen},
+        ExpressionAttributeNames={"#ip": ip_address},
+    )
+    _update_if(
+        table, key, "SET first_seen = :seen", "first_seen > :seen", {":seen": seen}
+    )
+
+
+def record_ip_use(items: list[dict]) -> None:
+    """Index IP events ({username, ip_address, country_code, timestamp (ms)})."""
+    table = _get_ip_index_table()
+    for item in items:
+        try:
+            address_keys = ip_keys(item["ip_address"])
+        except ValueError:
+            logger.warning(f"Not indexing invalid IP address {item['ip_address']}")
+            continue
+        for address_key in address_keys:
+            _record_address_use(
+                table,
+                address_key,
+                item["username"],
+                item["ip_address"],
+                item["timestamp"] // 1000,
+                item["country_code"],
+            )
+
+
+def find_ip_users(address: str, days: int = 30) -> list[dict]:
+    """
+    Users seen at an IP address, or in a subnet ('10.1.2.0/24', '2001:db8::/64'),
+    in the last `days` days. Newest first.
+    """
+    try:
+        network = ipaddress.ip_network(address.strip(), strict=False)
+    except ValueError as e:
+        raise MalformedRequest(f"Invalid IP address or subnet: {address}") from e
+
+    if network.num_addresses == 1:
+        address_key = f"ip#{network.network_address}"
+    elif network.prefixlen >= SUBNET_PREFIX[network.version]:
+        # Narrower ones are filtered from their indexed subnet below:
+        address_key = f"net#{_subnet(network.network_address)}"
+    else:
+        raise MalformedRequest(
+            "Only subnets up to /24 (IPv4) or /64 (IPv6) are indexed, "
+            f"not {network.with_prefixlen}"
+        )
+
+    since = int(time.time()) - days * 86400
+    query_params = {
+        "KeyConditionExpression": Key("address").eq(address_key),
+        "FilterExpression": Attr("last_seen").gte(since),
+    }
+    table = _get_ip_index_table()
+    response = table.query(**query_params)
+    items = response.get("Items", [])
+    while "LastEvaluatedKey" in response:
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        response = table.query(**query_params)
+        items.extend(response.get("Items", []))
+
+    users = []
+    for item in items:
+        # Only the addresses in `network` seen in the window, not just the subnet:
+        addresses = {
+            ip: int(last_seen)
+            for ip, last_seen in item.get("addresses", {}).items()
+            if last_seen >= since and ipaddress.ip_address(ip) in network
+        }
+        if not addresses:
+            continue
+        users.append(
+            {
+                "username": item["username"],
+                "first_seen": int(item["first_seen"]),
+                "last_seen": max(addresses.values()),
+                "country_code": item["country_code"],
+                "ip_addresses": sorted(addresses),
+            }
+        )
+    return sorted(users, key=lambda user: user["last_seen"], reverse=True)
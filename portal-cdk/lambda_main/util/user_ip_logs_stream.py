@@ -2,10 +2,15 @@ import json
 import os
 import time
 import datetime
+import threading
 
 import boto3
+from boto3.dynamodb.conditions import Key
+from cachetools import TTLCache
 
 from util.user import User
+from util.post_response import register_post_response_hook
+from util.user_ip_index import is_ip_index_enabled, record_ip_use
 from .exceptions import EnvironmentNotSet
 
 from aws_lambda_powertools import Logger
@@ -14,6 +19,26 @@ logger = Logger(log_uncaught_exceptions=True)
 
 _logs_client = None
 
+## IP events wait here, and get sent in batches (normally after the response):
+_ip_log_buffer = []
+_ip_log_buffer_lock = threading.Lock()
+# Flush early if the buffer gets this big, or the oldest event gets this old (seconds).
+# (Only matters if the post-response extension isn't running.)
+USER_IP_LOGS_BATCH_SIZE = int(os.getenv("USER_IP_LOGS_BATCH_SIZE", "50"))
+USER_IP_LOGS_MAX_AGE = int(os.getenv("USER_IP_LOGS_MAX_AGE", "30"))
+# Don't grow forever if CloudWatch is having a bad day:
+USER_IP_LOGS_MAX_BUFFER = 20 * USER_IP_LOGS_BATCH_SIZE
+
+
+## Recent IPs per user are also kept in DynamoDB (username, timestamp), so
+#  profile pages can read them with one Query instead of an Insights query:
+_ip_history_table = None
+# Days to keep history for, same as the default Insights window:
+USER_IP_HISTORY_DAYS = int(os.getenv("USER_IP_HISTORY_DAYS", "30"))
+# Same user/IP/country again within this many seconds isn't written again:
+USER_IP_HISTORY_MIN_INTERVAL = int(os.getenv("USER_IP_HISTORY_MIN_INTERVAL", "300"))
+_ip_history_recent = TTLCache(maxsize=1000, ttl=USER_IP_HISTORY_MIN_INTERVAL)
+
 
 def _get_logs_client() -> boto3.client:
     global _logs_client
@@ -22,24 +47,49 @@ def _get_logs_client() -> boto3.client:
     return _logs_client
 
 
+def is_ip_history_enabled() -> bool:
+    return bool(os.getenv("USER_IP_HISTORY_TABLE_NAME"))
+
+
+def _get_ip_history_table():
+    global _ip_history_table
+    if not _ip_history_table:
+        _ip_history_table = boto3.resource(
+            "dynamodb", region_name=os.getenv("STACK_REGION", "us-west-2")
+        ).Table(os.getenv("USER_IP_HISTORY_TABLE_NAME"))
+    return _ip_history_table
+
+
 def update_user_ip_in_db(
     username: str,
     ip_address: str,
     country_code: str,
+    user: User = None,
 ) -> bool:
-    user = User(username)
+    """
+    Saves the users latest IP/Country. Only writes to the DB if they changed.
+    Pass in 'user' if you already have it, to skip loading it again.
+    """
+    if user is None:
+        user = User(username)
 
-    user.ip_address = ip_address
-    user.country_code = country_code
+    changed = False
+    if user.ip_address != ip_address:
+        user.ip_address = ip_address
+        changed = True
+    if user.country_code != country_code:
+        user.country_code = country_code
+        changed = True
+    return changed
 
 
-def send_user_ip_logs(
+def _format_ip_log_event(
     username: str,
     ip_address: str,
     country_code: str,
     access_roles: str,
 ) -> dict:
-    event = {
+    return {
         "timestamp": int(time.time() * 1000),
         "message": json.dumps(
             {
@@ -51,14 +101,16 @@ def send_user_ip_logs(
         ),
     }
 
+
+def _put_ip_log_events(events: list) -> dict:
     logs_client = _get_logs_client()
 
     log_group_name = os.environ.get("USER_IP_LOGS_GROUP_NAME", None)
     log_stream_name = os.environ.get("USER_IP_LOGS_STREAM_NAME", None)
 
     if not log_group_name or not log_stream_name:
-        logger.warning("User IP event not collected in special log group. Event: ")
-        logger.warning(json.dumps(event))
+        logger.warning("User IP events not collected in special log group. Events: ")
+        logger.warning(json.dumps(events))
         raise EnvironmentNotSet(
             "User Activity Log Group or Stream not defined. Did you set the environment variable?"
         )
@@ -67,12 +119,151 @@ def send_user_ip_logs(
     response = logs_client.put_log_events(
         logGroupName=log_group_name,
         logStreamName=log_stream_name,
-        logEvents=[event],
+        # Events in a batch have to be in chronological order:
+        logEvents=sorted(events, key=lambda event: event["timestamp"]),
     )
 
     return response
 
 
+def _new_ip_items(events: list) -> dict[tuple, dict]:
+    """
+    {(username, ip_address, country_code): item} for IP events that weren't written
+    recently, keeping the newest of each.
+    """
+    # Newest first (queued order breaks ties), so repeats keep their latest one:
+    items = {}
+    used_keys = set()
+    for event in reversed(sorted(events, key=lambda event: event["timestamp"])):
+        message = json.loads(event["message"])
+        key = (message["username"], message["ip_address"], message["country_code"])
+        if key in items or key in _ip_history_recent:
+            continue
+        # (username, timestamp) is the history item key, don't overwrite another IP:
+        timestamp = event["timestamp"]
+        while (message["username"], timestamp) in used_keys:
+            timestamp -= 1
+        used_keys.add((message["username"], timestamp))
+        items[key] = {**message, "timestamp": timestamp}
+    return items
+
+
+def _put_ip_history(items: list[dict]) -> None:
+    with _get_ip_history_table().batch_writer() as batch:
+        for item in items:
+            expires_at = item["timestamp"] // 1000 + USER_IP_HISTORY_DAYS * 24 * 60 * 60
+            batch.put_item(Item={**item, "expires_at": expires_at})
+
+
+def get_user_ip_history(username: str, limit: int = 5) -> list[dict]:
+    """
+    The user's latest IP events, newest first, from one Query. Same shape as
+    `get_user_ip_logs` results.
+    """
+    response = _get_ip_history_table().query(
+        KeyConditionExpression=Key("username").eq(username),
+        ScanIndexForward=False,
+        Limit=limit,
+    )
+    return [
+        {
+            "@timestamp": datetime.datetime.fromtimestamp(
+                int(item["timestamp"]) / 1000, tz=datetime.timezone.utc
+            ).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "username": item["username"],
+            "ip_address": item["ip_address"],
+            "country_code": item["country_code"],
+            "access_roles": item["access_roles"],
+        }
+        for item in response.get("Items", [])
+    ]
+
+
+def _send_ip_history(events: list) -> None:
+    """Writes IP events to the history table and the IP index, skipping repeats."""
+    if not is_ip_history_enabled() and not is_ip_index_enabled():
+        return
+    # CloudWatch is the record, these are a convenience. Don't fail or retry for them:
+    try:
+        items = _new_ip_items(events)
+        if is_ip_history_enabled():
+            _put_ip_history(list(items.values()))
+        if is_ip_index_enabled():
+            record_ip_use(list(items.values()))
+    except Exception:
+        logger.exception("Could not write user IP history")
+        return
+    for key in items:
+        _ip_history_recent[key] = True
+
+
+def send_user_ip_logs(
+    username: str,
+    ip_address: str,
+    country_code: str,
+    access_roles: str,
+) -> dict:
+    """Sends one IP event right away. Prefer 'queue_user_ip_log' inside requests."""
+    event = _format_ip_log_event(username, ip_address, country_code, access_roles)
+    response = _put_ip_log_events([event])
+    _send_ip_history([event])
+    return response
+
+
+def queue_user_ip_log(
+    username: str,
+    ip_address: str,
+    country_code: str,
+    access_roles: str,
+) -> None:
+    """Buffers an IP event, to be sent by 'flush_user_ip_logs'."""
+    event = _format_ip_log_event(username, ip_address, country_code, access_roles)
+    with _ip_log_buffer_lock:
+        _ip_log_buffer.append(event)
+
+
+def _should_flush() -> bool:
+    if not _ip_log_buffer:
+        return False
+    if len(_ip_log_buffer) >= USER_IP_LOGS_BATCH_SIZE:
+        return True
+    oldest_age = time.time() - _ip_log_buffer[0]["timestamp"] / 1000
+    return oldest_age >= USER_IP_LOGS_MAX_AGE
+
+
+def flush_user_ip_logs(after_response: bool = True) -> int:
+    """
+    Sends buffered IP events in batches. Returns how many were sent.
+
+    after_response: If False, only flush once the size/age thresholds are hit.
+    """
+    with _ip_log_buffer_lock:
+        if not after_response and not _should_flush():
+            return 0
+        events = _ip_log_buffer[:]
+        _ip_log_buffer.clear()
+
+    sent = 0
+    for start in range(0, len(events), USER_IP_LOGS_BATCH_SIZE):
+        batch = events[start : start + USER_IP_LOGS_BATCH_SIZE]
+        try:
+            _put_ip_log_events(batch)
+        except Exception:
+            # Put the rest back to try again next time, up to a limit:
+            with _ip_log_buffer_lock:
+                _ip_log_buffer[:0] = events[start:]
+                del _ip_log_buffer[:-USER_IP_LOGS_MAX_BUFFER]
+            raise
+        sent += len(batch)
+    _send_ip_history(events)
+
+    logger.debug("Flushed %s user IP events", sent)
+    return sent
+
+
+register_post_response_hook(flush_user_ip_logs)
+
+
 def _consolidate_results(results: list) -> dict:
     """
     Reformat CloudWatch Query results into a more usuable format.
@@ -111,21 +302,35 @@ def _consolidate_results(results: list) -> dict:
     return all_results
 
 
-def get_user_ip_logs(
+def get_recent_user_ips(username: str, limit: int = 5) -> list[dict]:
+    """From the history table if there is one, otherwise an Insights query."""
+    if is_ip_history_enabled():
+        return get_user_ip_history(username, limit=limit)
+    return get_user_ip_logs(username=username, limit=limit)
+
+
+## Insights queries by (query, start, end). Repeated lookups reuse the running or
+#  finished query instead of starting another one:
+IP_LOGS_QUERY_CACHE = TTLCache(maxsize=100, ttl=5 * 60)
+# query_id -> (query, start, end), for queries started by this container:
+_ip_logs_query_keys = TTLCache(maxsize=100, ttl=15 * 60)
+INSIGHTS_DONE_STATUSES = ("Cancelled", "Complete", "Failed", "Timeout", "Unknown")
+# Seconds between polls, from the first to the most:
+IP_LOGS_POLL_MIN = 0.1
+IP_LOGS_POLL_MAX = 1.0
+# Range for how long async callers are told to wait, before asking again:
+IP_LOGS_RETRY_MIN = 0.5
+IP_LOGS_RETRY_MAX = 5.0
+
+
+def _ip_logs_query(
     username: str = None,
     start_date: str | datetime.datetime = None,
     end_date: str | datetime.datetime = None,
     limit: int = None,
     query_override: str = None,
-) -> dict:
-    """
-    username: string. Username to filter query by.
-    start_time: datetime object or string in ISO 8601 format. Start of query time.
-    end_time: datetime object or string in ISO 8601 format. End of query time.
-    limit: int between 0-10,000. Number of results rows to return.
-    query_override: string. Query to run. Args username and limit are ignored. Useful mainly when fields cannot be indexed.
-    """
-
+) -> tuple[str, int, int]:
+    """The (query, start, end) for `get_user_ip_logs` arguments."""
     username_filter = ""
     if username:
         # If username has wrapped in quotes it will break the query. So strip any quotes.
@@ -156,17 +361,29 @@ def get_user_ip_logs(
         start_date = datetime.datetime.fromisoformat(start_date.strip('"').strip("'"))
 
     if not end_date:
-        # End query 5 minutes into the future to guarantee that all results are returned.
-        end_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
-            minutes=5
+        # End query 5-10 minutes into the future to guarantee that all results are
+        # returned. (On a 5 minute boundary, so lookups in between share a query.)
+        now = int(time.time())
+        end_date = datetime.datetime.fromtimestamp(
+            now - now % 300 + 600, tz=datetime.timezone.utc
         )
 
     if not start_date:
         # Default start time is 30 days in the past from now
         start_date = end_date - datetime.timedelta(days=30)
 
-    end_date_int = int(end_date.timestamp())
-    start_date_int = int(start_date.timestamp())
+    return query, int(start_date.timestamp()), int(end_date.timestamp())
+
+
+def start_user_ip_logs_query(**kwargs) -> dict:
+    """
+    Starts an Insights query (same arguments as `get_user_ip_logs`), unless the same
+    one is already running or finished. Returns {"query_id", "started_at"}, plus
+    "status" and "results" if it's already finished.
+    """
+    key = _ip_logs_query(**kwargs)
+    if key in IP_LOGS_QUERY_CACHE:
+        return IP_LOGS_QUERY_CACHE[key]
 
     logs_client = _get_logs_client()
 
@@ -178,6 +395,7 @@ def get_user_ip_logs(
             "User Activity Log Group or Stream not defined. Did you set the environment variable?"
         )
 
+    query, start_date_int, end_date_int = key
     # https://boto3.amazonaws.com/v1/documentation/api/1.26.82/reference/services/logs/client/start_query.html
     start_query_response = logs_client.start_query(
         logGroupName=log_group_name,
@@ -187,26 +405,81 @@ def get_user_ip_logs(
     )
 
     query_id = start_query_response["queryId"]
+    IP_LOGS_QUERY_CACHE[key] = {"query_id": query_id, "started_at": time.time()}
+    _ip_logs_query_keys[query_id] = key
+    return IP_LOGS_QUERY_CACHE[key]
+
 
-    response = {}
+def poll_user_ip_logs_query(query_id: str) -> dict:
+    """
+    {"status", "complete", "results"} for an Insights query. While it's still running,
+    "results" are whatever it has found so far.
+    """
+    # https://boto3.amazonaws.com/v1/documentation/api/1.26.82/reference/services/logs/client/get_query_results.html
+    response = _get_logs_client().get_query_results(queryId=query_id)
+    status = response.get("status", "Unknown")
+    results = _consolidate_results(response.get("results", []))
+    complete = status in INSIGHTS_DONE_STATUSES
+
+    # Finished queries this container started are kept, for the next lookup:
+    key = _ip_logs_query_keys.get(query_id)
+    if status == "Complete" and key in IP_LOGS_QUERY_CACHE:
+        IP_LOGS_QUERY_CACHE[key] = {
+            **IP_LOGS_QUERY_CACHE[key],
+            "status": status,
+            "results": results,
+        }
+    elif complete:
+        # Failed or cancelled, let the next lookup start over:
+        IP_LOGS_QUERY_CACHE.pop(key, None)
+    return {"status": status, "complete": complete, "results": results}
+
+
+def suggested_retry_after(started_at: float) -> float:
+    """Seconds to wait before polling again: longer the longer a query has run."""
+    elapsed = time.time() - started_at
+    return round(min(max(elapsed / 2, IP_LOGS_RETRY_MIN), IP_LOGS_RETRY_MAX), 1)
 
-    while response.get("status", None) not in [
-        "Cancelled",
-        "Complete",
-        "Failed",
-        "Timeout",
-        "Unknown",
-    ]:
-        time.sleep(1)
-        # https://boto3.amazonaws.com/v1/documentation/api/1.26.82/reference/services/logs/client/get_query_results.html
-        response = logs_client.get_query_results(queryId=query_id)
 
-    results = response["results"]
+def get_user_ip_logs(
+    username: str = None,
+    start_date: str | datetime.datetime = None,
+    end_date: str | datetime.datetime = None,
+    limit: int = None,
+    query_override: str = None,
+) -> dict:
+    """
+    username: string. Username to filter query by.
+    start_time: datetime object or string in ISO 8601 format. Start of query time.
+    end_time: datetime object or string in ISO 8601 format. End of query time.
+    limit: int between 0-10,000. Number of results rows to return.
+    query_override: string. Query to run. Args username and limit are ignored. Useful mainly when fields cannot be indexed.
+
+    Blocks until the query finishes, see `start_user_ip_logs_query` to not.
+    """
+    query = start_user_ip_logs_query(
+        username=username,
+        start_date=start_date,
+        end_date=end_date,
+        limit=limit,
+        query_override=query_override,
+    )
+
+    if "results" in query:
+        results = query["results"]
+    else:
+        # Most queries finish in well under a second, don't always wait one:
+        delay = IP_LOGS_POLL_MIN
+        while True:
+            time.sleep(delay)
+            response = poll_user_ip_logs_query(query["query_id"])
+            if response["complete"]:
+                break
+            delay = min(delay * 2, IP_LOGS_POLL_MAX)
+        results = response["results"]
 
     if not results:
-        logger.warning(
-            f"No results returned. Are you sure the query '{query}' is correct?"
-        )
+        logger.warning(f"No results returned for query '{query['query_id']}'")
         return []
 
-    return _consolidate_results(results)
+    return results
@@ -24,6 +24,9 @@ from aws_cdk import (
     aws_iam as iam,
     aws_secretsmanager as secretsmanager,
     aws_logs as logs,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    triggers,
     SecretValue,
 )
 from aws_solutions_constructs.aws_lambda_dynamodb import LambdaToDynamoDB
@@ -112,6 +115,13 @@ class PortalCdkStack(Stack):
                     ).lower(),
                     "SES_EMAIL": str(os.getenv("SES_EMAIL")),
                     "SES_DOMAIN": str(os.getenv("SES_DOMAIN")),
+                    # Once the user migrations have run (lambda_main/migrate.py):
+                    "EMAIL_INDEX_BACKFILLED": str(
+                        os.getenv("EMAIL_INDEX_BACKFILLED", "false").lower() == "true"
+                    ).lower(),
+                    "FACET_INDEX_BACKFILLED": str(
+                        os.getenv("FACET_INDEX_BACKFILLED", "false").lower() == "true"
+                    ).lower(),
                 },
             ),
             # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_dynamodb.TableProps.html
@@ -133,6 +143,90 @@ class PortalCdkStack(Stack):
         lambda_dynamo.lambda_function.add_environment(
             "DYNAMO_TABLE_NAME", lambda_dynamo.dynamo_table.table_name
         )
+        ## User table GSIs, oldest first. DynamoDB only adds one GSI per update, so a
+        #  new table gets them all, but an existing one needs a deploy per new index
+        #  with USER_TABLE_INDEXES set to how many to have, see "User Table Indexes"
+        #  in the top level README. The construct's table grant covers them all.
+        user_table_indexes = [
+            # Sparse, only users with a country_code. For compliance sweeps, so they
+            # only read the users in countries that changed (util/labs/compliance.py).
+            dict(
+                index_name="country_code-index",
+                partition_key=dynamodb.Attribute(
+                    name="country_code",
+                    type=dynamodb.AttributeType.STRING,
+                ),
+                projection_type=dynamodb.ProjectionType.ALL,
+            ),
+            # Sparse, only users that logged in since it was added (or were backfilled).
+            # Month buckets of last login, for inactive user sweeps
+            # (util/user/activity.py):
+            dict(
+                index_name="activity_bucket-index",
+                partition_key=dynamodb.Attribute(
+                    name="activity_bucket",
+                    type=dynamodb.AttributeType.STRING,
+                ),
+                sort_key=dynamodb.Attribute(
+                    name="last_activity",
+                    type=dynamodb.AttributeType.NUMBER,
+                ),
+                projection_type=dynamodb.ProjectionType.KEYS_ONLY,
+            ),
+            # Lower-cased email -> username, kept in sync by User (util/user/user.py):
+            dict(
+                index_name="email_normalized-index",
+                partition_key=dynamodb.Attribute(
+                    name="email_normalized",
+                    type=dynamodb.AttributeType.STRING,
+                ),
+                projection_type=dynamodb.ProjectionType.KEYS_ONLY,
+            ),
+            # Sparse, the users page filters (FACETS in util/user/indexed.py). One index
+            # for every facet, keyed on each user's combination, like "admin#locked":
+            dict(
+                index_name="facet_key-index",
+                partition_key=dynamodb.Attribute(
+                    name="facet_key",
+                    type=dynamodb.AttributeType.STRING,
+                ),
+                sort_key=dynamodb.Attribute(
+                    name="username",
+                    type=dynamodb.AttributeType.STRING,
+                ),
+                projection_type=dynamodb.ProjectionType.ALL,
+            ),
+        ]
+        user_table_index_count = int(
+            os.getenv("USER_TABLE_INDEXES") or len(user_table_indexes)
+        )
+        for index in user_table_indexes[:user_table_index_count]:
+            lambda_dynamo.dynamo_table.add_global_secondary_index(**index)
+
+        ## Backfills for attributes added after users existed (lambda_main/migrate.py).
+        # Not scheduled, invoked by hand after a deploy that adds one:
+        lambda_user_migrations = aws_lambda.Function(
+            self,
+            "LambdaUserMigrations",
+            code=aws_lambda.Code.from_asset("lambda_main"),
+            description=f"User table backfills, run by hand ({construct_id})",
+            runtime=LAMBDA_RUNTIME,
+            handler="migrate.lambda_handler",
+            layers=[powertools_layer, requirements_layer],
+            timeout=Duration.minutes(15),
+            environment={
+                "POWERTOOLS_SERVICE_NAME": "USER_MIGRATIONS",
+                "STACK_REGION": self.region,
+                "DYNAMO_TABLE_NAME": lambda_dynamo.dynamo_table.table_name,
+            },
+        )
+        lambda_dynamo.dynamo_table.grant_read_write_data(lambda_user_migrations)
+        CfnOutput(
+            self,
+            "UserMigrationsFunction",
+            value=lambda_user_migrations.function_name,
+            description="Invoke with {'migration': <name>}, see lambda_main/migrate.py",
+        )
 
         ### Integration is after the request is validated:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_apigatewayv2_integrations.HttpLambdaIntegration.html
@@ -185,6 +279,43 @@ class PortalCdkStack(Stack):
             destination_bucket=error_bucket,
             content_type="text/html",
             content_disposition="inline",
+            # Don't prune the static assets deployed below, or the prerendered pages:
+            exclude=["static/*", "prerendered/*"],
+        )
+
+        ## Static assets, served straight from the bucket under /static/*
+        # Fingerprinted copies from `make build-static` (lambda_main/static/build.py).
+        # Their names change with their content, so they can be cached forever:
+        static_build_dir = "./lambda_main/static_build/static"
+        if not os.path.isdir(static_build_dir):
+            # Source.asset's own error doesn't say how to fix it:
+            raise FileNotFoundError(
+                f"{static_build_dir} doesn't exist. Run `make build-static` first, "
+                "or synth/deploy with `make synth-portal`/`make deploy-portal`."
+            )
+        s3deploy.BucketDeployment(
+            self,
+            "DeployFingerprintedStatic",
+            sources=[s3deploy.Source.asset(static_build_dir)],
+            destination_bucket=error_bucket,
+            destination_key_prefix="static/",
+            # Pages cached in browsers can still ask for the last deploy's files:
+            prune=False,
+            cache_control=[
+                s3deploy.CacheControl.from_string("public, max-age=31536000, immutable")
+            ],
+        )
+        # The originals too, for anything that doesn't go through static_url
+        # (like relative font/image URLs inside the CSS):
+        s3deploy.BucketDeployment(
+            self,
+            "DeployStatic",
+            sources=[s3deploy.Source.asset("./lambda_main/static")],
+            destination_bucket=error_bucket,
+            destination_key_prefix="static/",
+            exclude=["html/*", "*.py", "__pycache__/*", "*.md"],
+            prune=False,
+            cache_control=[s3deploy.CacheControl.from_string("public, max-age=3600")],
         )
 
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudfront.Distribution.html
@@ -214,6 +345,16 @@ class PortalCdkStack(Stack):
                     cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
                     response_headers_policy=cloudfront.ResponseHeadersPolicy.CORS_ALLOW_ALL_ORIGINS_WITH_PREFLIGHT,
                 ),
+                # Never reaches the Lambda. Cache-Control comes from the deployments above:
+                "/static/*": cloudfront.BehaviorOptions(
+                    origin=origins.S3Origin(error_bucket),
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                    cache_policy=cloudfront.CachePolicy.CACHING_OPTIMIZED,
+                    # gzip/brotli at the edge:
+                    compress=True,
+                    response_headers_policy=cloudfront.ResponseHeadersPolicy.CORS_ALLOW_ALL_ORIGINS,
+                ),
             },
             error_responses=[
                 cloudfront.ErrorResponse(
@@ -239,6 +380,88 @@ class PortalCdkStack(Stack):
             else portal_cloudfront.distribution_domain_name
         )
 
+        ## Anonymous pages, prerendered into the error bucket (lambda_main/util/pages.py)
+        # {path: object}, has to match ANONYMOUS_PAGES and PRERENDER_PREFIX:
+        prerendered_pages = {
+            "/": "/prerendered/index.html",
+            "/error": "/prerendered/error.html",
+            "/mfa": "/prerendered/mfa.html",
+            "/mfa/": "/prerendered/mfa.html",
+        }
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudfront.Function.html
+        anonymous_pages_function = cloudfront.Function(
+            self,
+            "AnonymousPagesFunction",
+            comment=f"Serve prerendered pages to anonymous visitors ({construct_id})",
+            runtime=cloudfront.FunctionRuntime.JS_2_0,
+            code=cloudfront.FunctionCode.from_inline(
+                f"""
+var PAGES = {json.dumps(prerendered_pages)};
+
+function handler(event) {{
+    var request = event.request;
+    // Same as the Lambda's '/' route: logged in users go on to the portal, which
+    // validates the cookie (and sends them back here without it if it's bad).
+    if (request.uri === "/" && request.cookies["portal-jwt"]) {{
+        return {{
+            statusCode: 302,
+            statusDescription: "Found",
+            headers: {{ location: {{ value: "/portal" }} }},
+        }};
+    }}
+    request.uri = PAGES[request.uri] || request.uri;
+    return request;
+}}
+"""
+            ),
+        )
+        # S3 answers with a 200, put back the status the Lambda would've used.
+        # {path: status}, has to match ANONYMOUS_PAGE_STATUS:
+        prerendered_status = {"/error": 401}
+        for path_pattern in prerendered_pages:
+            function_associations = [
+                cloudfront.FunctionAssociation(
+                    function=anonymous_pages_function,
+                    event_type=cloudfront.FunctionEventType.VIEWER_REQUEST,
+                )
+            ]
+            if path_pattern in prerendered_status:
+                status = prerendered_status[path_pattern]
+                status_function = cloudfront.Function(
+                    self,
+                    f"PrerenderedStatus{status}Function",
+                    comment=f"Serve prerendered pages as a {status} ({construct_id})",
+                    runtime=cloudfront.FunctionRuntime.JS_2_0,
+                    code=cloudfront.FunctionCode.from_inline(
+                        f"""
+function handler(event) {{
+    var response = event.response;
+    // Leave 304s (and S3 errors) alone:
+    if (response.statusCode === 200) {{
+        response.statusCode = {status};
+    }}
+    return response;
+}}
+"""
+                    ),
+                )
+                function_associations.append(
+                    cloudfront.FunctionAssociation(
+                        function=status_function,
+                        event_type=cloudfront.FunctionEventType.VIEWER_RESPONSE,
+                    )
+                )
+            portal_cloudfront.add_behavior(
+                path_pattern=path_pattern,
+                origin=origins.S3Origin(error_bucket),
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                # Cookies and '?return=' are handled before the cache, by the function:
+                cache_policy=cloudfront.CachePolicy.CACHING_OPTIMIZED,
+                compress=True,
+                function_associations=function_associations,
+            )
+
         crypto_remediation_arns = []
         # Loop over Labs and add proxy behaviors
         for lab in LABS.values():
@@ -320,6 +543,124 @@ class PortalCdkStack(Stack):
             "USER_IP_LOGS_STREAM_NAME", user_ip_log_stream.log_stream_name
         )
 
+        ## Each user's recent IPs, written next to the log events above, so profile
+        #  pages don't have to wait on an Insights query:
+        user_ip_history_table = dynamodb.Table(
+            self,
+            "UserIpHistoryTable",
+            partition_key=dynamodb.Attribute(
+                name="username",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            sort_key=dynamodb.Attribute(
+                name="timestamp",
+                type=dynamodb.AttributeType.NUMBER,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            # The log group is the long-term record, this is just recent history:
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        user_ip_history_table.grant_read_write_data(lambda_dynamo.lambda_function)
+        lambda_dynamo.lambda_function.add_environment(
+            "USER_IP_HISTORY_TABLE_NAME", user_ip_history_table.table_name
+        )
+        ## And the other way around: who used an IP or subnet (util/user_ip_index.py)
+        user_ip_index_table = dynamodb.Table(
+            self,
+            "UserIpIndexTable",
+            partition_key=dynamodb.Attribute(
+                name="address",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            sort_key=dynamodb.Attribute(
+                name="username",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        user_ip_index_table.grant_read_write_data(lambda_dynamo.lambda_function)
+        lambda_dynamo.lambda_function.add_environment(
+            "USER_IP_INDEX_TABLE_NAME", user_ip_index_table.table_name
+        )
+
+        ## Lab Health Monitor
+        # Checks every lab once a minute, so portal pages don't have to.
+        lab_health_table = dynamodb.Table(
+            self,
+            "LabHealthTable",
+            partition_key=dynamodb.Attribute(
+                name="lab",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            sort_key=dynamodb.Attribute(
+                name="checked_at",
+                type=dynamodb.AttributeType.NUMBER,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            # History items clean themselves up:
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        lambda_health_monitor = aws_lambda.Function(
+            self,
+            "LambdaLabHealthMonitor",
+            code=aws_lambda.Code.from_asset("lambda_main"),
+            description=f"Scheduled lab health checks ({construct_id})",
+            runtime=LAMBDA_RUNTIME,
+            handler="health_monitor.lambda_handler",
+            layers=[powertools_layer, requirements_layer],
+            timeout=Duration.seconds(30),
+            environment={
+                "POWERTOOLS_SERVICE_NAME": "LAB_HEALTH",
+                "IS_PROD": str(os.getenv("IS_PROD", "false").lower() == "true").lower(),
+                "STACK_REGION": self.region,
+                "LAB_HEALTH_TABLE_NAME": lab_health_table.table_name,
+            },
+        )
+        lab_health_table.grant_read_write_data(lambda_health_monitor)
+
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events.Rule.html
+        events.Rule(
+            self,
+            "LabHealthMonitorSchedule",
+            description=f"Run the lab health monitor ({construct_id})",
+            schedule=events.Schedule.rate(Duration.minutes(1)),
+            targets=[events_targets.LambdaFunction(lambda_health_monitor)],
+        )
+
+        # The portal only ever reads the status item and history:
+        lab_health_table.grant_read_data(lambda_dynamo.lambda_function)
+        lambda_dynamo.lambda_function.add_environment(
+            "LAB_HEALTH_TABLE_NAME", lab_health_table.table_name
+        )
+
+        ## Lab Catalog
+        # LABS as a versioned document, editable without a deploy (util/labs/catalog.py)
+        lab_catalog_table = dynamodb.Table(
+            self,
+            "LabCatalogTable",
+            partition_key=dynamodb.Attribute(
+                name="catalog",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            point_in_time_recovery=True,
+            removal_policy=RemovalPolicy.RETAIN,
+        )
+        # Admins edit it through the portal:
+        lab_catalog_table.grant_read_write_data(lambda_dynamo.lambda_function)
+        lambda_dynamo.lambda_function.add_environment(
+            "LAB_CATALOG_TABLE_NAME", lab_catalog_table.table_name
+        )
+        lab_catalog_table.grant_read_data(lambda_health_monitor)
+        lambda_health_monitor.add_environment(
+            "LAB_CATALOG_TABLE_NAME", lab_catalog_table.table_name
+        )
+
         ## Our Email Identity in SES:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ses.EmailIdentity.html
         # The domain must be verified in SES
@@ -548,6 +889,17 @@ class PortalCdkStack(Stack):
             description=f"({construct_id}) SSO Token required to communicate with Labs",
         )
 
+        # Ed25519 private key (PEM) the portal signs lab tokens with. Generate with:
+        #   openssl genpkey -algorithm ed25519
+        lab_token_secret = secretsmanager.Secret(
+            self,
+            f"Lab-Token-Key-{vars['deploy_prefix'].title()}",
+            secret_string_value=SecretValue.unsafe_plain_text(
+                "Change me to an Ed25519 private key PEM"
+            ),
+            description=f"({construct_id}) Key used to sign lab access tokens",
+        )
+
         lambda_dynamo.lambda_function.add_environment("STACK_REGION", self.region)
 
         lambda_dynamo.lambda_function.add_environment(
@@ -590,6 +942,36 @@ class PortalCdkStack(Stack):
         # Grant lambda permssion to read secret manager
         sso_token_secret.grant_read(lambda_dynamo.lambda_function)
 
+        lambda_dynamo.lambda_function.add_environment(
+            "LAB_TOKEN_SECRET_NAME", lab_token_secret.secret_name
+        )
+        lab_token_secret.grant_read(lambda_dynamo.lambda_function)
+
+        ## Renders the anonymous pages into the error bucket, on every deploy
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.triggers.TriggerFunction.html
+        prerender_function = triggers.TriggerFunction(
+            self,
+            "LambdaPrerenderPages",
+            code=aws_lambda.Code.from_asset("lambda_main"),
+            description=f"Prerender anonymous portal pages ({construct_id})",
+            runtime=LAMBDA_RUNTIME,
+            handler="prerender.lambda_handler",
+            layers=[powertools_layer, requirements_layer],
+            timeout=Duration.seconds(30),
+            # Code (and so template) changes re-render the pages:
+            execute_on_handler_change=True,
+            environment={
+                "POWERTOOLS_SERVICE_NAME": "PRERENDER",
+                "STACK_REGION": self.region,
+                "DEPLOYMENT_HOSTNAME": primary_host,
+                "COGNITO_CLIENT_ID": user_pool_client.user_pool_client_id,
+                "COGNITO_POOL_ID": user_pool.user_pool_id,
+                "COGNITO_DOMAIN_ID": user_pool_domain.domain_name,
+                "PRERENDER_BUCKET_NAME": error_bucket.bucket_name,
+            },
+        )
+        error_bucket.grant_put(prerender_function)
+
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.CfnOutput.html
         CfnOutput(
             self,
@@ -630,6 +1012,13 @@ class PortalCdkStack(Stack):
             description="ARN of SSO Token",
         )
 
+        CfnOutput(
+            self,
+            "LAB-TOKEN-KEY-ARN",
+            value=lab_token_secret.secret_full_arn,
+            description="ARN of the lab token signing key",
+        )
+
         CfnOutput(
             self,
             "return-path-whitelist-value",